@@ -0,0 +1,161 @@
+"""Microbenchmarks of the bibliography path.
+
+Times each stage of :func:`pndconf.bibliography.generate_bibtex`, each
+transform in :mod:`pndconf.transforms` both per entry and in batch, composed
+transform chains, the LTWA index and building the commands for a pdf with
+bibtex. Pandoc is replaced by :code:`benchmarks/stubs/pandoc` so that it
+runs offline.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_bibliography --sizes 1000,10000
+    python -m benchmarks.bench_bibliography --baseline benchmarks/baseline_bibliography.json
+
+"""
+from typing import Dict, List
+import io
+import os
+import shutil
+import argparse
+import tempfile
+import contextlib
+from pathlib import Path
+
+from bibtexparser import bparser
+
+from pndconf import bibliography, transforms
+from pndconf.config import Configuration
+from pndconf.csl import references_to_entries
+from pndconf.util import read_md_file_with_header, write_if_changed
+
+from .common import measure, add_common_args, finish, stubs_dir, benchmarks_dir
+from .synthetic import write_corpus, write_ltwa, title_words
+
+
+transform_names = ["normalize", "standardize_venue", "contract_venue",
+                   "change_to_title_case", "abbreviate_venue", "date_to_year_month",
+                   "remove_url", "remove_keys(file:doi)"]
+
+chains = {"default": bibliography.default_transforms,
+          "venue": ["abbreviate_venue", "change_to_title_case", "standardize_venue",
+                    "normalize"],
+          "all": transform_names}
+
+
+def bench_generate_bibtex(work_dir: Path, size: int, repeat: int) -> Dict[str, float]:
+    md_file, bib_file, keys = write_corpus(work_dir, size)
+    text, metadata = read_md_file_with_header(md_file)
+    metadata["bibliography"] = str(bib_file)
+    raw = bibliography.split_bib_files([str(bib_file)])
+    bibs = [raw[k] for k in keys if k in raw]
+    entries = bibliography.bibtex_parser().parse("\n".join(bibs)).entries
+    transform = bibliography.compose_batch_transforms(chains["venue"])
+    out = bibliography.transform_bibtex(entries, transform)
+    out_file = work_dir.joinpath("out.bib")
+    service = bibliography.BibliographyService()
+
+    def generate(service=None):
+        bibliography.generate_bibtex(md_file, dict(metadata), "bibtex", text,
+                                     chains["venue"], service=service)
+
+    def write(_):
+        out_file.unlink(missing_ok=True)
+        write_if_changed(out_file, "".join(out))
+
+    prefix = f"generate_bibtex.{size}"
+    return {f"{prefix}.cited_keys": measure(lambda: bibliography.cited_keys(text), repeat),
+            f"{prefix}.split": measure(lambda: bibliography.split_bib_files([str(bib_file)]),
+                                       repeat),
+            f"{prefix}.parse": measure(lambda: bparser.BibTexParser(common_strings=True).
+                                       parse("\n".join(bibs)), repeat),
+            f"{prefix}.inline_references": measure(
+                lambda: references_to_entries(metadata["references"], "bibtex"), repeat),
+            f"{prefix}.transform": measure(lambda: bibliography.transform_bibtex(
+                entries, transform), repeat),
+            f"{prefix}.write": measure(write, repeat, setup=lambda: None),
+            f"{prefix}.total_cold": measure(generate, repeat),
+            f"{prefix}.total_warm": measure(lambda: generate(service), repeat)}
+
+
+def bench_transforms(bib_file: Path, size: int, repeat: int) -> Dict[str, float]:
+    entries = bparser.BibTexParser(common_strings=True).parse(bib_file.read_text()).entries
+    results = {}
+
+    def copies():
+        return [x.copy() for x in entries]
+
+    for name in transform_names:
+        single = bibliography.compose_transforms([name])
+        batch = bibliography.compose_batch_transforms([name])
+        results[f"transforms.{size}.{name}.single"] =\
+            measure(lambda ents: [single(x) for x in ents], repeat, setup=copies)
+        results[f"transforms.{size}.{name}.batch"] = measure(batch, repeat, setup=copies)
+    for chain, names in chains.items():
+        results[f"chains.{size}.{chain}.compose"] =\
+            measure(lambda: bibliography.compose_transforms(names), repeat)
+        single = bibliography.compose_transforms(names)
+        batch = bibliography.compose_batch_transforms(names)
+        results[f"chains.{size}.{chain}.single"] =\
+            measure(lambda ents: [single(x) for x in ents], repeat, setup=copies)
+        results[f"chains.{size}.{chain}.batch"] = measure(batch, repeat, setup=copies)
+    return results
+
+
+def bench_abbrevs(work_dir: Path, repeat: int) -> Dict[str, float]:
+    ltwa = write_ltwa(work_dir.joinpath("ltwa.csv"))
+    cache = Path(os.environ["XDG_CACHE_HOME"]).joinpath("pndconf", "abbrevs")
+
+    def clear_cache():
+        shutil.rmtree(cache, ignore_errors=True)
+
+    index = transforms.load_abbrevs(ltwa)
+    words = [*title_words, *[w.capitalize() for w in title_words], "unknownword"] * 20
+
+    def lookup(_):
+        for w in words:
+            transforms.get_abbrev(index, w)
+
+    return {"abbrevs.load_cold": measure(lambda _: transforms.load_abbrevs(ltwa), repeat,
+                                         setup=clear_cache),
+            "abbrevs.load_cached": measure(lambda: transforms.load_abbrevs(ltwa), repeat),
+            "abbrevs.get_abbrev": measure(lookup, repeat, setup=index.lookup.cache_clear),
+            "abbrevs.get_abbrev_cached": measure(lambda: lookup(None), repeat)}
+
+
+def bench_commands(work_dir: Path, size: int, repeat: int) -> Dict[str, float]:
+    md_file, _, _ = write_corpus(work_dir, size)
+    config = Configuration(None, work_dir, config_file=benchmarks_dir.parent.
+                           joinpath("tests", "config.ini"),
+                           pandoc_path=stubs_dir.joinpath("pandoc"),
+                           pandoc_version="2.14.2", no_citeproc=True)
+    config._filetypes = ["pdf"]
+    config.update_generation_options(["pdf"], [])
+    with contextlib.redirect_stdout(io.StringIO()):
+        return {f"commands.{size}.pdf_bibtex": measure(
+            lambda: config.get_commands(str(md_file)), repeat)}
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000",
+                        help="Comma separated sizes of the synthetic bibliographies")
+    parser.add_argument("--work-dir", default="",
+                        help="Directory for the synthetic files. A temporary one if not given")
+    add_common_args(parser, "benchmarks/results/bibliography.json")
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["XDG_CACHE_HOME"] = str(Path(tmp).joinpath("cache"))
+        work_dir = Path(args.work_dir or tmp).absolute()
+        results: Dict[str, float] = {}
+        for size in map(int, args.sizes.split(",")):
+            bib_file = write_corpus(work_dir, size)[1]
+            results.update(bench_generate_bibtex(work_dir, size, args.repeat))
+            results.update(bench_transforms(bib_file, size, args.repeat))
+            results.update(bench_commands(work_dir, size, args.repeat))
+        results.update(bench_abbrevs(work_dir, args.repeat))
+    finish(args, results)
+
+
+if __name__ == "__main__":
+    main()
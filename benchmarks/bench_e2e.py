@@ -0,0 +1,289 @@
+"""End to end build benchmarks with a fake pandoc and TeX toolchain.
+
+Runs pndconf as a separate process on a generated corpus with the stub
+:code:`pandoc`, :code:`pdflatex`, :code:`bibtex` and :code:`biber` from
+:code:`benchmarks/stubs`, whose latency and output volume are set with
+environment variables (see :code:`benchmarks/stubs/_common.sh`). This
+isolates the overhead of pndconf itself: header parsing, option resolution,
+building the commands, spawning processes and parsing their output.
+
+For each of a :code:`convert` run and a scripted :code:`watch` session it
+reports the wall time, the CPU time of the pndconf process alone and with
+the commands it ran, the number of processes spawned and the peak RSS of
+pndconf.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_e2e --docs 20 --bib-size 5000 --latency 0.05
+    python -m benchmarks.bench_e2e --mode watch --edits 6 --edit-interval 3.5
+
+"""
+from typing import Dict, List, Optional
+import os
+import sys
+import json
+import time
+import random
+import signal
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+from .common import add_common_args, finish, stubs_dir, benchmarks_dir
+from .synthetic import generate_bib, make_title, title_words
+
+
+def write_documents(directory: Path, num_docs: int, paragraphs: int, header_keys: int,
+                    bib_size: int, num_cited: int = 50, seed: int = 0) -> List[Path]:
+    """Write a corpus of markdown documents sharing a bibliography.
+
+    Args:
+        directory: Directory to write to
+        num_docs: Number of documents
+        paragraphs: Number of paragraphs in each document
+        header_keys: Number of extra keys in the yaml header. Every other key
+                     is nested and every fourth one adds an inline reference.
+        bib_size: Number of entries in the bibliography
+        num_cited: Number of citations in each document
+        seed: Seed for the random generator
+
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    rand = random.Random(seed)
+    bib_file = directory.joinpath("library.bib")
+    bib_file.write_text(generate_bib(bib_size, seed))
+    docs = []
+    for i in range(num_docs):
+        header = ["---", f"title: Document {i}", "author:",
+                  "- Some Author", "- Another Author", "date: 2021-01-01",
+                  f"bibliography: {bib_file.absolute()}", "link-citations: true"]
+        refs = []
+        for j in range(header_keys):
+            if j % 4 == 3:
+                refs.extend([f"- id: inline{i}x{j}", "  type: article-journal",
+                             f"  title: {json.dumps(make_title(rand))}",
+                             "  container-title: Some Journal",
+                             "  author:", "  - family: Person", "    given: Some",
+                             "  issued: 2020-06"])
+            elif j % 2:
+                header.extend([f"meta{j}:", f"  name: value {j}",
+                               "  items:", "  - one", "  - two"])
+            else:
+                header.append(f"meta{j}: {rand.choice(title_words)}")
+        if refs:
+            header.extend(["references:", *refs])
+        header.append("---")
+        keys = [f"key{k}" for k in rand.sample(range(bib_size), min(num_cited, bib_size))]
+        body = []
+        for p in range(paragraphs):
+            words = " ".join(rand.choice(title_words) for _ in range(60))
+            cites = "; ".join(f"@{k}" for k in keys[p::paragraphs]) if keys else ""
+            body.append(f"{words.capitalize()} [{cites}]." if cites else f"{words}.")
+        md_file = directory.joinpath(f"doc{i}.md")
+        md_file.write_text("\n".join(header) + "\n\n# Section\n\n" + "\n\n".join(body) + "\n")
+        docs.append(md_file)
+    return docs
+
+
+def write_config(directory: Path) -> Path:
+    """Write a pndconf config for generating pdf via pdflatex and bibtex
+
+    Args:
+        directory: Directory to write to
+
+    The pdf section outputs "tex", so that pndconf runs the pdflatex and
+    bibtex commands itself instead of pandoc running the pdf engine.
+
+    """
+    config_file = directory.joinpath("config.ini")
+    config_file.write_text("""[pdf]
+-r : markdown+simple_tables+table_captions+yaml_metadata_block+raw_tex+raw_attribute
+-w : latex
+-s :
+--pdf-engine : pdflatex
+-o : tex
+
+[html]
+-r : markdown+simple_tables+table_captions+yaml_metadata_block+raw_html
+-w : html
+-s :
+-o : html
+
+[options]
+transforms : normalize,change_to_title_case,standardize_venue
+same_pdf_output_dir :
+""")
+    return config_file
+
+
+def stub_env(log_file: Path, args: argparse.Namespace) -> Dict[str, str]:
+    env = os.environ.copy()
+    env["PATH"] = f"{stubs_dir}{os.pathsep}{env.get('PATH', '')}"
+    env["PYTHONPATH"] = str(benchmarks_dir.parent)
+    env["PNDCONF_STUB_LOG"] = str(log_file)
+    env["PNDCONF_STUB_LATENCY"] = str(args.latency)
+    env["PNDCONF_STUB_OUTPUT"] = str(args.output_bytes)
+    env["PNDCONF_STUB_PANDOC_FILE_BYTES"] = str(args.file_bytes)
+    return env
+
+
+def pndconf_command(stats_file: Path, config_file: Path, args: List[str]) -> List[str]:
+    return [sys.executable, "-m", "benchmarks.run_pndconf", str(stats_file),
+            "--pandoc-path", str(stubs_dir.joinpath("pandoc")), "-c", str(config_file),
+            *args]
+
+
+def stub_calls(log_file: Path) -> Dict[str, int]:
+    "Return the number of invocations of each stub"
+    calls: Dict[str, int] = {}
+    if log_file.exists():
+        for line in log_file.read_text().splitlines():
+            tool = line.split(" ", 1)[0]
+            calls[tool] = calls.get(tool, 0) + 1
+    return calls
+
+
+def usage_results(name: str, wall: float, rusage, stats_file: Path,
+                  log_file: Path) -> Dict[str, float]:
+    with open(stats_file) as f:
+        stats = json.load(f)
+    calls = stub_calls(log_file)
+    results = {f"{name}.wall": wall,
+               f"{name}.cpu": stats["cpu"],
+               f"{name}.cpu_total": rusage.ru_utime + rusage.ru_stime,
+               f"{name}.processes": float(sum(calls.values())),
+               f"{name}.peak_rss_mb": stats["maxrss_kb"] / 1024}
+    for tool, count in sorted(calls.items()):
+        results[f"{name}.{tool}.processes"] = float(count)
+    return results
+
+
+def run_convert(work_dir: Path, docs: List[Path], config_file: Path,
+                args: argparse.Namespace) -> Dict[str, float]:
+    """Convert all the :code:`docs` once in a single pndconf process."""
+    log_file = work_dir.joinpath("convert-stubs.log")
+    stats_file = work_dir.joinpath("convert-stats.json")
+    log_file.unlink(missing_ok=True)
+    command = pndconf_command(stats_file, config_file,
+                              ["convert", "-g", args.generation, "-o", "out",
+                               *(["--no-citeproc"] if args.no_citeproc else []),
+                               ",".join(x.name for x in docs)])
+    with open(work_dir.joinpath("convert-output.log"), "w") as out:
+        start = time.perf_counter()
+        p = subprocess.Popen(command, cwd=work_dir, stdin=subprocess.DEVNULL,
+                             stdout=out, stderr=subprocess.STDOUT,
+                             env=stub_env(log_file, args))
+        _, status, rusage = os.wait4(p.pid, 0)
+        wall = time.perf_counter() - start
+    if status:
+        raise RuntimeError(f"pndconf convert failed. See {work_dir}/convert-output.log")
+    return usage_results("convert", wall, rusage, stats_file, log_file)
+
+
+def wait_for(predicate, timeout: float, interval: float = 0.05) -> bool:
+    end = time.time() + timeout
+    while time.time() < end:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return False
+
+
+def log_mtime(log_file: Path) -> Optional[float]:
+    return log_file.stat().st_mtime if log_file.exists() else None
+
+
+def run_watch(work_dir: Path, docs: List[Path], config_file: Path,
+              args: argparse.Namespace) -> Dict[str, float]:
+    """Run a scripted watch session.
+
+    The documents are edited in turn :code:`args.edits` times at intervals of
+    :code:`args.edit_interval` seconds. The session ends once no command has
+    run for :code:`args.settle` seconds after the last edit. The wall time is
+    from the first edit to the last command run.
+
+    """
+    log_file = work_dir.joinpath("watch-stubs.log")
+    stats_file = work_dir.joinpath("watch-stats.json")
+    output_file = work_dir.joinpath("watch-output.log")
+    log_file.unlink(missing_ok=True)
+    command = pndconf_command(stats_file, config_file,
+                              ["watch", "-w", ".", "-g", args.generation, "-o", "out",
+                               *(["--no-citeproc"] if args.no_citeproc else [])])
+    with open(output_file, "w") as out:
+        p = subprocess.Popen(command, cwd=work_dir, stdin=subprocess.DEVNULL,
+                             stdout=out, stderr=subprocess.STDOUT,
+                             env=stub_env(log_file, args))
+        if not wait_for(lambda: "Starting pandoc watcher" in output_file.read_text(), 30):
+            p.kill()
+            raise RuntimeError(f"pndconf watch didn't start. See {output_file}")
+        time.sleep(0.5)
+        start = time.time()
+        for i in range(args.edits):
+            with open(docs[i % len(docs)], "a") as f:
+                f.write(f"\nEdit {i} at {time.time()}.\n")
+            time.sleep(args.edit_interval)
+
+        def settled():
+            mtime = log_mtime(log_file)
+            return mtime is not None and time.time() - mtime > args.settle
+        wait_for(settled, args.timeout)
+        end = log_mtime(log_file) or time.time()
+        p.send_signal(signal.SIGINT)
+        _, status, rusage = os.wait4(p.pid, 0)
+    results = usage_results("watch", max(0.0, end - start), rusage, stats_file, log_file)
+    results["watch.builds"] = float(stub_calls(log_file).get("pandoc", 0))
+    return results
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", default="convert", choices=["convert", "watch", "both"],
+                        help="What to run")
+    parser.add_argument("--docs", type=int, default=10, help="Number of documents")
+    parser.add_argument("--paragraphs", type=int, default=20,
+                        help="Number of paragraphs in each document")
+    parser.add_argument("--header-keys", type=int, default=8,
+                        help="Number of extra keys in the yaml header of each document")
+    parser.add_argument("--bib-size", type=int, default=2000,
+                        help="Number of entries in the bibliography")
+    parser.add_argument("--generation", "-g", default="pdf", help="Output formats")
+    parser.add_argument("--no-citeproc", action="store_true", default=True,
+                        help="Use bibtex instead of citeproc. Default")
+    parser.add_argument("--citeproc", action="store_false", dest="no_citeproc",
+                        help="Use citeproc")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="Seconds each stub command takes")
+    parser.add_argument("--output-bytes", type=int, default=2000,
+                        help="Bytes of output to stdout from each stub command")
+    parser.add_argument("--file-bytes", type=int, default=20000,
+                        help="Size of the file written by the pandoc stub")
+    parser.add_argument("--edits", type=int, default=4, help="Number of edits while watching")
+    parser.add_argument("--edit-interval", type=float, default=3.5,
+                        help="Seconds between edits while watching")
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="Seconds without commands after which a watch session ends")
+    parser.add_argument("--timeout", type=float, default=120,
+                        help="Maximum seconds to wait for a watch session to settle")
+    parser.add_argument("--work-dir", default="",
+                        help="Directory for the corpus. A temporary one if not given")
+    add_common_args(parser, "benchmarks/results/e2e.json")
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = Path(args.work_dir or tmp).absolute()
+        docs = write_documents(work_dir, args.docs, args.paragraphs, args.header_keys,
+                               args.bib_size)
+        config_file = write_config(work_dir)
+        os.environ["XDG_CACHE_HOME"] = str(work_dir.joinpath("cache"))
+        results: Dict[str, float] = {}
+        if args.mode in {"convert", "both"}:
+            results.update(run_convert(work_dir, docs, config_file, args))
+        if args.mode in {"watch", "both"}:
+            results.update(run_watch(work_dir, docs, config_file, args))
+    finish(args, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Startup time benchmark of the pndconf CLI.
+
+Times fresh Python processes which:
+
+    import: Import :mod:`pndconf.parser`, which the :code:`pndconf` script does
+    version: Run :code:`pndconf --version`
+    print_pandoc_opts: Run :code:`pndconf -po` with the stub pandoc, after
+                       its probe results are cached
+
+It also reports the modules among :data:`heavy_modules` which are imported
+by :mod:`pndconf.parser` and by :mod:`pndconf.config`, which should be none.
+Exits with status 1 if the median time of any of them exceeds its budget or
+a heavy module is imported.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --budget 0.2 --budget import=0.1
+
+"""
+from typing import Dict, List
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+
+from .common import add_common_args, finish, measure, stubs_dir, benchmarks_dir
+from .bench_watch import parse_budgets
+
+
+heavy_modules = ["bibtexparser", "watchdog", "chardet"]
+
+
+def python_command(code: str) -> List[str]:
+    return [sys.executable, "-c", code]
+
+
+def run(command: List[str], env: Dict[str, str]) -> str:
+    p = subprocess.run(command, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                       stderr=subprocess.STDOUT, cwd=benchmarks_dir.parent)
+    if p.returncode:
+        raise RuntimeError(f"{command} failed with {p.stdout.decode()}")
+    return p.stdout.decode()
+
+
+def imported_heavy_modules(module: str, env: Dict[str, str]) -> List[str]:
+    "Return the modules in :data:`heavy_modules` imported by :code:`module`"
+    code = f"import sys, {module}; print(*[x for x in {heavy_modules} if x in sys.modules])"
+    return run(python_command(code), env).split()
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", action="append", default=[],
+                        help="Budget in seconds for the median time, either for all the\n"
+                        "benchmarks or as name=seconds. Can be given multiple times.")
+    add_common_args(parser, "benchmarks/results/startup.json")
+    args = parser.parse_args(argv)
+    budgets = {"*": 0.5, **parse_budgets(args.budget)}
+    pndconf = python_command("from pndconf.parser import main; main()")
+    commands = {"import": python_command("import pndconf.parser"),
+                "version": [*pndconf, "--version"],
+                "print_pandoc_opts": [*pndconf, "--pandoc-path",
+                                      str(stubs_dir.joinpath("pandoc")), "-po"]}
+    results: Dict[str, float] = {}
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {**os.environ, "XDG_CACHE_HOME": tmp,
+               "PYTHONPATH": str(benchmarks_dir.parent)}
+        # NOTE: Cache the probe results of the stub pandoc
+        run(commands["print_pandoc_opts"], env)
+        for name, command in commands.items():
+            results[name] = measure(lambda: run(command, env), args.repeat)
+            budget = budgets.get(name, budgets["*"])
+            if results[name] > budget:
+                failures.append(f"{name}: {results[name]:.3f}s exceeds budget {budget:.3f}s")
+        for module in ["pndconf.parser", "pndconf.config"]:
+            heavy = imported_heavy_modules(module, env)
+            results[f"{module}.heavy_imports"] = float(len(heavy))
+            if heavy:
+                failures.append(f"{module} imports {heavy}")
+    if failures:
+        print("Startup budgets exceeded:\n  " + "\n  ".join(failures))
+    finish(args, results)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""Watch mode event storm benchmark.
+
+Drives :class:`pndconf.watcher.ChangeHandler` with a real
+:class:`watchdog.observers.Observer` on a temporary directory, with
+:meth:`pndconf.config.Configuration.is_watched` and
+:meth:`pndconf.config.Configuration.get_watched` as in :code:`pndconf watch`
+and a stub compiler which records when it's called and takes a fixed time.
+
+Scenarios:
+    single_save: A document is overwritten in place
+    atomic_save: A document is written to a temporary file which is renamed to it
+    checkout: Many new documents are written at once, as by a VCS checkout
+    template_edit: A template included by several documents is modified
+
+For each scenario it records the latency from the end of the filesystem
+operation to the start of the compile of each affected document, duplicate
+builds, missed builds and the CPU time of the process. A missed build counts
+with the timeout as its latency. Exits with status 1 if the p95 latency of
+any scenario exceeds its budget.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_watch
+    python -m benchmarks.bench_watch --budget 0.25 --budget checkout=5
+
+"""
+from typing import Callable, Dict, List, Union
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import contextlib
+from pathlib import Path
+
+from watchdog.observers import Observer
+
+from pndconf.config import Configuration
+from pndconf.watcher import ChangeHandler
+
+from .common import add_common_args, finish, stubs_dir
+
+
+class CompileRecorder:
+    """Stub compiler which records the time of each compile of each file.
+
+    Args:
+        root: The watched directory. Relative paths are relative to it.
+        cost: Seconds each compile takes
+
+    """
+    def __init__(self, root: Path, cost: float):
+        self.root = root
+        self.cost = cost
+        self.calls: List[tuple] = []
+        self.lock = threading.Lock()
+
+    def __call__(self, md_files: Union[str, List[str]]):
+        now = time.perf_counter()
+        files = [md_files] if isinstance(md_files, str) else md_files
+        with self.lock:
+            for f in files:
+                self.calls.append((now, os.path.normpath(self.root.joinpath(f))))
+        time.sleep(self.cost * len(files))
+
+    def since(self, start: float) -> List[tuple]:
+        with self.lock:
+            return [x for x in self.calls if x[0] >= start]
+
+
+class WatchDriver:
+    """Run a watcher on :code:`root` with a :class:`CompileRecorder`.
+
+    Args:
+        root: The directory to watch
+        cost: Seconds each compile takes
+
+    """
+    def __init__(self, root: Path, cost: float = 0.0):
+        self.root = root.absolute()
+        self.config = Configuration(watch_dir=self.root, output_dir=self.root.joinpath("out"),
+                                    config_file=None, pandoc_path=stubs_dir.joinpath("pandoc"),
+                                    pandoc_version="2.14.2", no_citeproc=None)
+        self.config.set_included_extensions([".md"])
+        self.recorder = CompileRecorder(self.root, cost)
+        self.handler = ChangeHandler(self.root, self.config.is_watched,
+                                     self.config.get_watched, self.recorder, 0,
+                                     self.config.resources.invalidate)
+        self.observer = Observer()
+
+    def __enter__(self) -> "WatchDriver":
+        self.observer.schedule(self.handler, str(self.root), recursive=True)
+        self.observer.start()
+        time.sleep(0.2)
+        return self
+
+    def __exit__(self, *args):
+        self.observer.stop()
+        self.observer.join()
+
+    def measure(self, action: Callable[[], Dict[str, float]], timeout: float,
+                quiet: float) -> Dict[str, List[float]]:
+        """Run :code:`action` and measure the builds it causes.
+
+        Args:
+            action: Performs the filesystem operations and returns the files
+                    which should be compiled mapped to the time at which the
+                    operation on them started. It's taken before the operation
+                    as the watcher may compile the file before it returns.
+            timeout: Seconds to wait for all the builds
+            quiet: Seconds to wait after the last build for any duplicates
+
+        Returns latencies, and the number of duplicate and missed builds.
+
+        """
+        start = time.perf_counter()
+        expected = {os.path.normpath(k): v for k, v in action().items()}
+
+        def done():
+            return expected.keys() <= {x[1] for x in self.recorder.since(start)}
+        end = time.perf_counter() + timeout
+        while time.perf_counter() < end and not done():
+            time.sleep(0.01)
+        time.sleep(quiet)
+        first: Dict[str, float] = {}
+        duplicates = 0
+        for t, path in self.recorder.since(start):
+            if path in first or path not in expected:
+                duplicates += 1
+            else:
+                first[path] = t
+        latencies = [first[k] - v if k in first else timeout for k, v in expected.items()]
+        return {"latencies": latencies, "duplicates": [float(duplicates)],
+                "missed": [float(len(expected.keys() - first.keys()))]}
+
+
+def write_doc(path: Path, text: str = "", header: str = "") -> float:
+    "Write a document and return the time at which the write started"
+    start = time.perf_counter()
+    with open(path, "w") as f:
+        f.write(f"---\ntitle: {path.stem}\n{header}---\n\n{text or 'Some text.'}\n")
+    return start
+
+
+def single_save(driver: WatchDriver, i: int) -> Dict[str, float]:
+    path = driver.root.joinpath(f"doc{i}.md")
+    return {str(path): write_doc(path, f"Saved {i}")}
+
+
+def atomic_save(driver: WatchDriver, i: int) -> Dict[str, float]:
+    path = driver.root.joinpath(f"doc{i}.md")
+    temp = driver.root.joinpath(f".doc{i}.md.tmp")
+    write_doc(temp, f"Saved atomically {i}")
+    start = time.perf_counter()
+    os.replace(temp, path)
+    return {str(path): start}
+
+
+def checkout(size: int) -> Callable[[WatchDriver, int], Dict[str, float]]:
+    def func(driver: WatchDriver, i: int) -> Dict[str, float]:
+        directory = driver.root.joinpath(f"checkout{i}")
+        directory.mkdir()
+        return {str(directory.joinpath(f"doc{j}.md")):
+                write_doc(directory.joinpath(f"doc{j}.md")) for j in range(size)}
+    return func
+
+
+def template_edit(num_docs: int) -> Callable[[WatchDriver, int], Dict[str, float]]:
+    def func(driver: WatchDriver, i: int) -> Dict[str, float]:
+        template = driver.root.joinpath(f"base{i}.template")
+        start = time.perf_counter()
+        with open(template, "a") as f:
+            f.write(f"% edit {i}\n")
+        return {str(driver.root.joinpath(f"t{i}doc{j}.md")): start for j in range(num_docs)}
+    return func
+
+
+def setup_docs(driver: WatchDriver, iterations: int, template_docs: int):
+    for i in range(iterations):
+        write_doc(driver.root.joinpath(f"doc{i}.md"))
+        template = driver.root.joinpath(f"base{i}.template")
+        template.write_text("% template\n")
+        for j in range(template_docs):
+            write_doc(driver.root.joinpath(f"t{i}doc{j}.md"),
+                      header=f"# includes {template}\n")
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run_scenario(name: str, action: Callable[[WatchDriver, int], Dict[str, float]],
+                 args: argparse.Namespace) -> Dict[str, float]:
+    """Run :code:`action` :code:`args.iterations` times in a fresh watched directory."""
+    with tempfile.TemporaryDirectory() as tmp:
+        driver = WatchDriver(Path(tmp), args.compile_cost)
+        setup_docs(driver, args.iterations, args.template_docs)
+        latencies: List[float] = []
+        duplicates = missed = 0.0
+        with driver:
+            # NOTE: Let the events from the setup pass
+            time.sleep(args.quiet)
+            cpu = time.process_time()
+            for i in range(args.iterations):
+                # NOTE: Each iteration operates on different files, so
+                #       Debounce doesn't suppress the repeated saves
+                result = driver.measure(lambda: action(driver, i), args.timeout, args.quiet)
+                latencies.extend(result["latencies"])
+                duplicates += result["duplicates"][0]
+                missed += result["missed"][0]
+            cpu = time.process_time() - cpu
+    return {f"{name}.p50": percentile(latencies, 50),
+            f"{name}.p95": percentile(latencies, 95),
+            f"{name}.max": max(latencies),
+            f"{name}.duplicates": duplicates,
+            f"{name}.missed": missed,
+            f"{name}.cpu": cpu}
+
+
+def parse_budgets(budgets: List[str]) -> Dict[str, float]:
+    retval = {}
+    for budget in budgets:
+        name, _, value = budget.rpartition("=")
+        retval[name or "*"] = float(value)
+    return retval
+
+
+def check_budgets(results: Dict[str, float], scenarios: List[str],
+                  budgets: Dict[str, float]) -> List[str]:
+    failures = []
+    for name in scenarios:
+        budget = budgets.get(name, budgets["*"])
+        if results[f"{name}.p95"] > budget:
+            failures.append(f"{name}: p95 latency {results[f'{name}.p95']:.3f}s "
+                            f"exceeds budget {budget:.3f}s")
+    return failures
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="single_save,atomic_save,checkout,template_edit",
+                        help="Comma separated scenarios to run")
+    parser.add_argument("--iterations", type=int, default=10,
+                        help="Number of times each scenario is repeated")
+    parser.add_argument("--checkout-size", type=int, default=1000,
+                        help="Number of files in a checkout")
+    parser.add_argument("--template-docs", type=int, default=5,
+                        help="Number of documents including each template")
+    parser.add_argument("--compile-cost", type=float, default=0.0,
+                        help="Seconds each stub compile takes")
+    parser.add_argument("--timeout", type=float, default=10.0,
+                        help="Seconds after which a build is counted as missed")
+    parser.add_argument("--quiet", type=float, default=0.5,
+                        help="Seconds to wait for duplicate builds after each operation")
+    parser.add_argument("--budget", action="append", default=[],
+                        help="p95 latency budget in seconds, either for all the scenarios\n"
+                        "or as scenario=seconds. Can be given multiple times.")
+    add_common_args(parser, "benchmarks/results/watch.json")
+    args = parser.parse_args(argv)
+    budgets = {"*": 0.5, "checkout": 5.0, **parse_budgets(args.budget)}
+    actions = {"single_save": single_save,
+               "atomic_save": atomic_save,
+               "checkout": checkout(args.checkout_size),
+               "template_edit": template_edit(args.template_docs)}
+    scenarios = args.scenarios.split(",")
+    results: Dict[str, float] = {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for name in scenarios:
+            results.update(run_scenario(name, actions[name],
+                                        argparse.Namespace(**{**vars(args), "iterations":
+                                                              1 if name == "checkout"
+                                                              else args.iterations})))
+    failures = check_budgets(results, scenarios, budgets)
+    if failures:
+        print("Latency budgets exceeded:\n  " + "\n  ".join(failures))
+    finish(args, results)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
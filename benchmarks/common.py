@@ -0,0 +1,145 @@
+"""Timing, result files and baseline comparison shared by the benchmarks.
+
+Results are saved as JSON of the form::
+
+    {"meta": {...}, "results": {"<benchmark>": <seconds>, ...}}
+
+A baseline is a results file, optionally with a "thresholds" key of
+:mod:`fnmatch` patterns of benchmark names to the allowed ratio of the
+result to the baseline. Patterns are checked in order and the first match
+wins, otherwise the default threshold applies.
+
+"""
+from typing import Callable, Dict, List, Optional
+import sys
+import json
+import time
+import fnmatch
+import platform
+import argparse
+import statistics
+from pathlib import Path
+
+
+benchmarks_dir = Path(__file__).parent
+stubs_dir = benchmarks_dir.joinpath("stubs")
+
+# NOTE: Results with these suffixes are counts or sizes and not seconds
+plain_metrics = {"processes", "builds", "peak_rss_mb", "duplicates", "missed",
+                 "heavy_imports"}
+
+
+def measure(func: Callable, repeat: int = 5, setup: Optional[Callable] = None) -> float:
+    """Return the median wall time of :code:`repeat` calls of :code:`func`.
+
+    Args:
+        func: Function to time. Called with the return value of :code:`setup`
+              if given, else with no arguments.
+        repeat: Number of calls
+        setup: Called before each call of :code:`func` and not timed
+
+    """
+    times = []
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def meta() -> Dict[str, str]:
+    return {"python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def save_results(results: Dict[str, float], out_file: Path,
+                 thresholds: Optional[Dict[str, float]] = None):
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    data = {"meta": meta(), "results": results}
+    if thresholds:
+        data["thresholds"] = thresholds
+    with open(out_file, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def threshold_for(name: str, thresholds: Dict[str, float], default: float) -> float:
+    for pattern, value in thresholds.items():
+        if fnmatch.fnmatch(name, pattern):
+            return value
+    return default
+
+
+def compare(results: Dict[str, float], baseline_file: Path, default_threshold: float,
+            min_delta: float) -> List[str]:
+    """Compare :code:`results` with the baseline and return the regressions.
+
+    Args:
+        results: Benchmark results
+        baseline_file: The baseline results file
+        default_threshold: Allowed ratio of result to baseline
+        min_delta: Differences smaller than this are ignored as noise
+
+    """
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    thresholds = baseline.get("thresholds", {})
+    regressions = []
+    for name, value in results.items():
+        if name not in baseline["results"]:
+            continue
+        base = baseline["results"][name]
+        limit = threshold_for(name, thresholds, default_threshold)
+        if value - base > min_delta and value > base * limit:
+            regressions.append(f"{name}: {value:.6f} vs baseline {base:.6f} "
+                               f"({value / base:.2f}x > {limit:.2f}x)")
+    return regressions
+
+
+def add_common_args(parser: argparse.ArgumentParser, default_output: str):
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of times to run each benchmark. The median is reported")
+    parser.add_argument("-o", "--output", default=default_output,
+                        help="File to save the results to")
+    parser.add_argument("--baseline", default="",
+                        help="Baseline results file to compare with")
+    parser.add_argument("--threshold", type=float, default=1.5,
+                        help="Default allowed ratio of result to baseline")
+    parser.add_argument("--min-delta", type=float, default=0.005,
+                        help="Ignore differences smaller than these many seconds")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Save the results to the baseline file instead of comparing")
+
+
+def finish(args: argparse.Namespace, results: Dict[str, float]):
+    """Print and save the results and compare them with the baseline if given.
+
+    Exits with status 1 if there are regressions.
+
+    """
+    width = max(map(len, results), default=0)
+    for name, value in results.items():
+        if name.rsplit(".", 1)[-1] in plain_metrics:
+            print(f"{name:<{width}}  {value:10.3f}")
+        else:
+            print(f"{name:<{width}}  {value * 1000:10.3f} ms")
+    save_results(results, Path(args.output))
+    print(f"Saved results to {args.output}")
+    if not args.baseline:
+        return
+    baseline_file = Path(args.baseline)
+    if args.save_baseline or not baseline_file.exists():
+        thresholds = {}
+        if baseline_file.exists():
+            with open(baseline_file) as f:
+                thresholds = json.load(f).get("thresholds", {})
+        save_results(results, baseline_file, thresholds)
+        print(f"Saved baseline to {baseline_file}")
+        return
+    regressions = compare(results, baseline_file, args.threshold, args.min_delta)
+    if regressions:
+        print("Regressions:\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+    print("No regressions")
@@ -0,0 +1,29 @@
+"""Run pndconf in this process and save its own resource usage on exit.
+
+Usage::
+
+    python -m benchmarks.run_pndconf STATS_FILE [pndconf args]
+
+The CPU time and peak RSS in :code:`STATS_FILE` are only of the pndconf
+process itself and don't include the commands it runs.
+
+"""
+import sys
+import json
+import atexit
+import resource
+
+
+def dump_usage(stats_file: str):
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    with open(stats_file, "w") as f:
+        json.dump({"cpu": usage.ru_utime + usage.ru_stime,
+                   "maxrss_kb": usage.ru_maxrss}, f)
+
+
+if __name__ == "__main__":
+    stats_file = sys.argv[1]
+    sys.argv = ["pndconf", *sys.argv[2:]]
+    atexit.register(dump_usage, stats_file)
+    from pndconf.parser import main
+    main()
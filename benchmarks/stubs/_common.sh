@@ -0,0 +1,38 @@
+# Sourced by the stub executables.
+#
+# Environment variables:
+#   PNDCONF_STUB_LOG            File to which each invocation is appended as a line
+#   PNDCONF_STUB_LATENCY        Seconds to sleep on each invocation. Default 0
+#   PNDCONF_STUB_OUTPUT         Bytes written to stdout on each invocation. Default 0
+#
+# PNDCONF_STUB_<TOOL>_LATENCY and PNDCONF_STUB_<TOOL>_OUTPUT, with <TOOL> one
+# of PANDOC, PDFLATEX, BIBTEX or BIBER, override them for a single tool.
+# PNDCONF_STUB_PANDOC_FILE_BYTES is the size of the file written by pandoc.
+
+stub_start() {
+    tool=$1
+    upper=$2
+    shift 2
+    if [ -n "$PNDCONF_STUB_LOG" ]; then
+        echo "$tool $*" >> "$PNDCONF_STUB_LOG"
+    fi
+    eval "latency=\${PNDCONF_STUB_${upper}_LATENCY:-\${PNDCONF_STUB_LATENCY:-0}}"
+    eval "output=\${PNDCONF_STUB_${upper}_OUTPUT:-\${PNDCONF_STUB_OUTPUT:-0}}"
+    if [ "$latency" != 0 ]; then
+        sleep "$latency"
+    fi
+    if [ "$output" != 0 ]; then
+        yes "Overfull \\hbox (1.5pt too wide) in paragraph at lines 10--12
+LaTeX Warning: Citation \`key' on page 1 undefined on input line 20.
+" | head -c "$output"
+    fi
+}
+
+# Write $2 bytes of filler to file $1
+stub_fill() {
+    if [ "${2:-0}" != 0 ]; then
+        yes "Lorem ipsum dolor sit amet, consectetur adipiscing elit." | head -c "$2" > "$1"
+    else
+        : > "$1"
+    fi
+}
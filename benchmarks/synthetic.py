@@ -0,0 +1,197 @@
+"""Synthetic bibliographies and documents for the benchmarks.
+
+The entries have the variety seen in real libraries: the same venues spelled
+in many ways, arXiv preprints, titles with LaTeX markup and case protecting
+braces, and author names with particles, suffixes and accents.
+
+"""
+from typing import List, Tuple
+import random
+from pathlib import Path
+
+
+venue_spellings = {
+    "inproceedings": [
+        "Advances in Neural Information Processing Systems",
+        "Advances in Neural Information Processing Systems 32",
+        "NeurIPS", "NIPS", "Proc. NeurIPS 2019",
+        "Proceedings of the IEEE Conference on Computer Vision and Pattern Recognition",
+        "IEEE/CVF Conference on Computer Vision and Pattern Recognition (CVPR)",
+        "CVPR", "2020 IEEE/CVF CVPR",
+        "Proceedings of the IEEE International Conference on Computer Vision",
+        "ICCV", "IEEE International Conference on Computer Vision (ICCV)",
+        "European Conference on Computer Vision", "ECCV 2018",
+        "International Conference on Learning Representations", "ICLR",
+        "International Conference on Machine Learning", "Proc. of ICML", "ICML 2017",
+        "Proceedings of the AAAI Conference on Artificial Intelligence", "AAAI",
+        "International Joint Conference on Artificial Intelligence", "IJCAI",
+        "British Machine Vision Conference", "BMVC",
+        "Artificial Intelligence and Statistics", "AISTATS",
+        "Uncertainty in Artificial Intelligence", "UAI",
+        "Proceedings of the Workshop on Obscure Topics",
+        "Annual Meeting of the Association for Computational Linguistics",
+    ],
+    "article": [
+        "Journal of Machine Learning Research", "JMLR", "J. Mach. Learn. Res.",
+        "IEEE Transactions on Pattern Analysis and Machine Intelligence", "TPAMI",
+        "IEEE Trans. Pattern Anal. Mach. Intell.",
+        "International Journal of Computer Vision", "IJCV",
+        "Journal of Artificial Intelligence Research",
+        "arXiv preprint arXiv:{arxiv}", "CoRR", "ArXiv",
+        "Neural Computation", "Nature", "Science",
+        "Journal of Applied Statistical Methods",
+        "Transactions on Computational Linguistics",
+    ]}
+
+title_words = [
+    "learning", "deep", "neural", "networks", "representations", "attention",
+    "transformers", "graph", "convolutional", "generative", "adversarial", "models",
+    "bayesian", "inference", "variational", "reinforcement", "policy", "optimization",
+    "stochastic", "gradient", "descent", "robust", "efficient", "scalable", "sparse",
+    "self-supervised", "contrastive", "unsupervised", "semantic", "segmentation",
+    "object", "detection", "recognition", "image", "video", "language", "speech",
+    "translation", "retrieval", "embedding", "kernel", "methods", "theory", "analysis",
+    "benchmark", "dataset", "towards", "understanding", "generalization", "training",
+]
+
+title_glue = ["for", "of", "with", "in", "via", "and", "on", "the", "a"]
+
+title_markup = ["{BERT}", "{ImageNet}", "{GAN}s", "\\emph{Fast}", "{3D}", "{$k$}-means",
+                "{M}arkov", "{B}ayes", "{\\'E}tude", "{LSTM}"]
+
+surnames = ["Smith", "Zhang", "Wang", "Li", "Kumar", "Garc{\\'\\i}a", "M{\\\"u}ller",
+            "Nguyen", "Kim", "Rossi", "Dupont", "Ivanov", "Sato", "O'Brien",
+            "von Neumann", "de la Cruz", "van der Berg", "Schmidhuber", "Badola", "Hinton",
+            "Bengio", "LeCun", "Sch{\\\"o}lkopf", "Jordan", "Ng", "Koller", "Russell"]
+
+given_names = ["John", "Wei", "Priya", "Mar{\\'\\i}a", "J{\\\"u}rgen", "Yoshua", "Anh",
+               "Min-Jun", "Giulia", "Pierre", "Olga", "Haruto", "A.", "J. R.", "Akshay"]
+
+months = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct",
+          "nov", "dec"]
+
+
+def make_title(rand: random.Random) -> str:
+    words = [rand.choice(title_words) for _ in range(rand.randint(3, 10))]
+    for i in range(1, len(words), 3):
+        if rand.random() < 0.5:
+            words.insert(i, rand.choice(title_glue))
+    if rand.random() < 0.2:
+        words.insert(rand.randrange(len(words)), rand.choice(title_markup))
+    title = " ".join(words)
+    if rand.random() < 0.3:
+        title = title.title()
+    return title[0].upper() + title[1:]
+
+
+def make_name(rand: random.Random) -> str:
+    surname, given = rand.choice(surnames), rand.choice(given_names)
+    style = rand.random()
+    if style < 0.6:
+        return f"{surname}, {given}"
+    elif style < 0.95:
+        return f"{given} {surname}"
+    else:
+        return f"{surname}, Jr, {given}"
+
+
+def make_entry(i: int, rand: random.Random) -> str:
+    """Return a synthetic bibtex entry with key :code:`key{i}`"""
+    entry_type = "inproceedings" if rand.random() < 0.6 else "article"
+    venue = rand.choice(venue_spellings[entry_type]).format(
+        arxiv=f"{rand.randint(1500, 2212)}.{rand.randint(0, 99999):05d}")
+    year = rand.randint(1990, 2023)
+    authors = " and ".join(make_name(rand) for _ in range(rand.randint(1, 8)))
+    fields = [("author", authors), ("title", make_title(rand)),
+              ("booktitle" if entry_type == "inproceedings" else "journal", venue)]
+    if rand.random() < 0.7:
+        fields.append(("year", str(year)))
+    else:
+        fields.append(("date", f"{year}-{rand.randint(1, 12):02d}"))
+    if rand.random() < 0.3:
+        fields.append(("month", rand.choice(months)))
+    if rand.random() < 0.6:
+        start = rand.randint(1, 900)
+        fields.append(("pages", f"{start}--{start + rand.randint(5, 20)}"))
+    if rand.random() < 0.5:
+        fields.append(("url", f"https://example.org/papers/{i}.pdf"))
+    if rand.random() < 0.3:
+        fields.append(("file", f"/home/user/papers/{i}.pdf"))
+    if rand.random() < 0.3:
+        fields.append(("doi", f"10.{rand.randint(1000, 9999)}/{i}"))
+    if entry_type == "article" and rand.random() < 0.5:
+        fields.append(("volume", str(rand.randint(1, 60))))
+    body = ",\n".join(f"  {k} = {{{v}}}" for k, v in fields)
+    return f"@{entry_type}{{key{i},\n{body}\n}}\n\n"
+
+
+def generate_bib(num_entries: int, seed: int = 0) -> str:
+    """Return a bibliography of :code:`num_entries` synthetic entries.
+
+    Args:
+        num_entries: Number of entries
+        seed: Seed for the random generator
+
+    """
+    rand = random.Random(seed)
+    return "".join(make_entry(i, rand) for i in range(num_entries))
+
+
+def write_corpus(directory: Path, num_entries: int, num_cited: int = 200,
+                 seed: int = 0) -> Tuple[Path, Path, List[str]]:
+    """Write a bibliography and a markdown document citing some of its entries.
+
+    Args:
+        directory: Directory to write to
+        num_entries: Number of entries in the bibliography
+        num_cited: Number of entries cited in the document
+        seed: Seed for the random generator
+
+    Return the markdown file, the bibliography file and the cited keys.
+
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    rand = random.Random(seed)
+    bib_file = directory.joinpath(f"library-{num_entries}.bib")
+    if not bib_file.exists():
+        bib_file.write_text(generate_bib(num_entries, seed))
+    keys = [f"key{i}" for i in sorted(rand.sample(range(num_entries),
+                                                  min(num_cited, num_entries)))]
+    paragraphs = []
+    for i in range(0, len(keys), 4):
+        cites = "; ".join(f"@{k}" for k in keys[i:i + 4])
+        paragraphs.append(f"Some text about {rand.choice(title_words)} [{cites}].")
+    md_file = directory.joinpath(f"doc-{num_entries}.md")
+    md_file.write_text("---\ntitle: Benchmark\n"
+                       f"bibliography: {bib_file.absolute()}\n"
+                       "references:\n- id: inline2020\n  type: article-journal\n"
+                       "  title: Inline reference\n  container-title: Inline Journal\n"
+                       "  author:\n  - family: Person\n"
+                       "    given: Some\n  issued: 2020-06\n"
+                       "---\n\n" + "\n\n".join(paragraphs) + " [@inline2020]\n")
+    return md_file, bib_file, [*keys, "inline2020"]
+
+
+def write_ltwa(path: Path, num_patterns: int = 50000, seed: int = 0) -> Path:
+    """Write a synthetic LTWA file with the same format and size as the real one.
+
+    Args:
+        path: The file to write
+        num_patterns: Number of word patterns
+        seed: Seed for the random generator
+
+    """
+    rand = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    lines = ["WORD;ABBREVIATIONS;LANGUAGES"]
+    for word in title_words:
+        lines.append(f"{word[:5]}-;{word[:4]}.;eng")
+    for _ in range(num_patterns):
+        word = "".join(rand.choice(letters) for _ in range(rand.randint(4, 12)))
+        lang = rand.choice(["eng", "mul", "fre", "ger", "eng, fre"])
+        if rand.random() < 0.6:
+            lines.append(f"{word}-;{word[:4]}.;{lang}")
+        else:
+            lines.append(f"{word};{word[:3]}.;{lang}")
+    path.write_text("\n".join(lines) + "\n")
+    return path
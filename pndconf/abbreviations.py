@@ -0,0 +1,119 @@
+from typing import Dict, Optional, Union, Any
+import csv
+import pickle
+import hashlib
+from pathlib import Path
+from functools import lru_cache
+
+from .util import cache_dir, logd
+
+
+Pathlike = Union[str, Path]
+
+
+class AbbrevIndex:
+    """An index of ISO-4 abbreviations from the List of Title Word Abbreviations (LTWA).
+
+    Args:
+        exact: Full words and their abbreviations
+        prefixes: A trie of word prefixes. Each node is a :class:`dict` of
+                  characters to child nodes and the abbreviation, if any,
+                  is stored at the key :code:`""`.
+        cache_size: Size of the LRU cache of resolved words
+
+    The LTWA has whole words like "abbreviation" and prefix patterns like
+    "academ-" which match any word beginning with "academ". Whole words are
+    looked up in a :class:`dict` and prefixes in a trie, so that a lookup
+    takes time proportional to the length of the word. An exact match is
+    preferred over a prefix and a longer prefix over a shorter one.
+
+    """
+    def __init__(self, exact: Dict[str, str], prefixes: Dict[str, Any],
+                 cache_size: int = 65536):
+        self.exact = exact
+        self.prefixes = prefixes
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    @classmethod
+    def from_csv(cls, abbrevs_file: Pathlike) -> "AbbrevIndex":
+        """Parse the LTWA CSV file.
+
+        Args:
+            abbrevs_file: The LTWA file with ";" separated word pattern,
+                          abbreviation and languages.
+
+        Only English and multi language entries are indexed. Suffix patterns
+        (like "-ology") and patterns with multiple words are skipped.
+
+        """
+        exact: Dict[str, str] = {}
+        prefixes: Dict[str, Any] = {}
+        with open(abbrevs_file) as f:
+            reader = csv.reader(f, delimiter=";")
+            for line in reader:
+                if len(line) < 3 or not ("eng" in line[-1] or line[-1] == "mul"):
+                    continue
+                pattern, abbrev = line[0].strip().lower(), line[1].strip().lower()
+                if not pattern or pattern.startswith("-") or " " in pattern:
+                    continue
+                if pattern.endswith("-"):
+                    node = prefixes
+                    for char in pattern[:-1]:
+                        node = node.setdefault(char, {})
+                    node.setdefault("", abbrev)
+                else:
+                    exact.setdefault(pattern, abbrev)
+        return cls(exact, prefixes)
+
+    @classmethod
+    def load(cls, abbrevs_file: Pathlike) -> "AbbrevIndex":
+        """Load the index for :code:`abbrevs_file` from the cache or parse and cache it.
+
+        Args:
+            abbrevs_file: The LTWA file
+
+        The cached index is keyed by the path, size and mtime of the file.
+
+        """
+        abbrevs_file = Path(abbrevs_file).absolute()
+        stat = abbrevs_file.stat()
+        path_key = hashlib.md5(str(abbrevs_file).encode()).hexdigest()[:16]
+        stat_key = hashlib.md5(f"{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:16]
+        cache_file = cache_dir("abbrevs").joinpath(f"{path_key}-{stat_key}.pickle")
+        if cache_file.exists():
+            try:
+                with open(cache_file, "rb") as f:
+                    exact, prefixes = pickle.load(f)
+                return cls(exact, prefixes)
+            except Exception as e:
+                logd(f"Could not load abbreviations cache {cache_file}: {e}")
+        index = cls.from_csv(abbrevs_file)
+        for stale in cache_file.parent.glob(f"{path_key}-*.pickle"):
+            stale.unlink()
+        with open(cache_file, "wb") as f:
+            pickle.dump((index.exact, index.prefixes), f, protocol=pickle.HIGHEST_PROTOCOL)
+        return index
+
+    def _lookup(self, word: str) -> Optional[str]:
+        """Return the abbreviation for :code:`word` if any
+
+        Args:
+            word: The word to abbreviate
+
+        """
+        word = word.lower()
+        if word in self.exact:
+            return self.exact[word]
+        node = self.prefixes
+        found = None
+        for char in word:
+            if char not in node:
+                break
+            node = node[char]
+            found = node.get("", found)
+        return found
+
+    def __len__(self) -> int:
+        def count(node):
+            return ("" in node) + sum(count(v) for k, v in node.items() if k)
+        return len(self.exact) + count(self.prefixes)
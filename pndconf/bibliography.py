@@ -1,28 +1,223 @@
-from typing import List, Dict, Union, Optional, Callable
+from typing import List, Dict, Union, Optional, Callable, Tuple, Iterator, Set
 import re
+import json
+import hashlib
+import multiprocessing
 from pathlib import Path
-from subprocess import Popen, PIPE
 
-from bibtexparser import bparser, bwriter
-from common_pyutil.functional import compose, identity, rpartial
+from common_pyutil.functional import compose, identity, rpartial, unique
 
-from . import transforms
+from . import transforms, dedup
+from .csl import references_to_entries, entry_to_csl
+from .util import cache_dir, write_if_changed, temp_file_for, replace_if_changed, logi, logw
+
+
+# NOTE: bibtexparser takes a while to import, so it's imported only when
+#       bibtex is actually parsed or written
+def bibtex_parser():
+    from bibtexparser import bparser
+    return bparser.BibTexParser(common_strings=True)
+
+
+def bibtex_writer():
+    from bibtexparser import bwriter
+    return bwriter.BibTexWriter(write_common_strings=True)
+
+
+def parse_transform_name(name: str) -> Tuple[str, List[str]]:
+    """Parse a transform name like :code:`remove_keys(file:doi)`
+
+    Args:
+        name: The transform name with optional arguments separated by ":"
+
+    Return the function name and the list of arguments.
+
+    """
+    match = re.match(r"(.+?)\((.+)\)", name)
+    if match:
+        func_name, args = match.groups()
+        return func_name, args.split(":")
+    else:
+        return name, []
 
 
 def compose_transforms(transform_names: List[str]) -> Callable:
     bib_transforms = []
     for name in transform_names:
-        match = re.match(r"(.+?)\((.+)\)", name)
-        if match:
-            func_name, args = re.match(r"(.+?)\((.+)\)", name).groups()  # type: ignore
-            args = args.split(":")
-            func = getattr(transforms, func_name)
-            bib_transforms.append(rpartial(func, args))
-        else:
-            bib_transforms.append(getattr(transforms, name))
+        func_name, args = parse_transform_name(name)
+        func = getattr(transforms, func_name)
+        bib_transforms.append(rpartial(func, args) if args else func)
     return compose(*bib_transforms)
 
 
+def compose_batch_transforms(transform_names: List[str]) -> Callable[[List[Dict]], List[Dict]]:
+    """Compose the batch versions of transforms.
+
+    Args:
+        transform_names: Names of the transforms
+
+    The composed function takes and returns the full list of entries. See
+    :func:`pndconf.transforms.batch_transform`. The order of application is
+    the same as for :func:`compose_transforms`.
+
+    """
+    if not transform_names:
+        return identity
+    bib_transforms = []
+    for name in transform_names:
+        func_name, args = parse_transform_name(name)
+        func = transforms.get_batch_transform(func_name)
+        bib_transforms.append(rpartial(func, args) if args else func)
+    return compose(*bib_transforms)
+
+
+def cited_keys(text: str) -> List[str]:
+    """Return the unique citation keys in markdown :code:`text` in order.
+
+    Args:
+        text: Markdown text
+
+    Both bracketed citations like :code:`[@a; see @b, p. 3]` and in-text
+    citations like :code:`@a` are found. Citation keys can contain internal
+    punctuation as in pandoc. Email addresses are not matched.
+
+    """
+    keys = re.findall(r"(?<![\w.@])-?@(?:\{([^{}]+)\}|([\w][\w:.#$%&+?<>~/-]*))", text)
+    return unique([(braced or plain).rstrip(":.#$%&+?<>~/-") for braced, plain in keys])
+
+
+def split_bib_files(bib_files: List[str]) -> Dict[str, str]:
+    """Split bibliography files into raw bibtex entries.
+
+    Args:
+        bib_files: List of bibliography files
+
+    Return a :class:`dict` of citation key to raw bibtex text.
+
+    We use :mod:`re` for spliting the bibtex file.  Searching with :mod:`re` is
+    faster than parsing all the bib entries with :mod:`bibtexparser`.
+
+    """
+    splits = []
+    for bf in bib_files:
+        with open(bf) as f:
+            temp = f.read()
+            splits.extend([*filter(None, re.split(r'(@.+){', temp))])
+    entries: Dict[str, str] = {}
+    for i in range(0, len(splits), 2):
+        key = splits[i+1].split(",")[0]
+        entries[key] = splits[i] + "{" + splits[i+1]
+    return entries
+
+
+def bibliography_files(metadata: Dict) -> List[str]:
+    """Return bibliography files in :code:`metadata` as a list
+
+    Args:
+        metadata: Metadata for the file
+
+    """
+    bib_files = metadata.get("bibliography", [])
+    if isinstance(bib_files, str):
+        bib_files = [bib_files]
+    return bib_files
+
+
+class BibliographyService:
+    """Session scoped cache of parsed bibliography files.
+
+    The :class:`pndconf.config.Configuration` owns one instance, so that when
+    many documents cite the same bibliography files in a batch (or across
+    batches while watching), each file is read and split only once and each
+    cited entry is parsed only once. Composed transform chains are also
+    cached by the transform names.
+
+    A file is identified by its absolute path and fingerprinted by its size
+    and modification time. The split and parsed entries of a file are dropped
+    only when its fingerprint changes.
+
+    """
+    def __init__(self):
+        self._files: Dict[str, Tuple[Tuple[int, int], Dict[str, str]]] = {}
+        self._parsed: Dict[str, Dict[str, Dict[str, str]]] = {}
+        self._transforms: Dict[Tuple[str, ...], Callable] = {}
+        self.reads = 0
+        self.parses = 0
+
+    @staticmethod
+    def fingerprint(bib_file: Union[str, Path]) -> Tuple[int, int]:
+        """Return the size and modification time of :code:`bib_file`"""
+        stat = Path(bib_file).stat()
+        return stat.st_size, stat.st_mtime_ns
+
+    def raw_entries(self, bib_file: Union[str, Path]) -> Dict[str, str]:
+        """Return the raw entries of :code:`bib_file`, splitting it only if it changed.
+
+        Args:
+            bib_file: The bibliography file
+
+        See :func:`split_bib_files`
+
+        """
+        path = str(Path(bib_file).absolute())
+        fingerprint = self.fingerprint(path)
+        if path not in self._files or self._files[path][0] != fingerprint:
+            self.reads += 1
+            self._files[path] = (fingerprint, split_bib_files([path]))
+            self._parsed[path] = {}
+        return self._files[path][1]
+
+    def cited_entries(self, bib_files: List[str], keys: List[str]) -> List[Dict[str, str]]:
+        """Return the parsed entries for :code:`keys` from :code:`bib_files`.
+
+        Args:
+            bib_files: List of bibliography files
+            keys: Citation keys
+
+        The entries are returned in the order of :code:`keys`. An entry in a
+        later file replaces the one with the same key in an earlier file. The
+        entries not parsed earlier are parsed together in a single call to the
+        parser. The returned entries are shared and must be copied before
+        modification.
+
+        """
+        sources: Dict[str, str] = {}
+        for bf in bib_files:
+            path = str(Path(bf).absolute())
+            raw = self.raw_entries(path)
+            sources.update({k: path for k in keys if k in raw})
+        missing: Dict[str, List[str]] = {}
+        for key, path in sources.items():
+            if key not in self._parsed[path]:
+                missing.setdefault(path, []).append(key)
+        for path, path_keys in missing.items():
+            self.parses += 1
+            parser = bibtex_parser()
+            try:
+                bibtex = parser.parse("\n".join(self._files[path][1][k] for k in path_keys))
+            except Exception:
+                msg = f"Error while parsing bibtexs in {path}. Check sources."
+                raise ValueError(msg)
+            self._parsed[path].update({ent["ID"]: ent for ent in bibtex.entries})
+        return [self._parsed[sources[key]][key] for key in keys
+                if key in sources and key in self._parsed[sources[key]]]
+
+    def fingerprints(self, bib_files: List[str]) -> List[List]:
+        """Return the absolute paths and fingerprints of :code:`bib_files`"""
+        return [[str(Path(bf).absolute()), *self.fingerprint(bf)] for bf in bib_files]
+
+    def transform(self, transform_names: List[str]) -> Callable:
+        """Return the cached batch transform for :code:`transform_names`.
+
+        See :func:`compose_batch_transforms`
+
+        """
+        key = tuple(transform_names)
+        if key not in self._transforms:
+            self._transforms[key] = compose_batch_transforms(transform_names)
+        return self._transforms[key]
+
+
 # NOTE: An alternative library is :mod:`biblib`, but that's not been updated
 #       for a while.
 # TODO: references are parsed from the md file and converted to bibtex etc. format,
@@ -30,62 +225,130 @@ def compose_transforms(transform_names: List[str]) -> Callable:
 #       in one of the files and also in references, the it's not known which of those
 #       should be kept.
 #       Also at present duplicates are simply written to the bibtex/biblatex file
+def remove_duplicates(entries: List[Dict[str, str]], policy: str,
+                      style: str) -> List[Dict[str, str]]:
+    """Remove duplicate entries with different keys for a document.
+
+    Args:
+        entries: Bibtex entries
+        policy: Which duplicate to keep. See :data:`pndconf.dedup.policies`
+        style: One of "bibtex" or "biblatex"
+
+    Biblatex resolves the keys of the removed entries to the kept one via
+    its :code:`ids` field. Bibtex has no such aliases, so for it the
+    duplicates are only reported and all the entries are kept.
+
+    """
+    kept, aliases = dedup.deduplicate(entries, policy, add_ids=True)
+    for key, dups in aliases.items():
+        logw(f"Entries {dups} are duplicates of {key}")
+    return kept if style == "biblatex" else entries
+
+
 def generate_bibtex(in_file: Path, metadata: Dict, style: str,
-                    text: str, pandoc_path: Path, transform_names: List[str]) -> Path:
+                    text: str, transform_names: List[str],
+                    dedup_policy: Optional[str] = None,
+                    service: Optional[BibliographyService] = None) -> Path:
     """Generate bibtex for markdown file.
 
     Args:
         in_file: input file
-        references: Metadata for the file including bibliography files and
-                    references in the metadata
+        metadata: Metadata for the file including bibliography files and
+                  references in the metadata
+        style: One of "bibtex" or "biblatex". Style of the inline references
+        text: Text of the input file
+        transform_names: Names of transforms to apply to the entries
+        dedup_policy: If given, remove duplicates of the cited entries.
+                      See :func:`remove_duplicates`
+        service: The bibliography service to get the entries from. A new one
+                 is used if not given.
 
     The bibtex file is generated in the same directory as `in_file` with a
     ".bib" suffix.
 
-    We use :mod:`re` for spliting the bibtex file.  Searching with :mod:`re` is
-    faster than parsing all the bib entries with :mod:`bibtexparser`.
-
-    Conflicts:
+    Inline :code:`references` from the yaml header are converted natively
+    (see :func:`pndconf.csl.references_to_entries`) and are merged with the
+    entries from the bibliography files. An inline reference replaces a file
+    entry with the same key.
 
     """
     out_file = in_file.parent.joinpath(in_file.stem + ".bib")
-    bib_files = metadata.get("bibliography", [])
-    if isinstance(bib_files, str):
-        bib_files = [bib_files]
-    splits = []
-    for bf in bib_files:
-        with open(bf) as f:
-            temp = f.read()
-            splits.extend([*filter(None, re.split(r'(@.+){', temp))])
-    entries: Dict[str, str] = {}
-    for i in range(0, len(splits), 2):
-        key = splits[i+1].split(",")[0]
-        entries[key] = splits[i] + "{" + splits[i+1]
-    bibs = []
-    text_citations = re.findall(r'\[@(.+?)\]', text)
-    for t in text_citations:
-        if t in entries:
-            bibs.append(entries[t])
-    # NOTE: parser is used primarily to validate the bibtexs. We might use it to
-    #       transform them later
-    parser = bparser.BibTexParser(common_strings=True)
-    transform = compose_transforms(transform_names) if transform_names else identity
+    service = service or BibliographyService()
+    file_entries = service.cited_entries(bibliography_files(metadata), cited_keys(text))
+    transform = service.transform(transform_names)
     try:
-        bibtex = parser.parse("\n".join(bibs))  # noqa
-        p = Popen(f"{pandoc_path} -r markdown -s -t {style} {in_file}",
-                  shell=True, stdout=PIPE, stderr=PIPE)
-        yaml_refs, err = p.communicate()
-        parser.parse(yaml_refs)
-        bibs = transform_bibtex(bibtex.entries, transform)  # type: ignore
+        inline_entries = references_to_entries(metadata.get("references", []), style)
+        entries = [*{x["ID"]: x for x in [*file_entries, *inline_entries]}.values()]
+        if dedup_policy:
+            entries = remove_duplicates(entries, dedup_policy, style)
+        bibs = transform_bibtex(entries, transform)  # type: ignore
     except Exception:
         msg = "Error while parsing bibtexs. Check sources."
         raise ValueError(msg)
-    with open(out_file, "w") as f:
-        f.write("".join(bibs))
+    write_if_changed(out_file, "".join(bibs))
     metadata["bibliography"] = [str(out_file.absolute())]
     return out_file
 
 
+# NOTE: Part of the key of the cached CSL-JSON subsets. Changes when their
+#       conversion changes so that the stale subsets aren't reused.
+csl_json_version = 2
+
+
+def generate_csl_json(in_file: Path, metadata: Dict, text: str,
+                      transform_names: List[str],
+                      service: Optional[BibliographyService] = None) -> Optional[Path]:
+    """Generate a CSL-JSON bibliography of only the cited entries for citeproc.
+
+    Args:
+        in_file: input file
+        metadata: Metadata for the file including bibliography files
+        text: Text of the input file
+        transform_names: Names of transforms to apply to the entries
+        service: The bibliography service to get the entries from. A new one
+                 is used if not given.
+
+    Pandoc parses every entry of the bibliography files given to it even if
+    only a few are cited, and it reads CSL-JSON much faster than bibtex. The
+    cited subset is written to the cache directory with a name derived from
+    the input file and a hash of the citations, bibliography files,
+    transforms and the venues and abbreviations files they use. The file is reused as long as the hash doesn't change and
+    stale subsets of the same input file are removed.
+
+    The bibtex files in :code:`bibliography` in :code:`metadata` are
+    replaced with the subset. Other files (e.g., CSL-JSON or CSL-YAML) are
+    kept as they are. Returns :code:`None` and leaves the metadata unchanged
+    if there are no bibtex files.
+
+    """
+    bib_files = [x for x in bibliography_files(metadata)
+                 if Path(x).suffix.lower() in {".bib", ".bibtex"}]
+    other_files = [x for x in bibliography_files(metadata) if x not in bib_files]
+    if not bib_files:
+        return None
+    keys = cited_keys(text)
+    doc_hash = hashlib.md5(str(in_file.absolute()).encode()).hexdigest()[:8]
+    service = service or BibliographyService()
+    hash_input = [csl_json_version, keys, transform_names, transforms.settings_fingerprint(),
+                  *service.fingerprints(bib_files)]
+    cites_hash = hashlib.md5(json.dumps(hash_input).encode()).hexdigest()[:16]
+    prefix = f"{in_file.stem}-{doc_hash}-"
+    out_file = cache_dir("csl").joinpath(f"{prefix}{cites_hash}.json")
+    if not out_file.exists():
+        entries = service.cited_entries(bib_files, keys)
+        transform = service.transform(transform_names)
+        try:
+            refs = [entry_to_csl(ent) for ent in transform([x.copy() for x in entries])]
+        except Exception:
+            msg = "Error while parsing bibtexs. Check sources."
+            raise ValueError(msg)
+        for stale in out_file.parent.glob(f"{prefix}*.json"):
+            stale.unlink()
+        write_if_changed(out_file, json.dumps(refs, ensure_ascii=False, indent=2))
+    metadata["bibliography"] = [str(out_file), *other_files]
+    return out_file
+
+
 default_transforms = ["abbreviate_venue", "change_to_title_case", "normalize"]
 
 
@@ -98,8 +361,10 @@ def transform_bibtex(entries: List[Dict[str, str]], transform: Callable) -> List
 
     Args:
         entries: Bibtex entries as a dictionary
+        transform: A batch transform. See :func:`compose_batch_transforms`
 
-    The functions are applied in order.
+    The entries are copied before transforming. Entries with the same key
+    are written only once, the last one is kept.
 
     """
     # Can either use abbreviate after full names or contractions
@@ -113,13 +378,189 @@ def transform_bibtex(entries: List[Dict[str, str]], transform: Callable) -> List
     # t = compose(transforms.change_to_title_case,
     #             transforms.contract_venue,
     #             transforms.normalize)
-    writer = bwriter.BibTexWriter(write_common_strings=True)
+    writer = bibtex_writer()
     retval: Dict[str, str] = {}
-    for ent in entries:
+    for ent in transform([ent.copy() for ent in entries]):
         # TODO: Filter duplicates somewhere here maybe
         ID = ent["ID"]
         # if ID in retval:
         #     existing = retval[ID]
         #     check_which_one_to_keep
-        retval[ID] = writer._entry_to_bibtex(transform(ent.copy()))
+        retval[ID] = writer._entry_to_bibtex(ent)
     return [*retval.values()]
+
+
+def iter_bib_entries(bib_files: List[str]) -> Iterator[str]:
+    """Iterate over the raw bibtex entries in :code:`bib_files` without reading them whole.
+
+    Args:
+        bib_files: List of bibliography files
+
+    An entry begins at a line starting with "@" and continues till the next
+    such line. Any text before the first entry is ignored.
+
+    """
+    for bf in bib_files:
+        lines: List[str] = []
+        with open(bf) as f:
+            for line in f:
+                if line.lstrip().startswith("@") and lines:
+                    yield "".join(lines)
+                    lines = []
+                if lines or line.lstrip().startswith("@"):
+                    lines.append(line)
+        if lines:
+            yield "".join(lines)
+
+
+def iter_bib_chunks(bib_files: List[str], chunk_size: int) -> Iterator[Tuple[str, List[str]]]:
+    """Group raw bibtex entries into chunks for parallel processing.
+
+    Args:
+        bib_files: List of bibliography files
+        chunk_size: Number of entries in a chunk
+
+    Yield tuples of :code:`(kind, entries)`. Kind is "entries" for a chunk of
+    regular entries. :code:`@string` definitions seen so far are prepended
+    to every chunk so that they can be expanded while parsing. A
+    :code:`@preamble` is yielded as a separate chunk of kind "raw" to be
+    written as is. :code:`@comment` entries are dropped.
+
+    """
+    strings: List[str] = []
+    chunk: List[str] = []
+    for entry in iter_bib_entries(bib_files):
+        kind = entry.lstrip()[1:].split("{", 1)[0].split("(", 1)[0].strip().lower()
+        if kind == "string":
+            strings.append(entry)
+        elif kind == "comment":
+            continue
+        elif kind == "preamble":
+            if chunk:
+                yield "entries", [*strings, *chunk]
+                chunk = []
+            yield "raw", [entry]
+        else:
+            chunk.append(entry)
+            if len(chunk) >= chunk_size:
+                yield "entries", [*strings, *chunk]
+                chunk = []
+    if chunk:
+        yield "entries", [*strings, *chunk]
+
+
+def _parse_chunk(index: int, chunk: List[str]) -> List[Dict[str, str]]:
+    parser = bibtex_parser()
+    try:
+        return parser.parse("".join(chunk)).entries
+    except Exception as e:
+        raise ValueError(f"Error while parsing chunk {index} of bibtexs: {e}")
+
+
+def _chunk_records(args: Tuple[int, str, List[str], List[str], Dict[int, List[str]]]) ->\
+        List[dedup.Record]:
+    index, kind, chunk, _, _ = args
+    if kind == "raw":
+        return []
+    return [dedup.Record(x) for x in _parse_chunk(index, chunk)]
+
+
+def _normalize_chunk(args: Tuple[int, str, List[str], List[str], Dict[int, List[str]]]) ->\
+        List[Tuple[str, str]]:
+    index, kind, chunk, transform_names, aliases = args
+    if kind == "raw":
+        return [("", x) for x in chunk]
+    transform = compose_batch_transforms(transform_names)
+    writer = bibtex_writer()
+    entries = _parse_chunk(index, chunk)
+    for i, keys in aliases.items():
+        ids = [x.strip() for x in entries[i].get("ids", "").split(",") if x.strip()]
+        entries[i]["ids"] = ",".join([*ids, *(x for x in keys if x not in ids)])
+    return [(ent["ID"], writer._entry_to_bibtex(ent)) for ent in transform(entries)]
+
+
+def normalize_bibliography(bib_files: List[str], out_file: Path, transform_names: List[str],
+                           jobs: int = 1, chunk_size: int = 1000,
+                           dedup_policy: Optional[str] = None) -> int:
+    """Normalize bibliography files with the transforms in parallel.
+
+    Args:
+        bib_files: List of bibliography files
+        out_file: Output file
+        transform_names: Names of transforms to apply to the entries
+        jobs: Number of worker processes
+        chunk_size: Number of entries sent to a worker at a time
+        dedup_policy: If given, remove duplicate entries keeping one according
+                      to the policy. See :mod:`pndconf.dedup`
+
+    The files are streamed in chunks through a process pool and the results
+    are written in the original order as they arrive, so that the whole
+    library is never held in memory. The workers get the same venues and
+    abbreviations files as the current process. The output replaces
+    :code:`out_file` only if it changed.
+
+    Only the first entry of any key is written. With :code:`dedup_policy`, a
+    first pass over the chunks computes only the fingerprints of the entries
+    (see :class:`pndconf.dedup.Record`) to find the duplicates, and those are
+    skipped while writing. The keys of the skipped entries are added to the
+    :code:`ids` field of the kept one, so that biblatex resolves citations of
+    them. Bibtex ignores :code:`ids`, so documents using bibtex must cite the
+    kept keys.
+
+    Returns the number of entries written.
+
+    """
+    # NOTE: Keys of the dropped entries for each chunk, keyed by the index of
+    #       the kept entry in the chunk
+    chunk_aliases: Dict[int, Dict[int, List[str]]] = {}
+
+    def chunks():
+        return ((i, kind, chunk, transform_names, chunk_aliases.get(i, {}))
+                for i, (kind, chunk) in enumerate(iter_bib_chunks(bib_files, chunk_size)))
+
+    temp_file = temp_file_for(out_file)
+    count = 0
+    pool = multiprocessing.Pool(jobs, initializer=transforms.apply_settings,
+                                initargs=(transforms.get_settings(),)) if jobs > 1 else None
+    imap = pool.imap if pool else map
+    try:
+        drop: Dict[int, int] = {}
+        records: List[dedup.Record] = []
+        if dedup_policy:
+            locations: List[Tuple[int, int]] = []
+            for i, recs in enumerate(imap(_chunk_records, chunks())):
+                locations.extend((i, j) for j in range(len(recs)))
+                records.extend(recs)
+            drop = dedup.duplicates_to_drop(records, dedup_policy)
+            logi(f"Removing {len(drop)} duplicate entries")
+            for i, keep in sorted(drop.items()):
+                key, kept_key = records[i].key, records[keep].key
+                logi(f"Dropping {key} as a duplicate of {kept_key}")
+                if key != kept_key:
+                    chunk, j = locations[keep]
+                    keys = chunk_aliases.setdefault(chunk, {}).setdefault(j, [])
+                    if key not in keys:
+                        keys.append(key)
+        written: Set[str] = set()
+        index = 0
+        with open(temp_file, "w") as f:
+            for bibs in imap(_normalize_chunk, chunks()):
+                for key, bib in bibs:
+                    if key:
+                        index += 1
+                        if index - 1 in drop:
+                            continue
+                        if key in written:
+                            logw(f"Skipping duplicate key {key}")
+                            continue
+                        written.add(key)
+                    f.write(bib)
+                    count += 1
+    except Exception:
+        temp_file.unlink()
+        raise
+    finally:
+        if pool:
+            pool.terminate()
+    replace_if_changed(temp_file, out_file)
+    return count
@@ -1,18 +1,24 @@
 from typing import Dict, Union, List, Optional, Callable, Tuple
 import os
+import hashlib
 from pathlib import Path
 
 from common_pyutil.functional import unique
 
-from .util import (update_command, get_csl_or_template, expandpath,
-                   compress_space, logd, loge, logi, logbi, logw)
-from .bibliography import generate_bibtex
+from .util import (update_command, compress_space, logd, loge, logi, logbi, logw)
+from .bibliography import generate_bibtex, generate_csl_json, cited_keys, bibliography_files
+from .resources import ResourceIndex
 
 Pathlike = Union[str, Path]
 
+# NOTE: The LaTeX engines which pndconf can run, with their switch to not
+#       write the pdf on a pass
+tex_engines = {"pdflatex": "-draftmode", "lualatex": "-draftmode", "xelatex": "-no-pdf"}
+
 
 def get_template_or_csl_subr(argtype: str, csl_or_template: str,
-                             search_dir: Optional[Path], in_file: Pathlike):
+                             search_dir: Optional[Path], in_file: Pathlike,
+                             resources: Optional[ResourceIndex] = None):
     """Subroutine to get possible file name from csl or template name.
 
     Args:
@@ -20,6 +26,8 @@ def get_template_or_csl_subr(argtype: str, csl_or_template: str,
         csl_or_template: String value representing CSL or Pandoc Template
         search_dir: The path where possible file candidates are stored
         in_file: The input file path
+        resources: The index of the search directories. A new one is used if
+                   not given.
 
     :code:`csl_or_template` can be a full path, a relative path or simply a string sans
     extension. Its existence is checked in order:
@@ -27,39 +35,71 @@ def get_template_or_csl_subr(argtype: str, csl_or_template: str,
 
     Where relative_path is the path relative to input file
 
+    See :meth:`pndconf.resources.ResourceIndex.resolve`
+
     """
-    maybe_file = None
-    if Path(csl_or_template).exists():
-        maybe_file = expandpath(csl_or_template)
-    elif search_dir:
-        maybe_file = get_csl_or_template(argtype, csl_or_template, search_dir)
-    if maybe_file and Path(maybe_file).exists():
-        return str(maybe_file)
-    if argtype in [x.name for x in Path(in_file).parent.iterdir()]:
-        check_dir = Path(in_file).parent.joinpath(argtype).absolute()
-        maybe_file = get_csl_or_template(argtype, csl_or_template, check_dir)
-    if maybe_file and Path(maybe_file).exists():
-        return str(maybe_file)
-    else:
-        check_dir = Path(in_file).parent
-        maybe_file = get_csl_or_template(argtype, csl_or_template, check_dir)
-        if Path(maybe_file).exists():
-            return str(maybe_file)
-        else:
-            logw(f"{argtype} file for \"{csl_or_template}\" not found. "
-                 "This will default to pandoc template if it exists")
-            return str(maybe_file)
+    resources = resources or ResourceIndex()
+    return resources.resolve(argtype, csl_or_template, search_dir, in_file)
+
+
+def resource_dirs(csl_dir: Optional[Path], templates_dir: Optional[Path],
+                  in_file: Pathlike) -> List[Path]:
+    """Return the directories searched for CSL and template files for :code:`in_file`
+
+    Args:
+        csl_dir: The CSL directory from the config
+        templates_dir: The templates directory from the config
+        in_file: The input file path
+
+    See :func:`get_template_or_csl_subr`
+
+    """
+    parent = Path(in_file).parent
+    dirs = [x for x in [csl_dir, templates_dir] if x]
+    return [*dirs, parent, parent.joinpath("csl"), parent.joinpath("template")]
+
+
+def pdf_files_dir(output_dir: Path, in_file: Pathlike, same_pdf_output_dir: bool) -> Path:
+    """Return the directory in which pdflatex writes the files for :code:`in_file`
+
+    Args:
+        output_dir: The output directory from the config
+        in_file: The input file path
+        same_pdf_output_dir: Whether the pdf is output to the directory of :code:`in_file`
+
+    See :meth:`Commands.get_pdf_output_dir`
+
+    """
+    if same_pdf_output_dir:
+        return Path(in_file).parent.absolute()
+    return Path(f"{Path(output_dir).joinpath(Path(in_file).stem)}_files")
+
+
+def citations_record(files_dir: Pathlike, in_file: Pathlike) -> Path:
+    """Return the file recording the citations when bibtex or biber last succeeded.
+
+    Args:
+        files_dir: The directory in which pdflatex writes the files
+        in_file: The input file path
+
+    See :meth:`Commands.citations_changed`
+
+    """
+    return Path(files_dir).joinpath(Path(in_file).stem + ".cites")
 
 
 def update_in_file_paths(in_file_pandoc_opts: Dict[str, str], csl_dir: Optional[Path],
-                         templates_dir: Optional[Path], in_file: Pathlike):
+                         templates_dir: Optional[Path], in_file: Pathlike,
+                         resources: Optional[ResourceIndex] = None):
+    resources = resources or ResourceIndex()
     if "csl" in in_file_pandoc_opts:
-        v = get_template_or_csl_subr("csl", in_file_pandoc_opts["csl"], csl_dir, in_file)
+        v = get_template_or_csl_subr("csl", in_file_pandoc_opts["csl"], csl_dir, in_file,
+                                     resources)
         # v = csl_subr(in_file_pandoc_opts["csl"], csl_dir, in_file)
         in_file_pandoc_opts["csl"] = v
     if "template" in in_file_pandoc_opts:
         v = get_template_or_csl_subr("template", in_file_pandoc_opts["template"],
-                                     templates_dir, in_file)
+                                     templates_dir, in_file, resources)
         # v = template_subr(in_file_pandoc_opts["template"], templates_dir, in_file)
         in_file_pandoc_opts["template"] = v
     for k, v in in_file_pandoc_opts.items():
@@ -90,14 +130,120 @@ class Commands:
         self.file_pandoc_opts = file_pandoc_opts
         self.handlers = {"-M": self.handle_metadata_field,
                          "-V": self.handle_variable_field}
+        self._citeproc_bibliography_done = False
+        # NOTE: The bibliography files read by the LaTeX commands. See
+        #       :meth:`add_pdf_specific_options`
+        self.bib_files: List[str] = []
 
     @property
     def pdflatex(self) -> str:
-        return 'pdflatex  -file-line-error ' +\
+        return self.tex_command("pdflatex")
+
+    def tex_command(self, engine: str, engine_opts: Optional[List[str]] = None) -> str:
+        """Return the command to compile the tex file with :code:`engine`
+
+        Args:
+            engine: The LaTeX engine, one of :data:`tex_engines`
+            engine_opts: Extra options for the engine
+
+        """
+        interaction = self.config.profile_setting("interaction", "nonstopmode")
+        return f'{engine}  -file-line-error ' +\
             (" " if self.config.same_pdf_output_dir else
              '-output-directory ' + self.out_path_no_ext + '_files') +\
-             ' -interaction=nonstopmode --synctex=1 ' +\
-             self.out_path_no_ext + '.tex'
+             f' -interaction={interaction} --synctex=1 ' +\
+            "".join(f"{x} " for x in engine_opts or []) +\
+            self.out_path_no_ext + '.tex'
+
+    def pdf_engine(self, command: List[str]) -> str:
+        """Return the engine given with :code:`--pdf-engine` in :code:`command`
+
+        Args:
+            command: The command as a list of switches
+
+        Defaults to pdflatex if it's not given.
+
+        """
+        engines = [x.split("=", 1)[1] for x in command if x.startswith("--pdf-engine=")]
+        return engines[-1] if engines else "pdflatex"
+
+    def uses_build_dir(self, ft: str, command: List[str]) -> bool:
+        """Whether the pdf which pandoc writes directly is built in the persistent build dir.
+
+        Args:
+            ft: The filetype
+            command: The command as a list of switches
+
+        Only if the option :code:`persistent_build_dir` is set and the engine
+        is a LaTeX engine. See :meth:`route_via_build_dir`
+
+        """
+        if not self.config.persistent_build_dir or\
+           self.config.filetype_opts(ft).get("-o") != "pdf":
+            return False
+        engine = self.pdf_engine(command)
+        if Path(engine).name not in tex_engines:
+            logw(f"Can't run pdf engine {engine} in the build dir. Pandoc will run it")
+            return False
+        return True
+
+    def route_via_build_dir(self, command: List[str]) -> Tuple[str, List[str]]:
+        """Make pandoc write the tex file instead of the pdf
+
+        Args:
+            command: The command as a list of switches. It's modified in place
+
+        The pdf engine options are removed from the command and it's made
+        standalone, as pandoc does for a pdf. Returns the
+        engine and its options, so that pndconf runs it in the directory
+        :code:`<stem>_files`, which is kept between builds. Its aux, toc and
+        bbl files are then reused and the logs can be inspected.
+
+        """
+        engine = self.pdf_engine(command)
+        engine_opts = [x.split("=", 1)[1] for x in command if x.startswith("--pdf-engine-opt=")]
+        command[:] = [x for x in command if not x.startswith("--pdf-engine")]
+        command[:] = [f"-o {self.out_path_no_ext}.tex" if x == f"-o {self.out_path_no_ext}.pdf"
+                      else x for x in command]
+        if not {"-s", "--standalone"}.intersection(command):
+            command.append("-s")
+        return engine, engine_opts
+
+    def citations_hash(self, bib_file: Optional[Path]) -> str:
+        """Return a hash of the cited keys and of the bibliography generated for them.
+
+        Args:
+            bib_file: The generated bibliography file
+
+        """
+        value = hashlib.md5("\n".join(sorted(cited_keys(self.file_text))).encode())
+        if bib_file and Path(bib_file).exists():
+            value.update(Path(bib_file).read_bytes())
+        return value.hexdigest()
+
+    def citations_changed(self, bib_file: Optional[Path]) -> bool:
+        """Whether the citations changed since bibtex or biber last succeeded.
+
+        Args:
+            bib_file: The generated bibliography file
+
+        The hash of the citations is recorded by the bibliography command. See
+        :func:`citations_record`
+
+        """
+        files_dir = pdf_files_dir(self.config.output_dir, self.in_file,
+                                  self.config.same_pdf_output_dir)
+        record = citations_record(files_dir, self.in_file)
+        bbl = files_dir.joinpath(self.filename_no_ext + ".bbl")
+        return not (record.exists() and bbl.exists() and
+                    record.read_text().strip() == self.citations_hash(bib_file))
+
+    def record_citations_cmd(self, bib_file: Optional[Path], tex_files_dir: str) -> str:
+        "Shell command suffix to record the citations after the bibliography command"
+        if not self.config.single_pass:
+            return ""
+        record = citations_record(Path(tex_files_dir).absolute(), self.in_file)
+        return f"&& echo {self.citations_hash(bib_file)} > {record}"
 
     def handle_metadata_field(self):
         msg = loge("Metadata field setting is not supported")
@@ -131,7 +277,8 @@ class Commands:
             self.file_pandoc_opts.get(k, None)
         if k in {"template", "csl"}:
             v = maybe_in_cmdline_or_file or\
-                get_template_or_csl_subr(k, value, self.config.templates_dir, self.in_file)
+                get_template_or_csl_subr(k, value, self.config.templates_dir, self.in_file,
+                                         self.config.resources)
         else:
             v = maybe_in_cmdline_or_file or value
         if k == "filter":
@@ -183,7 +330,8 @@ class Commands:
             self.file_pandoc_opts.get(k, None)
         if k in {"template", "csl"}:
             v = maybe_in_cmdline_or_file or\
-                get_template_or_csl_subr(k, value, self.config.templates_dir, self.in_file)
+                get_template_or_csl_subr(k, value, self.config.templates_dir, self.in_file,
+                                         self.config.resources)
         else:
             v = maybe_in_cmdline_or_file or value
         if k == "filter":
@@ -205,7 +353,9 @@ class Commands:
         return out_file
 
     def add_filters(self, command, k, v):
-        vals = unique(v.split(","))
+        vals = unique(x for x in v.split(",") if not x or not self.config.is_skipped_filter(x))
+        if not vals:
+            return
         if vals[0]:
             for val in vals:
                 command.append(f"--{k}={val}")
@@ -277,6 +427,21 @@ class Commands:
             bib_cmd = ""
         return bib_style, bib_cmd, sed_cmd
 
+    def use_citeproc_bibliography_subset(self):
+        """Point the bibliography to a CSL-JSON file with only the cited entries.
+
+        See :func:`pndconf.bibliography.generate_csl_json`. As the metadata is
+        shared by all the filetypes, it's done only once per input file.
+
+        """
+        if not self._citeproc_bibliography_done:
+            self._citeproc_bibliography_done = True
+            csl_json = generate_csl_json(Path(self.in_file), self.file_pandoc_opts,
+                                         self.file_text, self.config.bib_transforms,
+                                         service=self.config.bibliography)
+            if csl_json:
+                logd(f"Using cited bibliography subset {csl_json}")
+
     def pdf_cmd_switch_to_output_dir(self, mk_tex_files_dir):
         return f"cd {self.output_dir} {mk_tex_files_dir}"
 
@@ -311,13 +476,15 @@ class Commands:
                                 f'../{Path(self.out_path_no_ext).stem}.tex')\
                        .replace(f'cd {self.output_dir}', f'cd {tex_files_dir}')
 
-    def add_bibtex_cmd(self, bib_file: Path, tex_files_dir: str, pdflatex: str):
+    def add_bibtex_cmd(self, bib_file: Path, tex_files_dir: str, pdflatex: str,
+                       passes: int = 2):
         """Generate the BibTeX command
 
         Args:
             bib_file: Bibliography file
             tex_files_dir: Directory where LaTeX files are present
             pdflatex: :code:`pdflatex` command
+            passes: Number of :code:`pdflatex` passes after BibTeX
 
 
         """
@@ -326,23 +493,24 @@ class Commands:
         copy_bibtex = "" if self.config.same_pdf_output_dir\
             else f"&& cp {bib_file.absolute()} {tex_files_dir}/"
         cmd.append(f"cd {self.output_dir} {copy_bibtex}")
-        cmd.append(f"cd {tex_files_dir} && {bibtex}")
+        cmd.append(f"cd {tex_files_dir} && {bibtex} "
+                   f"{self.record_citations_cmd(bib_file, tex_files_dir)}".strip())
         if not self.config.same_pdf_output_dir:
             pdflatex = self.pdflatex_with_target_file_in_tex_files_dir(pdflatex, tex_files_dir)
-        cmd.append(pdflatex)
-        cmd.append(pdflatex)
+        cmd.extend([pdflatex] * passes)
         return cmd
 
     # FIXME: This may not be correct
     def add_biber_cmd(self, bib_file, tex_files_dir: str, pdflatex: str):
         cmd = []
         biber = f"biber {tex_files_dir}/{self.filename_no_ext}.bcf"
-        cmd.append(f"cd {self.output_dir} && {biber}")
+        cmd.append(f"cd {self.output_dir} && {biber} "
+                   f"{self.record_citations_cmd(bib_file, tex_files_dir)}".strip())
         cmd.append(pdflatex)
         return cmd
 
     def get_bib_commands(self, bib_cmd: str, bib_file: Path,
-                         tex_files_dir: Pathlike, pdflatex: str):
+                         tex_files_dir: Pathlike, pdflatex: str, passes: int = 2):
         """Generate the LaTeX specific bibliography commands.
 
         Args:
@@ -351,13 +519,14 @@ class Commands:
             tex_files_dir: Directory where LaTeX files are present
             pdflatex: The :code:`pdflatex` command.
                       :code:`pdflatex` may include directory switching as required.
+            passes: Number of :code:`pdflatex` passes after bibtex
 
 
         """
         if bib_cmd == "biber" and bib_file:
             bib_commands = self.add_biber_cmd(bib_file, str(tex_files_dir), pdflatex)
         elif bib_cmd == "bibtex":
-            bib_commands = self.add_bibtex_cmd(bib_file, str(tex_files_dir), pdflatex)
+            bib_commands = self.add_bibtex_cmd(bib_file, str(tex_files_dir), pdflatex, passes)
         else:
             bib_commands = []
             logw("No citation processor specified. References may not be defined correctly.")
@@ -374,24 +543,38 @@ class Commands:
                            joinpath(self.filename_no_ext + ".pdf"))
         return out_file
 
-    def add_pdf_specific_options(self, command: list[str], ft) -> List[str]:
+    def add_pdf_specific_options(self, command: list[str], ft,
+                                 build_dir: bool = False) -> List[str]:
         """Add pdf specific options to command list
 
         Args:
             command: The command as a list of switches
             ft: Filetype for generation. Even with pdf generation, certain
                 switches can vary
+            build_dir: Run the pdf engine in the persistent build dir instead
+                       of pandoc. See :meth:`route_via_build_dir`
+
+        With :code:`build_dir`, the engine is run once and is run again by
+        :func:`pndconf.compilers.exec_tex_command` only if LaTeX asks for it.
 
         """
         # CHECK: If we don't use pdflatex explicitly but still use bibtex/biblatex
         #        for bibliography, can we still use pandoc with that?
         #        I think we can specify bibliography files but I don't need these
         #        commands then
-        bib_style, bib_cmd, sed_cmd = self.get_bibliography_opts(command)
-        if bib_cmd and bib_style and not self.config.no_cite_cmd:
+        _, bib_cmd, sed_cmd = self.get_bibliography_opts(command)
+        bib_file = None
+        self.bib_files = [str(Path(self.in_file).parent.joinpath(x))
+                          for x in bibliography_files(self.file_pandoc_opts)]
+        if bib_cmd and not self.config.no_cite_cmd:
+            # NOTE: Inline references are converted natively now, so the style
+            #       follows the citation processor.
+            bib_style = "biblatex" if bib_cmd == "biblatex" else "bibtex"
             bib_file = generate_bibtex(Path(self.in_file), self.file_pandoc_opts, bib_style,
-                                       self.file_text, self.config.pandoc_path,
-                                       self.config.bib_transforms)
+                                       self.file_text, self.config.bib_transforms,
+                                       self.config.dedup_policy,
+                                       service=self.config.bibliography)
+            self.bib_files = [str(bib_file.absolute())]
         pdf_cmd = []
         if sed_cmd:
             pdf_cmd.append(sed_cmd)
@@ -399,25 +582,47 @@ class Commands:
         # NOTE: Output filetype was PDF but generation was tex in config
         #       OR use explicit pdflatex for pdf instead of pandoc's engine
         # FIXME: This should be more explicit somewhere
-        gentype = self.config.conf[ft].get("-o", None)
-        if gentype in {"tex", "latex"}:
-            logw(f"Asked to generate pdf but configuration says to generate {gentype}. "
-                 "Will generate via pdflatex.")
+        gentype = self.config.filetype_opts(ft).get("-o", None)
+        if gentype in {"tex", "latex"} or build_dir:
+            if build_dir:
+                engine, engine_opts = self.route_via_build_dir(command)
+            else:
+                engine, engine_opts = self.pdf_engine(command), []
+                logw(f"Asked to generate pdf but configuration says to generate {gentype}. "
+                     f"Will generate via {engine}.")
+            if Path(engine).name not in tex_engines:
+                logw(f"Unknown LaTeX engine {engine}. Will use pdflatex")
+                engine = "pdflatex"
             tex_files_dir, mk_tex_files_dir = self.get_pdf_output_dir()
             # NOTE: cd {self.output_dir} is crucial for correct directory
             #       selection
-            pdflatex = f"cd {self.output_dir} && {self.pdflatex}"
+            pdflatex = f"cd {self.output_dir} && {self.tex_command(engine, engine_opts)}"
             pdf_cmd.append(self.pdf_cmd_switch_to_output_dir(mk_tex_files_dir))
-            if self.config.no_cite_cmd and not self.config.same_pdf_output_dir:
+            # NOTE: A single pass profile and the build dir reuse the aux files
+            #       of the previous builds
+            if self.config.no_cite_cmd and not self.config.same_pdf_output_dir and\
+               not self.config.single_pass and not build_dir:
                 pdf_cmd.append(f"rm {tex_files_dir}/*")
-            pdf_cmd.append(pdflatex)
+            run_bib = self.config.no_citeproc and not self.config.no_cite_cmd
+            if run_bib and self.config.single_pass and not self.citations_changed(bib_file):
+                logbi(f"Citations unchanged. Not running {bib_cmd} as profile is "
+                      f"{self.config.profile}")
+                run_bib = False
+            # NOTE: Only the last pass needs to write the pdf
+            if run_bib and (self.config.single_pass or build_dir):
+                pdf_cmd.append(pdflatex.replace(f"{engine} ", f"{engine} "
+                                                f"{tex_engines[Path(engine).name]} ", 1))
+            else:
+                pdf_cmd.append(pdflatex)
 
             if not self.config.same_pdf_output_dir:
                 pdflatex = self.pdflatex_with_target_file_in_parent_dir(pdflatex)
             if self.config.no_cite_cmd:
                 logbi(f"Not running bibtex command {bib_cmd} as asked.")
-            elif self.config.no_citeproc:
-                bib_commands = self.get_bib_commands(bib_cmd, bib_file, tex_files_dir, pdflatex)
+            elif run_bib:
+                passes = 1 if self.config.single_pass or build_dir else 2
+                bib_commands = self.get_bib_commands(bib_cmd, bib_file, tex_files_dir, pdflatex,
+                                                     passes)
                 pdf_cmd.extend(bib_commands)
         return pdf_cmd
 
@@ -433,11 +638,11 @@ class Commands:
 
         """
         commands = {}
+        update_in_file_paths(self.file_pandoc_opts, self.config.csl_dir,
+                             self.config.templates_dir, self.in_file, self.config.resources)
         for ft in self.config.filetypes:
             command: List[str] = []
-            update_in_file_paths(self.file_pandoc_opts, self.config.csl_dir,
-                                 self.config.templates_dir, self.in_file)
-            for k, v in self.config.conf[ft].items():
+            for k, v in self.config.filetype_opts(ft).items():
                 if k == '-M':
                     self.handle_metadata_field()
                 elif k == '-V':
@@ -450,12 +655,21 @@ class Commands:
                     command.append(f"{k} {v}" if v else f"{k}")
 
             self.fix_command_for_pandoc_versions(command)
+            if not self.config.no_citeproc and\
+               ("--citeproc" in command or "--filter=pandoc-citeproc" in command):
+                self.use_citeproc_bibliography_subset()
+
+            # NOTE: The file pandoc writes. For pdf it's an intermediate file
+            pandoc_out_file = out_file
 
             # TODO: Add EXPLICIT option in config for pdf generation via
             #       pdflatex
-            if ft == 'pdf':
-                pdf_cmd = self.add_pdf_specific_options(command, ft)
+            build_dir = self.uses_build_dir(ft, command)
+            if ft == 'pdf' or build_dir:
+                pdf_cmd = self.add_pdf_specific_options(command, ft, build_dir)
                 out_file = self.pdf_out_file
+                if build_dir:
+                    pandoc_out_file = f"{self.out_path_no_ext}.tex"
             else:
                 pdf_cmd = ""
 
@@ -466,6 +680,10 @@ class Commands:
             commands[ft] = {"command": cmd,
                             "in_file": self.in_file,
                             "out_file": out_file,
+                            "pandoc_out_file": pandoc_out_file,
                             "in_file_opts": self.file_pandoc_opts,
-                            "text": self.file_text}
+                            "text": self.file_text,
+                            "preamble_format": bool(pdf_cmd) and self.config.precompile_preamble,
+                            "rerun": build_dir,
+                            "bib_files": self.bib_files if pdf_cmd else []}
         return commands
@@ -1,11 +1,15 @@
-from typing import Dict, Any, Union, List, Optional, cast
+from typing import Dict, Any, Union, List, Optional, Tuple, cast
 import os
 import re
-import chardet
+import json
+import hashlib
+from pathlib import Path
 import yaml
-from subprocess import Popen, PIPE
+from subprocess import Popen, PIPE, DEVNULL
 
-from .util import get_now as now, logbbi
+from .util import (get_now as now, logbbi, logbi, temp_file_for, replace_if_changed,
+                   build_stats, cache_dir, path_fingerprint)
+from .formats import with_format
 from .const import COLORS
 
 
@@ -23,6 +27,7 @@ class TexCompiler:
         self.log_file_encoding = "ISO-8859-1"
         self.env_vars = env_vars
         self.mode = "latex"
+        self.engine = "pdflatex"
         # TODO: Change with re matches
         self.messages = {"latex":
                          {"info": "*",
@@ -37,7 +42,7 @@ class TexCompiler:
 
     @property
     def cmdname(self) -> str:
-        return "pdflatex" if self.mode == "latex" else "biber"
+        return self.engine if self.mode == "latex" else "biber"
 
     @property
     def info(self) -> str:
@@ -110,6 +115,44 @@ class TexCompiler:
         cc = COLORS.BRIGHT_RED
         return self.get_colored(paras, self.fatal, cc)
 
+    def read_log(self, opts: List[str], ind: int) -> List[str]:
+        """Return the paragraphs of the log file of pdflatex
+
+        Args:
+            opts: The pdflatex command split on whitespace
+            ind: Index of the output directory switch in :code:`opts`
+
+        """
+        log_file_name = os.path.basename(opts[-1]).replace(".tex", ".log").strip()
+        log_file = os.path.join(opts[ind+1].strip(), log_file_name)
+        with open(log_file, "rb") as f:
+            log_bytes = f.read()
+        try:
+            return log_bytes.decode(self.log_file_encoding).split("\n\n")
+        except UnicodeDecodeError as e:
+            print(f"UTF codec failed for log_file {log_file}. Error {e}")
+            import chardet
+            self.log_file_encoding = chardet.detect(log_bytes)["encoding"]
+            print(f"Opening with new codec {self.log_file_encoding}")
+            return log_bytes.decode(self.log_file_encoding, "ignore").split("\n\n")
+
+    def needs_rerun(self, command: str) -> bool:
+        """Whether LaTeX asked to be run again after :code:`command`, e.g., for references
+
+        Args:
+            command: Command string
+
+        """
+        opts = re.split(r'\s+', command)
+        inds = [i for i, x in enumerate(opts) if "output-directory" in x]
+        if self.mode != "latex" or not inds:
+            return False
+        try:
+            log_text = "\n\n".join(self.read_log(opts, inds[0]))
+        except OSError:
+            return False
+        return bool(rerun_regexp.search(log_text))
+
     def compile(self, command: str) -> bool:
         """Compile with `command`
 
@@ -130,6 +173,10 @@ class TexCompiler:
             ind: Optional[int] = inds[0]
         else:
             ind = None
+        # NOTE: pdflatex doesn't print anything in batchmode, so the messages
+        #       are read from the log file
+        if self.mode == "latex" and ind is not None and "-interaction=batchmode" in opts:
+            out = "\n\n".join(self.read_log(opts, ind))
         paras = self.get_paras(out)
         warnings = self.get_warnings(paras)
         errors = self.get_errors(paras)
@@ -141,17 +188,7 @@ class TexCompiler:
                 print(f"{i+1}. \t{x}")
             return False
         if self.mode == "latex" and ind is not None:
-            log_file_name = os.path.basename(opts[-1]).replace(".tex", ".log").strip()
-            log_file = os.path.join(opts[ind+1].strip(), log_file_name)
-            with open(log_file, "rb") as f:
-                log_bytes = f.read()
-            try:
-                log_text = log_bytes.decode(self.log_file_encoding).split("\n\n")
-            except UnicodeDecodeError as e:
-                print(f"UTF codec failed for log_file {log_file}. Error {e}")
-                self.log_file_encoding = chardet.detect(log_bytes)["encoding"]
-                print(f"Opening with new codec {self.log_file_encoding}")
-                log_text = log_bytes.decode(self.log_file_encoding, "ignore").split("\n\n")
+            log_text = self.read_log(opts, ind)
             warnings.extend([re.split(r'(\n\s+\n)', x)[0].
                              replace("Undefined",
                                      COLORS.ALT_RED +
@@ -176,23 +213,46 @@ class TexCompiler:
 
 tex_compiler = TexCompiler()
 
+# NOTE: Messages in the LaTeX log asking for another run
+rerun_regexp = re.compile(r"Rerun to get|Label\(s\) may have changed|Please rerun LaTeX|"
+                          r"Rerun LaTeX")
+
+# NOTE: Maximum number of runs of a LaTeX command which is run again on demand
+max_tex_runs = 4
+
 
 def is_tex_command(cmd: str) -> bool:
     splits = cmd.split("&&")
-    return any([re.match("^pdflatex|pdftex|biber", s.strip(), flags=re.IGNORECASE)
+    return any([re.match(r"^(\S*/)?(pdflatex|xelatex|lualatex|pdftex|biber)\b", s.strip(),
+                         flags=re.IGNORECASE)
                 for s in splits])
 
 
-def exec_tex_command(command):
+def exec_tex_command(command, rerun: bool = False):
+    """Execute a TeX command with :data:`tex_compiler`
+
+    Args:
+        command: The command
+        rerun: Run the command again while LaTeX asks for it, at most
+               :data:`max_tex_runs` times
+
+    """
     try:
         # status = exec_tex_compile(command)
-        if "pdftex" in command or "pdflatex" in command:
+        engines = re.findall(r"\b(pdflatex|xelatex|lualatex|pdftex)\b", command)
+        if engines:
             tex_compiler.mode = "latex"
+            tex_compiler.engine = engines[0]
         elif "biber" in command:
             tex_compiler.mode = "biber"
         else:
             raise ValueError(f"Unknown tex command in {command}")
         status = tex_compiler.compile(command)
+        runs = 1
+        while rerun and status and runs < max_tex_runs and tex_compiler.needs_rerun(command):
+            runs += 1
+            print(f"Running {tex_compiler.cmdname} again ({runs}) as LaTeX asked for it")
+            status = tex_compiler.compile(command)
         return status
     except Exception as e:
         print(f"Error occured while compiling file {e}")
@@ -218,7 +278,8 @@ def error_message(err, p):
         print("Some unknown error reported. If all outputs seem fine, then ignore it.")
 
 
-def exec_command(command: str, stdin: Optional[str] = None, noshell: bool = False):
+def exec_command(command: str, stdin: Optional[Union[str, bytes]] = None,
+                 noshell: bool = False, rerun: bool = False):
     """Execute a command via :class:`Popen`.
 
     The command is exectued with `shell=True`. Use `noshell=True` for inverting
@@ -226,8 +287,10 @@ def exec_command(command: str, stdin: Optional[str] = None, noshell: bool = Fals
 
     Args:
         command: The command to execute
-        stdin: Optional input to give to command via stdin
+        stdin: Optional input to give to command via stdin. :class:`bytes`
+               are given as they are, without a copy.
         noshell: Whether not to use shell
+        rerun: Run a LaTeX command again while it asks for it. See :func:`exec_tex_command`
 
     Aside from arbitrary shell commands, `pdftex`, `pdflatex` and `biber` are
     compiled via a separate :class:`TexCompiler` for printing legible color
@@ -242,13 +305,13 @@ def exec_command(command: str, stdin: Optional[str] = None, noshell: bool = Fals
     print(f"{prefix}{cmd}")
     os.chdir(os.path.abspath(os.getcwd()))
     if is_tex_command(command):
-        return exec_tex_command(command)
+        return exec_tex_command(command, rerun)
 
     if stdin:
         p = Popen(command, stdin=PIPE, stdout=PIPE, stderr=PIPE, shell=shell)
-        output = p.communicate(input=stdin.encode())
+        output = p.communicate(input=stdin.encode() if isinstance(stdin, str) else stdin)
     else:
-        p = Popen(command, stdout=PIPE, stderr=PIPE, shell=shell)
+        p = Popen(command, stdin=DEVNULL, stdout=PIPE, stderr=PIPE, shell=shell)
         output = p.communicate()
     out = output[0].decode("utf-8")
     err = output[1].decode("utf-8")
@@ -261,6 +324,159 @@ def exec_command(command: str, stdin: Optional[str] = None, noshell: bool = Fals
         return False
 
 
+# NOTE: Matches \includegraphics, \input and \include with the file name,
+#       which pandoc braces like {{name.with.dots}.png}
+tex_input_regexp = re.compile(r"\\(includegraphics|input|include)\s*(?:\[[^\]]*\])?\s*"
+                              r"\{((?:[^{}]|\{[^{}]*\})+)\}")
+graphics_extensions = [".pdf", ".png", ".jpg", ".jpeg", ".eps"]
+
+
+def tex_inputs(text: str, directory: Path) -> List[str]:
+    """Return the files included by a LaTeX document.
+
+    Args:
+        text: The LaTeX text
+        directory: The directory from which TeX runs
+
+    The files are those of :code:`\\includegraphics`, :code:`\\input` and
+    :code:`\\include`, with the implied extensions. A name which doesn't
+    resolve to an existing file is returned as a path, so that the file being
+    created later is noticed.
+
+    """
+    files = []
+    for command, name in tex_input_regexp.findall(text):
+        path = directory.joinpath(name.replace("{", "").replace("}", "").strip())
+        extensions = graphics_extensions if command == "includegraphics" else [".tex"]
+        candidates = [path, *(path.with_name(path.name + x) for x in extensions)]
+        files.append(str(next((x for x in candidates if x.is_file()), path)))
+    return files
+
+
+def cutoff_key(tex_file: str, commands: List[str],
+               bib_files: Optional[List[str]] = None) -> str:
+    """Return the key of the commands following pandoc in a chain.
+
+    Args:
+        tex_file: The tex file which pandoc wrote
+        commands: The commands following pandoc, as they'll be run
+        bib_files: The bibliography files read by the commands
+
+    It's a hash of the contents of :code:`tex_file`, the commands and the
+    fingerprints of :code:`bib_files` and the files which :code:`tex_file`
+    includes. See :func:`tex_inputs`.
+
+    """
+    text = Path(tex_file).read_bytes()
+    value = hashlib.md5(text)
+    value.update("\n".join(commands).encode())
+    inputs = tex_inputs(text.decode(errors="replace"), Path(tex_file).absolute().parent)
+    for path in [*(bib_files or []), *inputs]:
+        value.update(json.dumps(path_fingerprint(path)).encode())
+    return value.hexdigest()
+
+
+def cutoff_record(tex_file: str) -> Path:
+    "Return the file recording the :func:`cutoff_key` of the last successful build of :code:`tex_file`"
+    name = hashlib.md5(str(Path(tex_file).absolute()).encode()).hexdigest()[:16]
+    return cache_dir("cutoff").joinpath(name)
+
+
+def exec_command_chain(commands: List[str], stdin: Optional[Union[str, bytes]] = None,
+                       pandoc_out_file: Optional[str] = None,
+                       preamble_format: bool = False, rerun: bool = False,
+                       out_file: Optional[str] = None,
+                       bib_files: Optional[List[str]] = None) -> bool:
+    """Execute a chain of commands for a single output filetype.
+
+    Args:
+        commands: The commands. The first one is always the pandoc command.
+        stdin: Input to the pandoc command. The other commands don't read
+               stdin and aren't given it.
+        pandoc_out_file: The file which pandoc writes
+        preamble_format: Run pdflatex with a precompiled format of the preamble
+                         of :code:`pandoc_out_file`. See :func:`pndconf.formats.with_format`
+        rerun: Run the LaTeX commands again while they ask for it, instead of a
+               fixed number of passes
+        out_file: The final output of the chain. Required for the early cutoff
+        bib_files: The bibliography files read by the commands following pandoc
+
+    If pandoc writes a :code:`.tex` file, it's written to a temporary file
+    first. Any non TeX commands following pandoc which refer to that file (like
+    :code:`sed`) also operate on the temporary file. It then replaces the
+    actual file only if the contents have changed, so that the mtime of an
+    unchanged :code:`.tex` file doesn't change. See
+    :func:`pndconf.util.replace_if_changed`.
+
+    The commands following pandoc are skipped if the :code:`.tex` file, those
+    commands, :code:`bib_files` and the files the :code:`.tex` file includes
+    are the same as in the last successful build and :code:`out_file` exists. It's recorded as up to date
+    in :data:`pndconf.util.build_stats`. See :func:`cutoff_key`.
+
+    Otherwise all the commands are executed and :code:`True` is returned if
+    all of them succeeded.
+
+    """
+    staged = temp_file_for(pandoc_out_file)\
+        if pandoc_out_file and pandoc_out_file.endswith(".tex") else None
+    statuses: List[bool] = []
+
+    def commit(staged):
+        if statuses and all(statuses):
+            replace_if_changed(staged, pandoc_out_file)  # type: ignore
+        elif staged.exists():
+            staged.unlink()
+
+    def prepare(com):
+        if preamble_format and pandoc_out_file and pandoc_out_file.endswith(".tex") and\
+           is_tex_command(com):
+            return with_format(com, pandoc_out_file)
+        return com
+
+    key = None
+    for i, com in enumerate(commands):
+        if staged and pandoc_out_file in com and not is_tex_command(com):  # type: ignore
+            com = com.replace(pandoc_out_file, str(staged))  # type: ignore
+        elif staged:
+            commit(staged)
+            staged = None
+            if out_file and all(statuses):
+                # NOTE: The commands include the precompiled format, which
+                #       changes with the TeX installation
+                key = cutoff_key(pandoc_out_file, [*map(prepare, commands[i:])],  # type: ignore
+                                 bib_files)
+                record = cutoff_record(pandoc_out_file)  # type: ignore
+                if Path(out_file).exists() and record.exists() and record.read_text() == key:
+                    logbi(f"{out_file} is up to date as {pandoc_out_file} is unchanged")
+                    build_stats.record_up_to_date(out_file)
+                    return True
+        com = prepare(com)
+        statuses.append(exec_command(com, stdin if i == 0 else None, rerun=rerun))
+    if staged:
+        commit(staged)
+    if key:
+        record = cutoff_record(pandoc_out_file)  # type: ignore
+        if all(statuses):
+            record.write_text(key)
+        elif record.exists():
+            record.unlink()
+    return all(statuses)
+
+
+def merge_input(pandoc_opts: Optional[Dict], file_text: str) -> bytes:
+    """Return the input for pandoc with :code:`pandoc_opts` as the yaml header
+
+    Args:
+        pandoc_opts: The pandoc options
+        file_text: Text of the file after the header
+
+    """
+    if pandoc_opts:
+        return "---\n".join(["", yaml.dump(pandoc_opts), file_text]).encode()
+    else:
+        return file_text.encode()
+
+
 def markdown_compile(commands: Dict[str, Dict[str, Union[List[str], str]]],
                      md_file: str) -> Optional[PostProc]:  # FIXME: Actually it's a path
     """Compile markdown to output format with pandoc.
@@ -274,25 +490,25 @@ def markdown_compile(commands: Dict[str, Dict[str, Union[List[str], str]]],
         return None
     logbbi(f"\nCompiling {md_file} at {now()}")
     postprocess = []
+    # NOTE: The input is merged only once for all the filetypes with the same
+    #       options, which is usually all of them
+    inputs: List[Tuple[Dict, str, bytes]] = []
     # NOTE: commands' values are either strings or lists of strings
     for filetype, command_dict in commands.items():
         command = command_dict["command"]
         out_file: str = cast(str, command_dict["out_file"])
-        pandoc_opts = command_dict["in_file_opts"]
+        pandoc_opts = cast(Dict, command_dict["in_file_opts"])
         file_text: str = cast(str, command_dict["text"])
-        if pandoc_opts:
-            input = "---\n".join(["", yaml.dump(pandoc_opts), file_text])
-        else:
-            input = file_text
-        if isinstance(command, str):
-            status = exec_command(command, input)
-            if status:
-                # mark status for processing
-                postprocess.append({"in_file": md_file, "out_file": out_file})
-        elif isinstance(command, list):
-            statuses = []
-            for com in command:
-                statuses.append(exec_command(com, input))
-            if all(statuses):
-                postprocess.append({"in_file": md_file, "out_file": out_file})
+        input = next((x[2] for x in inputs if x[1] is file_text and x[0] == pandoc_opts), None)
+        if input is None:
+            input = merge_input(pandoc_opts, file_text)
+            inputs.append((pandoc_opts, file_text, input))
+        pandoc_out_file = cast(Optional[str], command_dict.get("pandoc_out_file"))
+        chain = [command] if isinstance(command, str) else command
+        if exec_command_chain(chain, input, pandoc_out_file,
+                              bool(command_dict.get("preamble_format")),
+                              bool(command_dict.get("rerun")), out_file,
+                              cast(List[str], command_dict.get("bib_files"))):
+            # mark status for processing
+            postprocess.append({"in_file": md_file, "out_file": out_file})
     return postprocess
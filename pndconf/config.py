@@ -1,6 +1,9 @@
-from typing import Dict, Union, List, Optional, Callable
+from typing import Dict, Union, List, Optional, Callable, Tuple, Any
 import os
 import re
+import copy
+import json
+import hashlib
 from pathlib import Path
 import configparser
 import pprint
@@ -8,13 +11,25 @@ from glob import glob
 
 from common_pyutil.system import Semver
 
-from .util import load_user_module, logd, loge, logi, logbi, logw, read_md_file_with_header
+from .util import (load_user_module, logd, loge, logi, logbi, logw, read_md_file_with_header,
+                   parse_md_text_with_header, build_stats, path_fingerprint)
 from .compilers import markdown_compile
-from .commands import Commands
+from . import transforms, dedup
+from .commands import Commands, resource_dirs, pdf_files_dir, citations_record
+from .bibliography import BibliographyService, bibliography_files, cited_keys
+from .resources import ResourceIndex
+from .scheduler import Tier, parse_tier
 
 
 Pathlike = Union[str, Path]
 
+# NOTE: Built in profiles. See :meth:`Configuration.set_profile`
+default_profiles: Dict[str, Dict[str, str]] = {
+    "draft": {"remove": "--toc,--toc-depth,--lof,--lot",
+              "skip_filters": "",
+              "interaction": "batchmode",
+              "single_pass": "yes"}}
+
 
 # TODO: remove output dir from watch if same as watch dir
 # TODO: Config should be yaml instead of config.ini. Yaml is more flexible
@@ -33,6 +48,8 @@ class Configuration:
         self.output_dir = output_dir
         self.pandoc_path = pandoc_path
         self.pandoc_version = Semver(pandoc_version)
+        # NOTE: Probe results of pandoc. See :func:`pndconf.toolchain.pandoc_info`
+        self.pandoc_info: Dict[str, Any] = {}
         self.no_citeproc = no_citeproc
         self.csl_dir = csl_dir and Path(csl_dir).absolute()
         self.templates_dir = templates_dir and Path(templates_dir).absolute()
@@ -42,7 +59,8 @@ class Configuration:
         self._conf = configparser.ConfigParser()
         self.conf.optionxform = lambda option: option  # type: ignore
         self.conf.read(self._config_file)
-        self._filetypes = [k for k in self._conf if k not in {"options", "DEFAULT"}]
+        self._filetypes = [k for k in self._conf if k not in {"options", "schedule", "DEFAULT"}
+                           and not k.startswith("profile.")]
         self._excluded_regexp: List[str] = []
         self._excluded_extensions: List[str] = []
         self._excluded_folders: List[str] = []
@@ -50,6 +68,23 @@ class Configuration:
         self._excluded_files: List[str] = []
         self.same_pdf_output_dir = same_pdf_output_dir
         self._bib_transforms: List[str] = []
+        self._dedup_policy: Optional[str] = None
+        # NOTE: Scheduling tiers of the filetypes in watch mode. See
+        #       :class:`pndconf.scheduler.Scheduler`
+        self._schedule: Dict[str, Tier] = {}
+        # NOTE: The build profile applied over the filetypes. See :meth:`set_profile`
+        self._profile_name = ""
+        self._profile: Dict[str, str] = {}
+        # NOTE: Parsed bibliography files are shared by all the documents
+        self.bibliography = BibliographyService()
+        # NOTE: Index of the CSL and template directories. Invalidated by the
+        #       watcher on changes
+        self.resources = ResourceIndex()
+        # NOTE: The last command plan of each document with its key.
+        #       See :meth:`get_commands`
+        self._plans: Dict[str, Tuple[str, Dict[str, Dict[str, Any]]]] = {}
+        self.plan_builds = 0
+        self.plan_reuses = 0
         self.dry_run = dry_run
         self._log_file = None
         # self._use_extra_opts = extra_opts
@@ -57,9 +92,21 @@ class Configuration:
         self._debug_levels = ["error", "warning", "info", "debug"]
         # NOTE: Some new arguments
         self.no_cite_cmd = False
+        # NOTE: Compile with a precompiled format of the LaTeX preamble.
+        #       See :func:`pndconf.formats.format_for`
+        self.precompile_preamble = False
+        # NOTE: Run the pdf engine in a build dir kept between the builds
+        #       instead of pandoc. See :meth:`pndconf.commands.Commands.uses_build_dir`
+        self.persistent_build_dir = False
         self.parse_options()
 
     def parse_options(self):
+        if "schedule" in self.conf:
+            for filetype, value in self.conf["schedule"].items():
+                try:
+                    self._schedule[filetype] = parse_tier(value)
+                except ValueError as e:
+                    loge(f"{e} for {filetype}. Ignoring")
         if "options" in self.conf:
             if self.conf["options"]["transforms"]:
                 self._bib_transforms = [*map(str.strip, self.conf["options"]["transforms"].split(","))]
@@ -67,10 +114,25 @@ class Configuration:
                 self._bib_transforms = []
             if "csl_dir" in self.conf["options"]:
                 self.csl_dir = self.csl_dir or Path(self.conf["options"]["csl_dir"])
+            if "venues_file" in self.conf["options"]:
+                transforms.set_venues_files([*map(str.strip,
+                                                  self.conf["options"]["venues_file"].split(","))])
+            if "abbrevs_file" in self.conf["options"]:
+                transforms.set_abbrevs_file(self.conf["options"]["abbrevs_file"])
+            if self.conf["options"].get("dedup"):
+                if self.conf["options"]["dedup"] in dedup.policies:
+                    self._dedup_policy = self.conf["options"]["dedup"]
+                else:
+                    loge(f"Unknown dedup policy {self.conf['options']['dedup']}. "
+                         f"Choose from {dedup.policies}. Ignoring")
             if "templates_dir" in self.conf["options"]:
                 self.templates_dir = self.templates_dir or Path(self.conf["options"]["templates_dir"])
             self.same_pdf_output_dir = self.same_pdf_output_dir or\
                 self.conf["options"]["same_pdf_output_dir"]
+            self.precompile_preamble = self.conf["options"].getboolean("precompile_preamble",
+                                                                       False)
+            self.persistent_build_dir = self.conf["options"].getboolean("persistent_build_dir",
+                                                                        False)
 
     @property
     def filetypes(self):
@@ -80,10 +142,95 @@ class Configuration:
     def conf(self):
         return self._conf
 
+    @property
+    def schedule(self) -> Dict[str, Tier]:
+        return self._schedule
+
+    @property
+    def profile(self) -> str:
+        return self._profile_name
+
+    def set_profile(self, name: str):
+        """Set the build profile applied over the options of all the filetypes.
+
+        Args:
+            name: Name of the profile. The full build is used if empty.
+
+        A profile is read from the section :code:`[profile.name]` of the
+        config. Its keys are:
+
+            remove: Comma separated options removed from the filetypes, e.g., "--toc"
+            skip_filters: Comma separated filters not run, e.g., the expensive ones
+            interaction: The pdflatex interaction mode
+            single_pass: Run pdflatex once, and bibtex only if the citations changed
+                         since it last ran. The aux files of the previous
+                         builds are reused.
+
+        Any other key beginning with "-" is set as a pandoc option for all the
+        filetypes.
+
+        The profile "draft" exists even if it's not in the config, with
+        :data:`default_profiles` updated by the section if given.
+
+        Raises :class:`ValueError` if the profile doesn't exist.
+
+        """
+        section = f"profile.{name}"
+        if not name:
+            self._profile = {}
+        elif section in self.conf or name in default_profiles:
+            self._profile = {**default_profiles.get(name, {}),
+                             **(dict(self.conf[section]) if section in self.conf else {})}
+        else:
+            raise ValueError(f"Unknown profile {name}. Add the section [{section}] to the config")
+        self._profile_name = name
+        logd(f"Using profile \"{name}\" with {self._profile}")
+
+    def profile_setting(self, key: str, default: str = "") -> str:
+        "Return the setting :code:`key` of the current profile"
+        return self._profile.get(key, default)
+
+    @property
+    def single_pass(self) -> bool:
+        "Whether the current profile runs pdflatex once. See :meth:`set_profile`"
+        return self.profile_setting("single_pass").lower() in {"yes", "true", "1"}
+
+    @property
+    def skipped_filters(self) -> List[str]:
+        "Filters which the current profile doesn't run"
+        return [x.strip() for x in self.profile_setting("skip_filters").split(",") if x.strip()]
+
+    def is_skipped_filter(self, name: str) -> bool:
+        "Whether the filter :code:`name`, a name or a path, isn't run"
+        return Path(name.strip()).name in self.skipped_filters
+
+    def filetype_opts(self, filetype: str) -> Dict[str, str]:
+        """Return the options of :code:`filetype` with the current profile applied.
+
+        Args:
+            filetype: The filetype
+
+        """
+        opts = dict(self.conf[filetype])
+        if not self._profile:
+            return opts
+        for key in self.profile_setting("remove").split(","):
+            opts.pop(key.strip(), None)
+        for key in ["--filter", "--lua-filter"]:
+            if key in opts and self.skipped_filters:
+                opts[key] = ",".join(x for x in opts[key].split(",")
+                                     if x.strip() and not self.is_skipped_filter(x))
+        opts.update({k: v for k, v in self._profile.items() if k.startswith("-")})
+        return opts
+
     @property
     def bib_transforms(self) -> List[str]:
         return self._bib_transforms
 
+    @property
+    def dedup_policy(self) -> Optional[str]:
+        return self._dedup_policy
+
     @property
     def post_processor(self):
         "Return the post processor"
@@ -220,12 +367,14 @@ class Configuration:
     # TODO: should be a better way to compile with pdflatex
     # TODO: User defined options should override the default ones and the file ones
     # TODO: This functions is wayyy too complicated now. Split this is up
-    def get_commands(self, in_file: str) ->\
+    def get_commands(self, in_file: str, text: Optional[str] = None) ->\
             Optional[Dict[str, Dict[str, Union[List[str], str]]]]:
         """Get pandoc commands for various output formats for input file `in_file`.
 
         Args:
             in_file: Input file name
+            text: Contents of the input file, e.g., an unsaved editor buffer.
+                  The file is read if not given.
 
 
         Pandoc options can be specified via:
@@ -247,15 +396,98 @@ class Configuration:
         "pdflatex commands" can include multiple invocations of pdflatex along
         with bibtex or biber.
 
+        The commands are memoized per document with a key of everything they
+        depend on other than the body of the text (see :meth:`plan_key`), so
+        edits which touch only the body reuse the plan and only the
+        :code:`text` is updated.
+
         """
-        retval = read_md_file_with_header(in_file)
+        retval = read_md_file_with_header(in_file) if text is None else\
+            parse_md_text_with_header(text)
         if retval is None:
             return None
         else:
             in_file_text, in_file_pandoc_opts = retval
 
-        commands = Commands(self, Path(in_file), in_file_text, in_file_pandoc_opts)
-        return commands.build_commands()
+        path = str(Path(in_file).absolute())
+        key = self.plan_key(in_file, in_file_text, in_file_pandoc_opts)
+        if path in self._plans and self._plans[path][0] == key and\
+           self.plan_outputs_exist(self._plans[path][1]):
+            self.plan_reuses += 1
+            logd(f"Reusing commands for {in_file}")
+            plan = self._plans[path][1]
+        else:
+            self.plan_builds += 1
+            commands = Commands(self, Path(in_file), in_file_text,
+                                copy.deepcopy(in_file_pandoc_opts))
+            plan = commands.build_commands()
+            # NOTE: The key is computed again as the bibliography generated
+            #       in the directory of the file changes its fingerprint
+            key = self.plan_key(in_file, in_file_text, in_file_pandoc_opts)
+            self._plans[path] = (key, plan)
+        # NOTE: Copied so that the cached plan isn't modified by the callers
+        return {ft: {**copy.deepcopy({k: v for k, v in val.items() if k != "text"}),
+                     "text": in_file_text}
+                for ft, val in plan.items()}
+
+    @property
+    def snapshot(self) -> Dict[str, Any]:
+        "The settings of the configuration which affect the commands"
+        return {"conf": {k: dict(v) for k, v in self.conf.items()},
+                "filetypes": self.filetypes,
+                "cmdline_opts": self.cmdline_opts,
+                "output_dir": str(self.output_dir),
+                "pandoc_path": str(self.pandoc_path),
+                "pandoc_version": str(self.pandoc_version),
+                "no_citeproc": self.no_citeproc,
+                "no_cite_cmd": self.no_cite_cmd,
+                "profile": self._profile,
+                "precompile_preamble": self.precompile_preamble,
+                "persistent_build_dir": self.persistent_build_dir,
+                "same_pdf_output_dir": self.same_pdf_output_dir,
+                "csl_dir": self.csl_dir and str(self.csl_dir),
+                "templates_dir": self.templates_dir and str(self.templates_dir),
+                "bib_transforms": self.bib_transforms,
+                "dedup_policy": self.dedup_policy,
+                "transforms": transforms.get_settings(),
+                "cwd": os.getcwd()}
+
+    def plan_key(self, in_file: Pathlike, text: str, opts: Dict[str, Any]) -> str:
+        """Return the key of the command plan of :code:`in_file`
+
+        Args:
+            in_file: Input file name
+            text: Text of the file without the yaml header
+            opts: Pandoc options from the yaml header
+
+        The key is a hash of the yaml header, the cited keys, the
+        configuration :attr:`snapshot`, the versions of the directories
+        searched for CSL and templates files in :attr:`resources` and the
+        fingerprints of the bibliography files, as the generated
+        bibliographies depend on them.
+
+        """
+        # NOTE: Paths beginning with "./" are relative to the file.
+        #       See :func:`pndconf.commands.update_in_file_paths`
+        bib_files = [Path(in_file).parent.joinpath(x) if x.startswith("./") else x
+                     for x in bibliography_files(opts)]
+        bib_files.extend(v for ft in self.filetypes
+                         for v in self.conf[ft].get("--bibliography", "").split(",") if v)
+        value = [opts, cited_keys(text), self.snapshot,
+                 [[str(x), self.resources.version(x)]
+                  for x in resource_dirs(self.csl_dir, self.templates_dir, in_file)],
+                 [path_fingerprint(x) for x in bib_files]]
+        # NOTE: A single pass profile skips bibtex depending on when it last
+        #       ran. See :meth:`pndconf.commands.Commands.citations_changed`
+        if self.single_pass:
+            files_dir = pdf_files_dir(self.output_dir, in_file, self.same_pdf_output_dir)
+            value.append(path_fingerprint(citations_record(files_dir, in_file)))
+        return hashlib.md5(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+    def plan_outputs_exist(self, plan: Dict[str, Dict[str, Any]]) -> bool:
+        "Check if the bibliographies generated for a plan still exist"
+        return all(Path(x).exists() for val in plan.values()
+                   for x in bibliography_files(val["in_file_opts"] or {}))
 
     def set_included_extensions(self, included_file_extensions):
         self._included_extensions = included_file_extensions
@@ -307,7 +539,11 @@ class Configuration:
         elements = [f for f in all_files if self.is_watched(f)]
         return elements
 
-    def compile_or_warn(self, cmds, mdf, post):
+    def compile_or_warn(self, cmds, mdf, post, filetypes: Optional[List[str]] = None):
+        if filetypes is not None:
+            cmds = {k: v for k, v in cmds.items() if k in filetypes}
+            if not cmds:
+                return
         if self.dry_run:
             for k, v in cmds.items():
                 cmd = "\n\t".join(v['command']) if isinstance(v['command'], list)\
@@ -318,29 +554,42 @@ class Configuration:
                 logbi(f"Compiling: {mdf}")
             post.append(markdown_compile(cmds, mdf))
 
-    def compile_files(self, md_files: Union[str, List[str]]):
+    def compile_files(self, md_files: Union[str, List[str]],
+                      text: Optional[str] = None,
+                      filetypes: Optional[List[str]] = None) -> List[Dict[str, str]]:
         """Compile files and call the post_processor if it exists.
 
         Args:
             md_files: The markdown files to compile
+            text: Contents of :code:`md_files` if it's a single file, instead
+                  of reading it. See :meth:`get_commands`
+            filetypes: Compile only these of the :attr:`filetypes`.
+                       Defaults to all of them.
+
+        Returns the outputs of each file as returned by
+        :func:`pndconf.compilers.markdown_compile`.
 
         """
         post: List[Dict[str, str]] = []
         commands = None
+        build_stats.reset()
 
         if md_files and isinstance(md_files, str):
-            commands = self.get_commands(md_files)
+            commands = self.get_commands(md_files, text)
             if commands is not None:
-                self.compile_or_warn(commands, md_files, post)
+                self.compile_or_warn(commands, md_files, post, filetypes)
         elif isinstance(md_files, list):
             for md_file in md_files:
                 commands = self.get_commands(md_file)
                 if commands is not None:
-                    self.compile_or_warn(commands, md_file, post)
+                    self.compile_or_warn(commands, md_file, post, filetypes)
         logbi("Done compiling!")
+        if build_stats.written or build_stats.unchanged or build_stats.up_to_date:
+            logbi(build_stats.summary())
         if commands and self.post_processor and post:
             if self.dry_run:
                 logbi("Not calling post_processor as dry run.")
             else:
                 logbi("Calling post_processor")
                 self.post_processor(post)
+        return post
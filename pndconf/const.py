@@ -28,3 +28,9 @@ class LogLevels(IntEnum):
 
 gentypes = ["html", "pdf", "reveal", "beamer", "latex"]
 log_levels = [x.name for x in LogLevels]
+
+stop_words_set = {"a", "an", "and", "are", "as", "at", "by", "can", "did",
+                  "do", "does", "for", "from", "had", "has", "have", "having", "here", "how",
+                  "in", "into", "is", "it", "it's", "its", "not", "of", "on", "over", "should",
+                  "so", "than", "that", "the", "then", "there", "these", "to", "via", "was", "were",
+                  "what", "when", "where", "which", "who", "why", "will", "with"}
@@ -0,0 +1,387 @@
+from typing import Dict, List, Optional, Tuple, Any
+import re
+import datetime
+
+
+# NOTE: CSL types which don't have a direct equivalent fall back to "misc"
+bibtex_types = {"article": "article",
+                "article-journal": "article",
+                "article-magazine": "article",
+                "article-newspaper": "article",
+                "paper-conference": "inproceedings",
+                "book": "book",
+                "chapter": "incollection",
+                "thesis": "phdthesis",
+                "report": "techreport",
+                "manuscript": "unpublished"}
+
+biblatex_types = {"article": "article",
+                  "article-journal": "article",
+                  "article-magazine": "article",
+                  "article-newspaper": "article",
+                  "paper-conference": "inproceedings",
+                  "book": "book",
+                  "chapter": "incollection",
+                  "thesis": "thesis",
+                  "report": "report",
+                  "manuscript": "unpublished",
+                  "webpage": "online",
+                  "post": "online",
+                  "post-weblog": "online",
+                  "dataset": "dataset",
+                  "software": "software"}
+
+# CSL variables which map one to one for both styles
+simple_fields = {"title": "title",
+                 "volume": "volume",
+                 "edition": "edition",
+                 "publisher": "publisher",
+                 "collection-title": "series",
+                 "note": "note",
+                 "DOI": "doi",
+                 "URL": "url",
+                 "ISBN": "isbn",
+                 "ISSN": "issn"}
+
+# NOTE: Fields which CSL styles may change the case of
+title_fields = {"title", "container-title", "collection-title"}
+
+month_names = ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+               "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+def escape_latex(value: str) -> str:
+    """Escape the characters which would break a bibtex value.
+
+    Args:
+        value: String value of a CSL variable
+
+    """
+    return re.sub(r"(?<!\\)([&%#])", r"\\\1", value)
+
+
+def csl_name_to_bibtex(name: Any) -> str:
+    """Convert a CSL name to bibtex name format "von Last, Jr, First".
+
+    Args:
+        name: A CSL name. Either a :class:`dict` with CSL name parts or a
+              simple string which is used as is.
+
+    """
+    if isinstance(name, str):
+        return name
+    if "literal" in name:
+        return "{" + str(name["literal"]) + "}"
+    family = " ".join(filter(None, [name.get("non-dropping-particle", ""),
+                                    name.get("family", "")]))
+    given = " ".join(filter(None, [name.get("given", ""),
+                                   name.get("dropping-particle", "")]))
+    parts = [family]
+    if name.get("suffix"):
+        parts.append(name["suffix"])
+    if given:
+        parts.append(given)
+    return ", ".join(str(x) for x in parts)
+
+
+def csl_names_to_bibtex(names: Any) -> str:
+    """Join a list of CSL names with "and"
+
+    Args:
+        names: A list of CSL names or a single name
+
+    """
+    if not isinstance(names, list):
+        names = [names]
+    return " and ".join(csl_name_to_bibtex(x) for x in names)
+
+
+def parse_csl_date(date: Any) -> Tuple[str, Optional[int], Optional[int]]:
+    """Parse a CSL date into a tuple of year, month and day.
+
+    Args:
+        date: CSL date. Can be a string like "2020-06", a :class:`datetime.date`,
+              a CSL-JSON date with "date-parts", or the older pandoc style
+              list of dicts with "year", "month" and "day".
+
+    Month and day are :code:`None` if absent. Year is empty if the date
+    could not be parsed.
+
+    """
+    if isinstance(date, (datetime.date, datetime.datetime)):
+        return str(date.year), date.month, date.day
+    if isinstance(date, (int, float)):
+        return str(int(date)), None, None
+    if isinstance(date, list) and date and isinstance(date[0], dict):
+        date = date[0]
+        return (str(date.get("year", "")),
+                date.get("month") and int(date["month"]),
+                date.get("day") and int(date["day"]))
+    if isinstance(date, dict):
+        if "date-parts" in date and date["date-parts"]:
+            parts = [*map(int, date["date-parts"][0]), None, None]
+            return str(parts[0]), parts[1], parts[2]
+        date = date.get("raw", "") or date.get("literal", "")
+    match = re.match(r"^(-?\d+)(?:-(\d{1,2}))?(?:-(\d{1,2}))?", str(date).strip())
+    if match:
+        year, month, day = match.groups()
+        return year, month and int(month), day and int(day)
+    return "", None, None
+
+
+def csl_to_entry(ref: Dict[str, Any], style: str = "biblatex") -> Optional[Dict[str, str]]:
+    """Convert a single CSL reference to a :mod:`bibtexparser` entry.
+
+    Args:
+        ref: CSL reference as a dictionary
+        style: One of "bibtex" or "biblatex"
+
+    The entry is a flat :class:`dict` of strings with "ENTRYTYPE" and "ID" keys
+    in the same format as parsed by :class:`bibtexparser.bparser.BibTexParser`
+    so that it can be transformed and written along with the entries from
+    bibliography files.
+
+    Returns :code:`None` if the reference has no "id".
+
+    """
+    if "id" not in ref:
+        return None
+    biblatex = style == "biblatex"
+    csl_type = ref.get("type", "")
+    types = biblatex_types if biblatex else bibtex_types
+    entry_type = types.get(csl_type, "misc")
+    if not biblatex and entry_type == "phdthesis" and\
+       "master" in str(ref.get("genre", "")).lower():
+        entry_type = "mastersthesis"
+    entry: Dict[str, str] = {"ENTRYTYPE": entry_type, "ID": str(ref["id"])}
+    for key, field in simple_fields.items():
+        if key in ref:
+            entry[field] = escape_latex(str(ref[key]))
+    for key in ["author", "editor"]:
+        if key in ref:
+            entry[key] = csl_names_to_bibtex(ref[key])
+    if "page" in ref:
+        entry["pages"] = re.sub(r"\s*[-–]+\s*", "--", str(ref["page"]))
+    if "issue" in ref:
+        entry["number"] = str(ref["issue"])
+    elif "number" in ref:
+        entry["number"] = str(ref["number"])
+    if "container-title" in ref:
+        container = escape_latex(str(ref["container-title"]))
+        if entry_type in {"inproceedings", "incollection"}:
+            entry["booktitle"] = container
+        elif entry_type == "article":
+            entry["journaltitle" if biblatex else "journal"] = container
+        elif biblatex:
+            entry["maintitle"] = container
+        else:
+            entry["howpublished"] = container
+    if "publisher-place" in ref:
+        entry["location" if biblatex else "address"] = escape_latex(str(ref["publisher-place"]))
+    if "event-place" in ref:
+        if biblatex:
+            entry["venue"] = escape_latex(str(ref["event-place"]))
+        elif "address" not in entry:
+            entry["address"] = escape_latex(str(ref["event-place"]))
+    if biblatex and ("event-title" in ref or "event" in ref):
+        entry["eventtitle"] = escape_latex(str(ref.get("event-title", ref.get("event"))))
+    if csl_type in {"report", "thesis"}:
+        if "genre" in ref:
+            entry["type"] = str(ref["genre"])
+        if "publisher" in entry:
+            publisher = entry.pop("publisher")
+            if biblatex:
+                entry["institution"] = publisher
+            else:
+                entry["school" if csl_type == "thesis" else "institution"] = publisher
+    if "issued" in ref:
+        year, month, day = parse_csl_date(ref["issued"])
+        if year and biblatex:
+            entry["date"] = "-".join([year, *[f"{x:02d}" for x in
+                                               filter(None, [month, month and day])]])
+        elif year:
+            entry["year"] = year
+            if month:
+                entry["month"] = month_names[month - 1]
+    return entry
+
+
+def references_to_entries(references: Any, style: str = "biblatex") -> List[Dict[str, str]]:
+    """Convert inline CSL-YAML :code:`references` to :mod:`bibtexparser` entries.
+
+    Args:
+        references: The value of :code:`references` key from the yaml header
+                    of a markdown file
+        style: One of "bibtex" or "biblatex"
+
+    This replaces running :code:`pandoc -t biblatex` over the whole document
+    only to get the references in the metadata.
+
+    """
+    if not references:
+        return []
+    if isinstance(references, dict):
+        references = [references]
+    entries = []
+    for ref in references:
+        if isinstance(ref, dict):
+            entry = csl_to_entry(ref, style)
+            if entry:
+                entries.append(entry)
+    return entries
+
+
+# NOTE: Reverse mapping of bibtex and biblatex types to CSL types
+csl_types = {"article": "article-journal",
+             "inproceedings": "paper-conference",
+             "conference": "paper-conference",
+             "book": "book",
+             "incollection": "chapter",
+             "inbook": "chapter",
+             "phdthesis": "thesis",
+             "mastersthesis": "thesis",
+             "thesis": "thesis",
+             "techreport": "report",
+             "report": "report",
+             "unpublished": "manuscript",
+             "online": "webpage",
+             "dataset": "dataset",
+             "software": "software"}
+
+months = {x.lower(): i + 1 for i, x in enumerate(month_names)}
+
+
+def case_protected_groups(value: str) -> List[Tuple[int, int]]:
+    """Return the spans of the top level brace groups which protect case in a bibtex value.
+
+    Args:
+        value: Bibtex field value
+
+    Groups which are arguments of a command, like :code:`\\"{o}`, or which
+    start with a command, like :code:`{\\"o}`, are special characters and
+    not case protection.
+
+    """
+    spans: List[Tuple[int, int]] = []
+    depth, start = 0, 0
+    for i, char in enumerate(value):
+        if i and value[i - 1] == "\\":
+            continue
+        if char == "{":
+            if not depth:
+                start = i
+            depth += 1
+        elif char == "}" and depth:
+            depth -= 1
+            if not depth and not value[start + 1:].startswith("\\") and\
+               not re.search(r"\\(?:[a-zA-Z]+|[^a-zA-Z\s])\s*$", value[:start]):
+                spans.append((start, i + 1))
+    return spans
+
+
+def clean_latex(value: str, protect_case: bool = False) -> str:
+    """Convert a bibtex value to plain unicode text.
+
+    Args:
+        value: Bibtex field value
+        protect_case: Keep the case protecting braces as
+                      :code:`<span class="nocase">...</span>`, as pandoc does
+                      when it reads a bibtex file
+
+    Simple formatting commands like :code:`\\textit{...}` are removed, LaTeX
+    accents are converted to unicode and the case protecting braces are
+    stripped unless :code:`protect_case` is given.
+
+    """
+    from bibtexparser.latexenc import latex_to_unicode
+    value = re.sub(r"\\(?:textit|textbf|emph|texttt|textsc|textrm|mbox|url)\{([^{}]*)\}",
+                   r"\1", value)
+    spans = case_protected_groups(value) if protect_case else []
+    groups = [clean_latex(value[start + 1:end - 1]) for start, end in spans]
+    # NOTE: The groups are replaced with placeholders as latex_to_unicode
+    #       strips the braces
+    for i, (start, end) in reversed([*enumerate(spans)]):
+        value = f"{value[:start]}\ue000{i}\ue001{value[end:]}"
+    value = latex_to_unicode(value).replace("{", "").replace("}", "")
+    value = re.sub(r"\s+", " ", value.replace("---", "—").replace("--", "–")).strip()
+    return re.sub("\ue000(\\d+)\ue001",
+                  lambda x: f'<span class="nocase">{groups[int(x.group(1))]}</span>', value)
+
+
+def bibtex_name_to_csl(name: str) -> Dict[str, str]:
+    """Convert a bibtex name to a CSL name.
+
+    Args:
+        name: Name in one of the forms "First Last", "Last, First" or
+              "Last, Jr, First". A fully braced name is kept as a literal.
+
+    """
+    name = name.strip()
+    if name.startswith("{") and name.endswith("}") and\
+       name.count("{") == 1:
+        return {"literal": clean_latex(name)}
+    parts = [clean_latex(x) for x in name.split(",")]
+    if len(parts) == 1:
+        words = parts[0].split()
+        if len(words) == 1:
+            return {"family": words[0]}
+        return {"family": words[-1], "given": " ".join(words[:-1])}
+    retval = {"family": parts[0]}
+    if len(parts) > 2:
+        retval["suffix"] = parts[1]
+    if parts[-1]:
+        retval["given"] = parts[-1]
+    return retval
+
+
+def bibtex_names_to_csl(names: str) -> List[Dict[str, str]]:
+    """Split bibtex names joined with "and" and convert them to CSL names
+
+    Args:
+        names: Bibtex names
+
+    """
+    return [bibtex_name_to_csl(x) for x in re.split(r"\s+and\s+", names.strip()) if x]
+
+
+def entry_to_csl(entry: Dict[str, str]) -> Dict[str, Any]:
+    """Convert a :mod:`bibtexparser` entry to a CSL-JSON reference.
+
+    Args:
+        entry: Bibtex entry as a dictionary
+
+    Both bibtex and biblatex field names are understood.
+
+    """
+    entry_type = entry.get("ENTRYTYPE", "misc").lower()
+    ref: Dict[str, Any] = {"id": entry["ID"], "type": csl_types.get(entry_type, "document")}
+    for key, field in simple_fields.items():
+        if field in entry:
+            ref[key] = clean_latex(entry[field], key in title_fields)
+    for key in ["author", "editor"]:
+        if key in entry:
+            ref[key] = bibtex_names_to_csl(entry[key])
+    container = entry.get("journal") or entry.get("journaltitle") or entry.get("booktitle")
+    if container:
+        ref["container-title"] = clean_latex(container, True)
+    place = entry.get("address") or entry.get("location")
+    if place:
+        ref["publisher-place"] = clean_latex(place)
+    publisher = entry.get("school") or entry.get("institution")
+    if publisher and "publisher" not in ref:
+        ref["publisher"] = clean_latex(publisher)
+    if "pages" in entry:
+        ref["page"] = re.sub(r"\s*-+\s*", "-", entry["pages"])
+    if "number" in entry:
+        ref["issue" if entry_type == "article" else "number"] = clean_latex(entry["number"])
+    if "url" not in entry and "\\url{" in entry.get("howpublished", ""):
+        ref["URL"] = re.sub(r".*\\url\{([^{}]+)\}.*", r"\1", entry["howpublished"])
+    if entry.get("date"):
+        year, month, day = parse_csl_date(entry["date"])
+    else:
+        year, month, day = parse_csl_date(entry.get("year", ""))
+        month_val = entry.get("month", "").strip("{} ").lower()
+        month = months.get(month_val[:3]) or (int(month_val) if month_val.isdigit() else None)
+    if year:
+        ref["issued"] = {"date-parts": [[int(year), *filter(None, [month, month and day])]]}
+    return ref
@@ -0,0 +1,302 @@
+from typing import Dict, List, Optional, Set, Tuple, Iterable
+import re
+import zlib
+import random
+import hashlib
+import unicodedata
+from collections import defaultdict
+
+from . import transforms
+from .const import stop_words_set
+from .csl import clean_latex
+
+
+Entries = List[Dict[str, str]]
+
+# NOTE: Which entry of a group of duplicates to keep
+#       "first": The first one in the order of the files
+#       "last": The last one in the order of the files
+#       "most_fields": The one with the most fields, first one among equals
+policies = ["first", "last", "most_fields"]
+
+
+def ascii_fold(value: str) -> str:
+    """Lower case and strip the accents from :code:`value`"""
+    value = value.lower()
+    if value.isascii():
+        return value
+    value = unicodedata.normalize("NFKD", value)
+    return "".join(x for x in value if not unicodedata.combining(x))
+
+
+def maybe_clean_latex(value: str) -> str:
+    """Call :func:`pndconf.csl.clean_latex` only if :code:`value` has any LaTeX"""
+    return clean_latex(value) if ("\\" in value or "{" in value) else value
+
+
+def title_words(title: str) -> List[str]:
+    """Return the normalized words of a title without the stop words.
+
+    Args:
+        title: Title of a bibtex entry
+
+    """
+    return [x for x in re.split(r"[^a-z0-9]+", ascii_fold(maybe_clean_latex(title)))
+            if x and x not in stop_words_set]
+
+
+def author_surnames(authors: str) -> Tuple[str, ...]:
+    """Return the normalized surnames from bibtex names joined with "and"
+
+    Args:
+        authors: The :code:`author` field of a bibtex entry
+
+    """
+    surnames = []
+    for name in re.split(r"\s+and\s+", maybe_clean_latex(authors).strip()):
+        name = name.split(",")[0] if "," in name else (name.split() or [""])[-1]
+        surnames.append(re.sub(r"[^a-z0-9]+", "", ascii_fold(name)))
+    return tuple(filter(None, surnames))
+
+
+def entry_year(ent: Dict[str, str]) -> str:
+    """Return the year of the entry from :code:`year` or :code:`date` fields"""
+    match = re.search(r"\d{4}", ent.get("year", "") or ent.get("date", ""))
+    return match.group(0) if match else ""
+
+
+class Record:
+    """Normalized fields of an entry used for finding duplicates.
+
+    Args:
+        ent: Bibtex entry as a dictionary
+
+    The entry is first normalized with :func:`pndconf.transforms.normalize`.
+    The :attr:`fingerprint` is a hash of the title words, the author surnames
+    and the year and :attr:`shingles` are the title words and the pairs of
+    consecutive title words.
+
+    """
+    def __init__(self, ent: Dict[str, str]):
+        ent = transforms.normalize(ent.copy())
+        self.key = ent.get("ID", "")
+        self.words = title_words(ent.get("title", ""))
+        self.surnames = author_surnames(ent.get("author", ""))
+        self.year = entry_year(ent)
+        self.num_fields = len(ent)
+        self.shingles: Set[str] = {*self.words, *(" ".join(x) for x in
+                                                  zip(self.words, self.words[1:]))}
+        value = "|".join([" ".join(self.words), " ".join(self.surnames), self.year])
+        self.fingerprint = hashlib.md5(value.encode()).hexdigest()
+
+    def similar(self, other: "Record", threshold: float) -> bool:
+        """Check if :code:`other` is a near duplicate of this record.
+
+        Args:
+            other: Another record
+            threshold: Minimum Jaccard similarity of the title shingles
+
+        The first authors must match if both are present and the years can
+        differ by at most one, as a preprint and its published version
+        often do.
+
+        """
+        if not self.shingles or not other.shingles:
+            return False
+        if self.surnames and other.surnames and self.surnames[0] != other.surnames[0]:
+            return False
+        if self.year and other.year and abs(int(self.year) - int(other.year)) > 1:
+            return False
+        common = len(self.shingles & other.shingles)
+        return common / (len(self.shingles) + len(other.shingles) - common) >= threshold
+
+
+class MinHashLSH:
+    """Locality sensitive hashing of sets with MinHash signatures.
+
+    Args:
+        bands: Number of bands
+        rows: Number of rows in each band
+        seed: Seed for the hash functions
+
+    The signatures use one permutation hashing with densification which
+    needs only one hash per item. Sets which have the same signature in any of the bands are candidates for
+    being similar. The probability of that is high for sets with Jaccard
+    similarity above about :code:`(1 / bands) ** (1 / rows)` and drops sharply
+    below it.
+
+    """
+    mask64 = (1 << 64) - 1
+
+    def __init__(self, bands: int = 8, rows: int = 4, seed: int = 0):
+        self.bands = bands
+        self.rows = rows
+        self.size = bands * rows
+        self.shift = 64 - self.size.bit_length()
+        self.mask = (1 << self.shift) - 1
+        rand = random.Random(seed)
+        self.multiplier = rand.randrange(1, 1 << 64) | 1
+        self.increment = rand.randrange(0, 1 << 64)
+        self.probes = [rand.sample(range(self.size), self.size) for _ in range(self.size)]
+        self.buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = defaultdict(list)
+
+    def signature(self, items: Iterable[str]) -> List[int]:
+        """Return the MinHash signature of the set :code:`items`
+
+        Args:
+            items: The set
+
+        A single hash of each item is computed and the items are split into
+        :code:`bands * rows` bins by the top bits of the hash, keeping the
+        minimum in each bin. Empty bins take the value of the first non empty
+        bin in a fixed random order for that bin, so that signatures of
+        different sets remain comparable.
+
+        """
+        size, shift, mask = self.size, self.shift, self.mask
+        mins: List[Optional[int]] = [None] * size
+        for x in items:
+            value = (zlib.crc32(x.encode()) * self.multiplier + self.increment) & self.mask64
+            k = (value >> shift) % size
+            value &= mask
+            if mins[k] is None or value < mins[k]:  # type: ignore
+                mins[k] = value
+        for k in range(size):
+            if mins[k] is None:
+                for j in self.probes[k]:
+                    if mins[j] is not None:
+                        mins[k] = mins[j]
+                        break
+        return mins  # type: ignore
+
+    def add(self, index: int, items: Set[str]) -> Set[int]:
+        """Add the set :code:`items` and return the indices of the candidates added earlier
+
+        Args:
+            index: Index of the set
+            items: The set
+
+        """
+        candidates: Set[int] = set()
+        if not items:
+            return candidates
+        signature = self.signature(items)
+        for i in range(self.bands):
+            bucket = self.buckets[(i, tuple(signature[i * self.rows:(i + 1) * self.rows]))]
+            candidates.update(bucket)
+            bucket.append(index)
+        return candidates
+
+
+def find_duplicates(records: List[Record], threshold: float = 0.8) -> List[List[int]]:
+    """Find the groups of duplicate records.
+
+    Args:
+        records: List of records
+        threshold: Minimum Jaccard similarity of title shingles for near duplicates
+
+    Records with the same fingerprint are exact duplicates and are found with
+    a hash lookup. The rest are checked for near duplicates with
+    :class:`MinHashLSH` and only the candidate pairs are compared. Both take
+    time nearly linear in the number of records.
+
+    Returns groups of indices of the records, each in increasing order.
+    Records without duplicates are not included.
+
+    """
+    parent = list(range(len(records)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        i, j = find(i), find(j)
+        if i != j:
+            parent[max(i, j)] = min(i, j)
+
+    seen: Dict[str, int] = {}
+    lsh = MinHashLSH()
+    for i, rec in enumerate(records):
+        if rec.fingerprint in seen:
+            union(i, seen[rec.fingerprint])
+            continue
+        seen[rec.fingerprint] = i
+        for j in lsh.add(i, rec.shingles):
+            if find(i) != find(j) and rec.similar(records[j], threshold):
+                union(i, j)
+    groups: Dict[int, List[int]] = defaultdict(list)
+    for i in range(len(records)):
+        groups[find(i)].append(i)
+    return [x for x in groups.values() if len(x) > 1]
+
+
+def choose(group: List[int], records: List[Record], policy: str) -> int:
+    """Choose the record to keep from a group of duplicates according to :code:`policy`.
+
+    Args:
+        group: Indices of the duplicate records
+        records: List of records
+        policy: One of :data:`policies`
+
+    """
+    if policy == "first":
+        return group[0]
+    elif policy == "last":
+        return group[-1]
+    elif policy == "most_fields":
+        return max(group, key=lambda i: (records[i].num_fields, -i))
+    else:
+        raise ValueError(f"Unknown dedup policy {policy}. Choose from {policies}")
+
+
+def duplicates_to_drop(records: List[Record], policy: str,
+                       threshold: float = 0.8) -> Dict[int, int]:
+    """Return the indices of the records to drop mapped to the index of the one kept
+
+    Args:
+        records: List of records
+        policy: One of :data:`policies`
+        threshold: See :func:`find_duplicates`
+
+    """
+    drop: Dict[int, int] = {}
+    for group in find_duplicates(records, threshold):
+        keep = choose(group, records, policy)
+        drop.update({i: keep for i in group if i != keep})
+    return drop
+
+
+def deduplicate(entries: Entries, policy: str, threshold: float = 0.8,
+                add_ids: bool = False) -> Tuple[Entries, Dict[str, List[str]]]:
+    """Remove duplicate entries.
+
+    Args:
+        entries: Bibtex entries
+        policy: One of :data:`policies`
+        threshold: See :func:`find_duplicates`
+        add_ids: Add the keys of the dropped entries to the :code:`ids` field
+                 of the one kept. Biblatex resolves citations of those keys
+                 to the kept entry.
+
+    Returns the kept entries in their original order and a :class:`dict` of
+    the keys of the kept entries to the keys of their duplicates.
+
+    """
+    drop = duplicates_to_drop([Record(x) for x in entries], policy, threshold)
+    aliases: Dict[str, List[str]] = defaultdict(list)
+    for i, keep in sorted(drop.items()):
+        if entries[i]["ID"] != entries[keep]["ID"]:
+            aliases[entries[keep]["ID"]].append(entries[i]["ID"])
+    kept = []
+    for i, ent in enumerate(entries):
+        if i in drop:
+            continue
+        if add_ids and ent["ID"] in aliases:
+            ent = ent.copy()
+            ids = [x for x in ent.get("ids", "").split(",") if x.strip()]
+            ent["ids"] = ",".join([*ids, *aliases[ent["ID"]]])
+        kept.append(ent)
+    return kept, dict(aliases)
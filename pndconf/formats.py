@@ -0,0 +1,164 @@
+from typing import Any, Dict, List, Optional, Tuple, Union
+import re
+import json
+import hashlib
+from pathlib import Path
+from subprocess import Popen, PIPE, DEVNULL
+
+from .util import which, cache_dir, path_fingerprint, logd, logbi, logw
+
+
+Pathlike = Union[str, Path]
+
+begin_document = b"\\begin{document}"
+
+# NOTE: Fingerprints of the TeX installation keyed by the path of the engine.
+#       See :func:`tex_fingerprint`
+_tex_fingerprints: Dict[str, List[Any]] = {}
+
+
+def preamble(tex_file: Pathlike) -> Optional[bytes]:
+    """Return the preamble of :code:`tex_file`, the text before :code:`\\begin{document}`
+
+    Args:
+        tex_file: The LaTeX file
+
+    Returns None if the file doesn't exist or has no :code:`\\begin{document}`.
+
+    """
+    try:
+        with open(tex_file, "rb") as f:
+            text = f.read()
+    except OSError:
+        return None
+    index = text.find(begin_document)
+    return text[:index] if index != -1 else None
+
+
+def kpsewhich(name: str) -> Optional[str]:
+    "Return the path of the TeX file :code:`name` or None if it's not found"
+    kpsewhich_path = which("kpsewhich")
+    if not kpsewhich_path:
+        return None
+    p = Popen([kpsewhich_path, name], stdin=DEVNULL, stdout=PIPE, stderr=DEVNULL)
+    out, _ = p.communicate()
+    return out.decode().strip() or None
+
+
+def tex_fingerprint(engine_path: str) -> List[Any]:
+    """Return the fingerprint of the TeX installation.
+
+    Args:
+        engine_path: Path of the TeX engine, e.g., pdflatex
+
+    It's the fingerprint of the engine, its base format and
+    :code:`mylatexformat.ltx`, so that the formats are rebuilt when the
+    installation is updated. It's computed once per process.
+
+    """
+    if engine_path not in _tex_fingerprints:
+        engine = Path(engine_path).name
+        files = [engine_path, kpsewhich(f"{engine}.fmt"), kpsewhich("mylatexformat.ltx")]
+        _tex_fingerprints[engine_path] = [path_fingerprint(x) for x in files if x]
+    return _tex_fingerprints[engine_path]
+
+
+def format_name(tex_file: Pathlike, text: bytes, engine_path: str) -> Tuple[str, str]:
+    """Return the prefix and the name of the format for :code:`tex_file`
+
+    Args:
+        tex_file: The LaTeX file
+        text: Its preamble
+        engine_path: Path of the TeX engine
+
+    The prefix depends only on the file, so that the stale formats of the
+    file can be removed.
+
+    """
+    prefix = hashlib.md5(str(Path(tex_file).absolute()).encode()).hexdigest()[:12]
+    key = hashlib.md5(text)
+    key.update(json.dumps(tex_fingerprint(engine_path)).encode())
+    return prefix, f"{prefix}-{key.hexdigest()[:16]}"
+
+
+def build_format(tex_file: Path, engine_path: str, directory: Path, name: str) -> bool:
+    """Dump the preamble of :code:`tex_file` to the format :code:`name` in :code:`directory`
+
+    Args:
+        tex_file: The LaTeX file
+        engine_path: Path of the TeX engine
+        directory: The directory for the format
+        name: Name of the format
+
+    The format is built with :code:`mylatexformat` from the directory of
+    :code:`tex_file` so that relative inputs in the preamble are found.
+
+    """
+    engine = Path(engine_path).name
+    command = [engine_path, "-ini", "-interaction=batchmode", f"-jobname={name}",
+               f"-output-directory={directory}", f"&{engine}", "mylatexformat.ltx",
+               tex_file.name]
+    logbi(f"Building preamble format for {tex_file}")
+    p = Popen(command, cwd=tex_file.parent, stdin=DEVNULL, stdout=PIPE, stderr=PIPE)
+    p.communicate()
+    return not p.returncode and directory.joinpath(f"{name}.fmt").exists()
+
+
+def format_for(tex_file: Pathlike, engine: str = "pdflatex") -> Optional[Path]:
+    """Return the precompiled format of the preamble of :code:`tex_file`
+
+    Args:
+        tex_file: The LaTeX file
+        engine: The TeX engine
+
+    The format is built once for each preamble and TeX installation and
+    cached. The other formats of :code:`tex_file` are removed when it's built,
+    i.e., when the template, the header variables or the TeX installation
+    change.
+
+    Returns the path of the format without the :code:`.fmt` suffix, or None
+    if the file has no preamble or the format can't be built, e.g., if a
+    package in the preamble can't be dumped. A preamble whose format failed
+    isn't tried again.
+
+    """
+    tex_file = Path(tex_file).absolute()
+    engine_path = which(engine)
+    text = preamble(tex_file)
+    if not engine_path or text is None:
+        return None
+    directory = cache_dir("formats")
+    prefix, name = format_name(tex_file, text, engine_path)
+    fmt_file, failed = directory.joinpath(f"{name}.fmt"), directory.joinpath(f"{name}.failed")
+    if fmt_file.exists():
+        logd(f"Using preamble format {fmt_file}")
+        return directory.joinpath(name)
+    if failed.exists():
+        return None
+    for stale in directory.glob(f"{prefix}-*"):
+        stale.unlink()
+    if build_format(tex_file, engine_path, directory, name):
+        return directory.joinpath(name)
+    logw(f"Could not build preamble format for {tex_file}. "
+         f"See {directory.joinpath(name + '.log')}")
+    failed.touch()
+    return None
+
+
+def with_format(command: str, tex_file: Pathlike) -> str:
+    """Return the TeX :code:`command` using the precompiled preamble of :code:`tex_file`
+
+    Args:
+        command: The pdflatex command
+        tex_file: The LaTeX file it compiles
+
+    The command is returned unchanged if there's no format. See :func:`format_for`
+
+    """
+    match = re.search(r"(^|&&\s*)pdflatex\s", command)
+    if not match:
+        return command
+    fmt = format_for(tex_file)
+    if not fmt:
+        return command
+    return command[:match.end()] + f"-fmt={fmt} " + command[match.end():]
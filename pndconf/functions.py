@@ -1,11 +1,14 @@
 import os
 import sys
+import json
 import time
+import threading
+from pathlib import Path
 
-from watchdog.observers import Observer
+from common_pyutil.functional import unique
 
-from .watcher import ChangeHandler
-from .util import which, logd, loge, logi, logbi, logw
+from .util import which, logd, loge, logi, logbi, logw, output_files
+from .bibliography import normalize_bibliography
 
 
 def set_exclude_regexps(args, config):
@@ -36,6 +39,11 @@ def set_exclusions(args, config):
 
 
 def watch(args, config):
+    # NOTE: watchdog is imported only when watching
+    from watchdog.observers import Observer
+    from .watcher import ChangeHandler, ResourceHandler
+    from .scheduler import Scheduler
+
     # FIXME: The program assumes that extensions startwith '.'
     if args.exclude_regexp:
         set_exclude_regexps(args, config)
@@ -60,13 +68,60 @@ def watch(args, config):
         get_watched = config.get_watched
     logi(f"Watching: {watched_elements}")
     logi(f"Will output to {os.path.abspath(config.output_dir)}")
+    preview_server = None
+    if args.preview:
+        from .preview import PreviewServer
+
+        preview_server = PreviewServer(config.output_dir, args.preview_host, args.preview_port)
+        preview_server.start()
+        logbi(f"Open the html outputs at {preview_server.url} to reload them on changes")
+
+    def compile_func(md_files, filetypes=None, text=None):
+        post = config.compile_files(md_files, text=text, filetypes=filetypes)
+        if preview_server:
+            preview_server.notify(output_files(post))
+        return post
+    scheduler = Scheduler(compile_func, config.filetypes, config.schedule)
+    for filetype in config.filetypes:
+        mode, delay = scheduler.tier(filetype)
+        if mode != "immediate":
+            logi(f"Will build {filetype} " +
+                 (f"after {delay} seconds idle" if mode == "idle" else "only on request"))
+    request_server = None
+    manual = [ft for ft in config.filetypes if scheduler.tier(ft)[0] == "manual"]
+    if manual:
+        from .server import Server, default_socket_path
+
+        # NOTE: The manual filetypes are built on the requests of the client
+        socket_path = Path(args.socket) if args.socket else default_socket_path()
+        try:
+            request_server = Server(socket_path, lambda md_file, text, filetypes:
+                                    scheduler.build(md_file, filetypes, text))
+        except FileExistsError as e:
+            loge(f"{e}. Can't accept requests to build {manual}. "
+                 "Stop the other server or give another --socket")
+            sys.exit(1)
+        request_thread = threading.Thread(target=request_server.serve, daemon=True)
+        request_thread.start()
+        socket_opt = f" --socket {socket_path}" if args.socket else ""
+        logbi(f"Build {manual} with \"pndconf client{socket_opt} convert FILE -g "
+              f"{','.join(manual)}\"")
     logi("Starting pandoc watcher...")
     # CHECK: Maybe just pass config directly
     event_handler = ChangeHandler(config.watch_dir, is_watched,
-                                  get_watched, config.compile_files,
-                                  config.log_level)
+                                  get_watched, scheduler,
+                                  config.log_level, config.resources.invalidate)
     observer = Observer()
     observer.schedule(event_handler, str(config.watch_dir), recursive=True)
+    # NOTE: CSL and templates directories outside the watch dir are watched
+    #       only to keep the resources index up to date
+    config.resources.watched = True
+    resources_handler = ResourceHandler(config.resources.invalidate)
+    resource_dirs = unique([Path(x).absolute() for x in [config.csl_dir, config.templates_dir]
+                            if x and Path(x).is_dir()])
+    for resource_dir in resource_dirs:
+        if config.watch_dir not in [resource_dir, *resource_dir.parents]:
+            observer.schedule(resources_handler, str(resource_dir), recursive=True)
     observer.start()
     try:
         while True:
@@ -74,8 +129,13 @@ def watch(args, config):
     except KeyboardInterrupt as err:
         logi(str(err))
         logi("Stopping pandoc watcher ...")
-        # NOTE: Start simple server here when added and asked
         observer.stop()
+        scheduler.stop()
+        if request_server:
+            request_server.shutdown()
+            request_thread.join(5)
+        if preview_server:
+            preview_server.stop()
     logi("Stopped pandoc watcher")
     sys.exit(0)
 
@@ -98,6 +158,79 @@ def convert(args, config):
         config.compile_files(input_files)
 
 
+def serve(args, config):
+    from .server import Server, default_socket_path
+
+    socket_path = Path(args.socket) if args.socket else default_socket_path()
+    # NOTE: Nothing watches the directories here, so the resources index
+    #       checks them for changes on each lookup
+    config.resources.watched = False
+    try:
+        server = Server(socket_path, config.compile_files)
+    except FileExistsError as e:
+        loge(str(e))
+        sys.exit(1)
+    logbi(f"Will compile requested files to {config.output_dir}")
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        logi("Stopping pndconf server ...")
+    logi("Stopped pndconf server")
+    sys.exit(0)
+
+
+def client(args):
+    from .server import send_request, default_socket_path
+
+    socket_path = Path(args.socket) if args.socket else default_socket_path()
+    if args.client_command == "convert":
+        request = {"command": "convert", "file": os.path.abspath(args.input_file),
+                   "wait": not args.no_wait}
+        if args.generation:
+            request["filetypes"] = args.generation.split(",")
+        # NOTE: The unsaved buffer is sent so that the file needn't be written
+        if args.stdin:
+            request["text"] = sys.stdin.read()
+    elif args.client_command == "status":
+        request = {"command": "status"}
+    elif args.client_command == "cancel":
+        if args.id is None and not args.input_file:
+            loge("Give the id or the file of the build to cancel")
+            sys.exit(1)
+        request = {"command": "cancel", "id": args.id,
+                   "file": args.input_file and os.path.abspath(args.input_file)}
+    else:
+        loge("No client command given. Choose from ['convert', 'status', 'cancel']")
+        sys.exit(1)
+    try:
+        response = send_request(socket_path, request)
+    except OSError as e:
+        loge(f"Could not connect to pndconf server at {socket_path}: {e}")
+        sys.exit(1)
+    print(json.dumps(response, indent=2))
+    sys.exit(0 if response.get("ok") else 1)
+
+
+def bib(args, config):
+    if args.bib_command != "normalize":
+        loge("No bib command given. Choose from ['normalize']")
+        sys.exit(1)
+    input_files = args.input_files.split(",")
+    not_input_files = [x for x in input_files if not os.path.exists(x)]
+    if not_input_files:
+        loge(f"Error! {not_input_files} don't exist")
+        sys.exit(1)
+    if args.transforms:
+        transform_names = [*map(str.strip, args.transforms.split(","))]
+    else:
+        transform_names = config.bib_transforms
+    jobs = max(1, args.jobs)
+    logbi(f"Normalizing {input_files} with transforms {transform_names} and {jobs} jobs")
+    count = normalize_bibliography(input_files, Path(args.output_file), transform_names,
+                                   jobs=jobs, chunk_size=max(1, args.chunk_size),
+                                   dedup_policy=args.dedup or config.dedup_policy)
+    logbi(f"Wrote {count} entries to {args.output_file}")
+
 
 def standalone(args, config):
     input_files = args.input_files.split(",")
@@ -1,17 +1,19 @@
-from typing import List, Optional, Tuple
+from typing import List, Optional, Tuple, Dict, Any, TYPE_CHECKING
 
+import os
 import sys
-import shlex
 from pathlib import Path
-from subprocess import Popen, PIPE
 import argparse
 
-from .config import Configuration
 from .util import which, logd, loge, logi, logbi, logw
-from .functions import watch, convert
 from .const import gentypes, log_levels
+from .dedup import policies as dedup_policies
+from .toolchain import pandoc_info
 from . import __version__
 
+if TYPE_CHECKING:
+    from .config import Configuration
+
 
 usage = """
     pndconf [global_opts] CMD [opts] [pandoc_opts]
@@ -27,29 +29,38 @@ usage = """
 
 
 def pandoc_version_and_path(pandoc_path: Optional[Path]):
+    pandoc_path, info = pandoc_path_and_info(pandoc_path)
+    return pandoc_path, info["version"]
+
+
+def pandoc_path_and_info(pandoc_path: Optional[Path]) -> Tuple[Path, Dict[str, Any]]:
+    """Return the pandoc path and the cached probe results of pandoc.
+
+    See :func:`pndconf.toolchain.pandoc_info`
+
+    """
     pandoc_path = Path(pandoc_path or which("pandoc"))
     if not (pandoc_path.exists() and pandoc_path.is_file()):
         loge("'pandoc' executable not available.\n"
              "Please install pandoc. Exiting!")
         sys.exit(1)
     try:
-        pandoc_version = Popen(shlex.split(f"{pandoc_path} --version"), stdout=PIPE).\
-            communicate()[0].decode("utf-8").split()[1]
+        info = pandoc_info(pandoc_path)
     except Exception as e:
         loge(f"Error checking pandoc version {e}")
         sys.exit(1)
-    return pandoc_path, pandoc_version
+    return pandoc_path, info
 
 
-def get_pandoc_help_output(pandoc_path):
-    return Popen([str(pandoc_path), "--help"], stdout=PIPE, stderr=PIPE).communicate()
+def get_pandoc_help_output(info: Dict[str, Any]) -> Tuple[str, str]:
+    return info["help"], info["help_error"]
 
 
-def print_pandoc_opts(stdout, stderr):
+def print_pandoc_opts(stdout: str, stderr: str):
     if stderr:
-        loge(f"Pandoc exited with error {stderr.decode('utf-8')}")
+        loge(f"Pandoc exited with error {stderr}")
     else:
-        loge(f"Pandoc options are \n{stdout.decode('utf-8')}")
+        loge(f"Pandoc options are \n{stdout}")
 
 
 def print_generation_opts(args, config):
@@ -69,11 +80,11 @@ def maybe_exit_for_unknown_generation_type(args):
         sys.exit(1)
 
 
-def set_log_levels_and_maybe_log_pandoc_output(args, config, out):
+def set_log_levels_and_maybe_log_pandoc_output(args, config, out: str):
     config.log_level = args.log_level
     if config.log_level > 2:
-        logi("\n".join(out.decode().split("\n")[:3]))
-        logi("-" * len(out.decode().split("\n")[2]))
+        logi("\n".join(out.split("\n")[:3]))
+        logi("-" * len((out.split("\n") + ["", "", ""])[2]))
     if args.log_file:
         config._log_file = args.log_file
         logw("Log file isn't implemented yet. Will output to stdout")
@@ -82,8 +93,24 @@ def set_log_levels_and_maybe_log_pandoc_output(args, config, out):
 # TODO: Need Better checks
 # NOTE: These options will override pandoc options in all the sections of
 #       the config file
-def validate_extra_args(extra):
+def validate_extra_args(extra, pandoc_options: Optional[List[str]] = None):
+    """Validate the extra arguments which are passed on to pandoc.
+
+    Args:
+        extra: The extra arguments
+        pandoc_options: Options supported by pandoc, as found by
+                        :func:`pndconf.toolchain.parse_help_options`. They
+                        aren't checked if not given.
+
+    """
+    known = set(pandoc_options or [])
     for i, arg in enumerate(extra):
+        name = arg.split("=")[0][2:] if arg.startswith("--") else arg
+        if known and arg.startswith("-") and not (i >= 1 and extra[i-1] == "-V") and\
+           name not in known:
+            loge(f"Unknown pandoc option {arg}.\n"
+                 "Print \"pndconf --print-pandoc-opts\" to see the options.")
+            sys.exit(1)
         if not arg.startswith('-') and not (i >= 1 and extra[i-1] == "-V"):
             loge(f"Unknown pdfconf option {arg}.\n"
                  f"If it's a pandoc option {arg}, it must be preceded with -"
@@ -100,9 +127,13 @@ def validate_extra_args(extra):
 #        specified in the config.ini (which only contains generation) options
 #        anyway. Perhaps they should be moved to separate config classes.
 def get_config_and_pandoc_output(args: argparse.Namespace)\
-        -> Tuple[Configuration, Tuple[str, str]]:
-    pandoc_path, pandoc_version = pandoc_version_and_path(args.pandoc_path)
-    out, err = get_pandoc_help_output(pandoc_path)
+        -> Tuple["Configuration", Tuple[str, str]]:
+    # NOTE: Imported here, so that the CLI starts quickly when no
+    #       configuration is needed, e.g., for "--version"
+    from .config import Configuration
+    pandoc_path, info = pandoc_path_and_info(args.pandoc_path)
+    pandoc_version = info["version"]
+    out, err = get_pandoc_help_output(info)
     logi(f"Pandoc path is {pandoc_path}\n")
     # NOTE: This one is only watch specific
     watch_dir = getattr(args, "watch_dir", None)
@@ -122,6 +153,7 @@ def get_config_and_pandoc_output(args: argparse.Namespace)\
                            same_pdf_output_dir=same_pdf_output_dir,
                            dry_run=args.dry_run)
     set_log_levels_and_maybe_log_pandoc_output(args, config, out)
+    config.pandoc_info = info
     return config, (out, err)
 
 
@@ -139,6 +171,11 @@ def add_common_args(parser):
                         help=f"Which formats to output. Can be [{', '.join(gentypes)}].\n"
                         "Defaults to pdf. You can choose multiple generation at once.\n"
                         "E.g., 'pndconf -g pdf,html' or 'pndconf -g beamer,reveal'")
+    parser.add_argument("--profile", default="",
+                        help="Build profile applied over the options of all the filetypes.\n"
+                        "\"draft\" skips the TOC, runs pdflatex once and bibtex only if\n"
+                        "the citations changed. Profiles are read from \"[profile.NAME]\"\n"
+                        "sections of the config. Defaults to the full build")
     parser.add_argument("--same-pdf-output-dir", action="store_true", dest="same_pdf_output_dir",
                         help="Output tex files and pdf to same dir as markdown file.\n"
                         "Default is to create a separate folder with a \"_files\" suffix")
@@ -201,6 +238,14 @@ def add_watch_parser(subparsers):
         # To watch in some input directory and generate pdf and beamer outputs
         # to some other output directory
         pndconf watch -g pdf,beamer -w /path/to/watch_dir -o output_dir
+
+        # To preview the html outputs at http://127.0.0.1:8000 which are
+        # reloaded when they're built again
+        pndconf watch -g html --preview
+
+        # With pdf scheduled as "manual" in the config, to build it on request
+        pndconf watch -g pdf,html
+        pndconf client convert article.md -g pdf
 """
     parser = subparsers.add_parser("watch",
                                    description=description,
@@ -228,10 +273,128 @@ def add_watch_parser(subparsers):
     parser.add_argument("--exclude-files", dest="excluded_files",
                               default="",
                               help="Specific files to exclude from watching")
+    parser.add_argument("--preview", action="store_true",
+                              help="Serve the output directory over http and reload the\n"
+                              "open html outputs when they're built again.")
+    parser.add_argument("--preview-host", dest="preview_host", default="127.0.0.1",
+                              help="Host for the preview server. Defaults to 127.0.0.1")
+    parser.add_argument("--preview-port", dest="preview_port", type=int, default=8000,
+                              help="Port for the preview server. Defaults to 8000")
+    parser.add_argument("--socket", default="",
+                              help="Path of the socket on which to accept requests for\n"
+                              "the \"manual\" filetypes. See \"pndconf serve --help\"")
+    add_common_args(parser)
+
+
+def add_bib_parser(subparsers):
+    description = "Operations on bibliography files"
+    bib_usage = """
+    pndconf [global_opts] bib CMD [opts]
+
+    Example:
+        # To normalize a large library with the transforms in the config file
+        # with 8 worker processes
+        pndconf bib normalize library.bib -o library_normalized.bib --jobs 8
+"""
+    parser = subparsers.add_parser("bib",
+                                   usage=bib_usage,
+                                   description=description,
+                                   allow_abbrev=False,
+                                   formatter_class=argparse.RawTextHelpFormatter)
+    bib_subparsers = parser.add_subparsers(help="Bibliography Commands", dest="bib_command")
+    normalize = bib_subparsers.add_parser("normalize",
+                                          description="Apply the transforms to bibliography files",
+                                          allow_abbrev=False,
+                                          formatter_class=argparse.RawTextHelpFormatter)
+    normalize.add_argument("input_files", help="Comma separated list of bibliography files.")
+    normalize.add_argument("-o", "--output-file", dest="output_file", required=True,
+                           help="File to write the normalized bibliography to")
+    normalize.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                           help="Number of worker processes. Defaults to number of CPUs")
+    normalize.add_argument("--chunk-size", dest="chunk_size", type=int, default=1000,
+                           help="Number of entries sent to a worker process at a time")
+    normalize.add_argument("--transforms", default="",
+                           help="Comma separated list of transforms.\n"
+                           "Defaults to \"transforms\" in the config file")
+    normalize.add_argument("--dedup", default="", choices=["", *dedup_policies],
+                           help="Remove duplicate entries keeping one according to the policy.\n"
+                           "Defaults to \"dedup\" in the config file")
+
+
+def add_serve_parser(subparsers):
+    description = "Run a server which converts files on requests from clients"
+    serve_usage = """
+    pndconf [global_opts] serve [opts] [pandoc_opts]
+
+    The configuration, caches and pandoc options are loaded once, so a request
+    doesn't wait for them.
+
+    Example:
+        # Serve on the default socket and generate pdf and html outputs
+        pndconf serve -g pdf,html
+
+        # Then convert a file, or an unsaved buffer of it from stdin
+        pndconf client convert yourfile.md
+        cat yourfile.md | pndconf client convert --stdin yourfile.md
+"""
+    parser = subparsers.add_parser("serve",
+                                   usage=serve_usage,
+                                   description=description,
+                                   allow_abbrev=False,
+                                   formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--socket", default="",
+                        help="Path of the server socket.\n"
+                        "Defaults to \"pndconf.sock\" in $XDG_RUNTIME_DIR or the temp directory")
     add_common_args(parser)
 
 
+def add_client_parser(subparsers):
+    description = "Send requests to a running pndconf server"
+    client_usage = """
+    pndconf client [--socket SOCKET] CMD [opts]
+
+    Example:
+        # Convert a file and wait for the build
+        pndconf client convert yourfile.md
+
+        # Status of the server and its queued builds
+        pndconf client status
+
+        # Cancel the queued builds of a file
+        pndconf client cancel yourfile.md
+"""
+    parser = subparsers.add_parser("client",
+                                   usage=client_usage,
+                                   description=description,
+                                   allow_abbrev=False,
+                                   formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--socket", default="",
+                        help="Path of the server socket. See \"pndconf serve --help\"")
+    client_subparsers = parser.add_subparsers(help="Client Commands", dest="client_command")
+    convert = client_subparsers.add_parser("convert", description="Convert a file",
+                                           allow_abbrev=False)
+    convert.add_argument("input_file", help="The markdown file")
+    convert.add_argument("--stdin", action="store_true",
+                         help="Read the text of the file from stdin instead of the file")
+    convert.add_argument("--no-wait", action="store_true", dest="no_wait",
+                         help="Return after the build is queued")
+    convert.add_argument("-g", "--generation", default="",
+                         help="Comma separated filetypes to build, e.g., the ones\n"
+                         "scheduled as \"manual\". Defaults to those of the server")
+    client_subparsers.add_parser("status", description="Print the status of the server",
+                                 allow_abbrev=False)
+    cancel = client_subparsers.add_parser("cancel", description="Cancel queued builds",
+                                          allow_abbrev=False)
+    cancel.add_argument("input_file", nargs="?", default="",
+                        help="Cancel the queued builds of this file")
+    cancel.add_argument("--id", type=int, help="Cancel the build with this id")
+
+
 def check_and_dispatch_command(args, extra, short_help):
+    from .functions import watch, convert, bib, serve, client
+    # NOTE: The client only talks to the server and doesn't need the config
+    if args.command == "client":
+        client(args)
     config, out_err = get_config_and_pandoc_output(args)
 
     common_args, _ = common_args_parser().parse_known_args()
@@ -250,22 +413,35 @@ def check_and_dispatch_command(args, extra, short_help):
         loge("No command given. Issue a command or a switch.\n")
         print(short_help)
         sys.exit(1)
+    # NOTE: bib commands don't need the generation options
+    if args.command == "bib":
+        bib(args, config)
+        sys.exit(0)
     if not common_args.generation:
         loge("Generation options cannot be empty")
         sys.exit(1)
 
     maybe_exit_for_unknown_generation_type(args)
-    validate_extra_args(extra)
+    validate_extra_args(extra, config.pandoc_info.get("options"))
     logbi(f"Will generate for {args.generation.upper()}")
     logbi(f"Extra pandoc args are {extra}")
 
     # Update generation options, it'll generate everything by default
     config.update_generation_options(args.generation.split(','), extra)
+    try:
+        config.set_profile(args.profile)
+    except ValueError as e:
+        loge(str(e))
+        sys.exit(1)
+    if args.profile:
+        logbi(f"Will build with profile {args.profile}")
 
     if args.command == "watch":
         watch(args, config)
     elif args.command == "convert":
         convert(args, config)
+    elif args.command == "serve":
+        serve(args, config)
 
 
 class MyParser(argparse.ArgumentParser):
@@ -338,6 +514,9 @@ def main():
     subparsers = parser.add_subparsers(help="Sub Commands", dest="command")
     add_watch_parser(subparsers)
     add_convert_parser(subparsers)
+    add_bib_parser(subparsers)
+    add_serve_parser(subparsers)
+    add_client_parser(subparsers)
     args, extra = parser.parse_known_args()
     if args.help:
         print(description)
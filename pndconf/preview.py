@@ -0,0 +1,201 @@
+from typing import Dict, Iterable, Optional, Union
+import os
+import threading
+from pathlib import Path
+from functools import partial
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+from .util import logd, logi
+
+
+Pathlike = Union[str, Path]
+
+events_path = "/__pndconf__/events"
+
+# NOTE: The page subscribes to the reloads of its own file only
+reload_script = """<script>
+(function() {
+  var source = new EventSource("%s?file=" + encodeURIComponent(location.pathname));
+  source.addEventListener("reload", function() { location.reload(); });
+})();
+</script>
+""" % events_path
+
+
+def inject_reload_script(html: bytes) -> bytes:
+    """Insert :data:`reload_script` in :code:`html` before the closing body tag.
+
+    Args:
+        html: Contents of an html file
+
+    The script is appended if there's no closing body tag.
+
+    """
+    script = reload_script.encode()
+    index = html.lower().rfind(b"</body>")
+    if index == -1:
+        return html + script
+    return html[:index] + script + html[index:]
+
+
+class Notifier:
+    """Keep the versions of the output files and wait for their changes.
+
+    The version of a file is incremented each time it's written.
+
+    """
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        self._cond = threading.Condition()
+        self.stopped = False
+
+    def version(self, path: Pathlike) -> int:
+        with self._cond:
+            return self._versions.get(os.path.abspath(path), 0)
+
+    def notify(self, paths: Iterable[Pathlike]):
+        """Increment the versions of :code:`paths` and wake the waiting clients
+
+        Args:
+            paths: The output files which were written
+
+        """
+        with self._cond:
+            for path in map(os.path.abspath, paths):
+                self._versions[path] = self._versions.get(path, 0) + 1
+            self._cond.notify_all()
+
+    def wait(self, path: Pathlike, version: int, timeout: float) -> Optional[int]:
+        """Wait for :code:`path` to change from :code:`version` and return its new version
+
+        Args:
+            path: The output file
+            version: Its last known version
+            timeout: Timeout in seconds
+
+        Returns None on timeout or if the notifier is stopped.
+
+        """
+        path = os.path.abspath(path)
+        with self._cond:
+            self._cond.wait_for(lambda: self.stopped or
+                                self._versions.get(path, 0) != version, timeout)
+            current = self._versions.get(path, 0)
+            return None if self.stopped or current == version else current
+
+    def stop(self):
+        with self._cond:
+            self.stopped = True
+            self._cond.notify_all()
+
+
+class PreviewHandler(SimpleHTTPRequestHandler):
+    """Serve the output files with the live reload script in the html files.
+
+    Args:
+        notifier: The :class:`Notifier` of the output files
+        keepalive: Interval in seconds of the comments sent on the event stream
+
+    """
+    def __init__(self, *args, notifier: Notifier, keepalive: float = 15, **kwargs):
+        self.notifier = notifier
+        self.keepalive = keepalive
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, format, *args):
+        logd("Preview: " + format % args)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == events_path:
+            self.send_events(parse_qs(url.query).get("file", ["/"])[0])
+            return
+        path = self.translate_path(url.path)
+        if os.path.isdir(path):
+            path = os.path.join(path, "index.html")
+        if path.endswith((".html", ".htm")) and os.path.isfile(path):
+            with open(path, "rb") as f:
+                body = inject_reload_script(f.read())
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            super().do_GET()
+
+    def send_events(self, file: str):
+        """Send a :code:`reload` event each time :code:`file` is written
+
+        Args:
+            file: URL path of the page
+
+        """
+        path = self.translate_path(file)
+        if os.path.isdir(path):
+            path = os.path.join(path, "index.html")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        version = self.notifier.version(path)
+        try:
+            self.wfile.write(b": connected\n\n")
+            self.wfile.flush()
+            while not self.notifier.stopped:
+                current = self.notifier.wait(path, version, self.keepalive)
+                if current is None:
+                    self.wfile.write(b": keepalive\n\n")
+                else:
+                    version = current
+                    self.wfile.write(f"event: reload\ndata: {version}\n\n".encode())
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class PreviewServer(ThreadingHTTPServer):
+    """An HTTP server for previewing the output files with live reload.
+
+    Args:
+        directory: The directory to serve, usually the output directory
+        host: Host to listen on
+        port: Port to listen on. A free port is chosen if it's 0
+
+    The html pages are served with a script which listens on an event stream
+    for the writes of its own file, so that only the pages of the files which
+    were built are reloaded. :meth:`notify` must be called with the written
+    output files.
+
+    """
+    daemon_threads = True
+
+    def __init__(self, directory: Pathlike, host: str = "127.0.0.1", port: int = 8000):
+        self.directory = Path(directory).absolute()
+        self.notifier = Notifier()
+        handler = partial(PreviewHandler, directory=str(self.directory),
+                          notifier=self.notifier)
+        super().__init__((host, port), handler)
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def notify(self, paths: Iterable[Pathlike]):
+        paths = [*paths]
+        logd(f"Notifying preview clients of {paths}")
+        self.notifier.notify(paths)
+
+    def start(self):
+        self._thread.start()
+        logi(f"Serving previews of {self.directory} at {self.url}")
+
+    def stop(self):
+        self.notifier.stop()
+        self.shutdown()
+        self.server_close()
+
@@ -0,0 +1,199 @@
+from typing import Dict, List, Optional, Set, Tuple, Union
+import os
+from pathlib import Path
+
+from .util import expandpath, logd, logw
+
+
+Pathlike = Union[str, Path]
+
+
+def candidate_names(kind: str, name: str) -> List[str]:
+    """Return the file names which :code:`name` can refer to, in order of preference.
+
+    Args:
+        kind: One of "csl" or "template"
+        name: The CSL or template name
+
+    E.g., a CSL named "ieee" can be the file "ieee" or "ieee.csl", and a
+    template named "ieee" can be "ieee", "default.ieee" or "ieee.template".
+    The names are resolved only by :meth:`ResourceIndex.resolve`.
+
+    """
+    if kind == "template":
+        return [name, f"default.{name}", f"{name}.template"]
+    elif kind == "csl":
+        return [name, f"{name}.csl"]
+    else:
+        return [name]
+
+
+def dir_mtime(path: str) -> Optional[int]:
+    "Return the modification time of the directory :code:`path` or None if it doesn't exist"
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ResourceIndex:
+    """Resolve CSL and template names with an index of the search directories.
+
+    Each directory is listed once and its entry names are kept in a
+    :class:`set`, so that checking for a candidate file is a lookup instead of
+    a filesystem call. The resolved paths are memoized per kind, name, search
+    directory and directory of the input file.
+
+    Args:
+        watched: Whether the directories are watched for changes
+
+    If the directories are watched, :meth:`invalidate` must be called with the
+    paths which changed, which :class:`pndconf.watcher.ChangeHandler` does in
+    watch mode. Otherwise, e.g., for the long running server, the
+    modification times of the indexed directories are checked on each
+    lookup and the changed ones are listed again. See :meth:`revalidate`.
+
+    """
+    def __init__(self, watched: bool = False):
+        self.watched = watched
+        self._entries: Dict[str, Set[str]] = {}
+        self._mtimes: Dict[str, Optional[int]] = {}
+        self._versions: Dict[str, int] = {}
+        self._dirty: Set[str] = set()
+        self._memo: Dict[Tuple[str, str, str, str], str] = {}
+        self.scans = 0
+
+    def entries(self, directory: Pathlike) -> Set[str]:
+        """Return the names of the entries of :code:`directory`
+
+        Args:
+            directory: The directory
+
+        The directory is listed only the first time or if it's been
+        invalidated since. If the names differ from the earlier listing, the
+        :meth:`version` of the directory is incremented and the memoized
+        results are cleared. A directory which doesn't exist has no entries.
+
+        """
+        path = os.path.abspath(directory)
+        if path not in self._entries or path in self._dirty:
+            self.scans += 1
+            self._dirty.discard(path)
+            # NOTE: Taken before listing so that a change while listing is
+            #       seen by the next :meth:`revalidate`
+            self._mtimes[path] = dir_mtime(path)
+            try:
+                entries = set(os.listdir(path))
+            except OSError:
+                entries = set()
+            if path in self._entries and self._entries[path] != entries:
+                logd(f"Entries changed in {path}")
+                self._versions[path] = self._versions.get(path, 0) + 1
+                self._memo.clear()
+            self._entries[path] = entries
+        return self._entries[path]
+
+    def version(self, directory: Pathlike) -> int:
+        """Return the version of :code:`directory`
+
+        Args:
+            directory: The directory
+
+        The version changes only when entries are added to the directory or
+        removed from it, and not when a file in it is modified or saved via
+        a temporary file.
+
+        """
+        if not self.watched:
+            self.revalidate([directory])
+        self.entries(directory)
+        return self._versions.get(os.path.abspath(directory), 0)
+
+    def revalidate(self, directories: Optional[List[Pathlike]] = None):
+        """Mark the indexed directories whose modification time changed to be listed again
+
+        Args:
+            directories: The directories to check. Defaults to all the indexed ones.
+
+        Adding, removing or renaming an entry changes the modification time
+        of a directory, so this needs one :func:`os.stat` per directory
+        instead of a listing.
+
+        """
+        paths = self._mtimes if directories is None else\
+            [os.path.abspath(x) for x in directories]
+        for path in paths:
+            if path in self._mtimes and dir_mtime(path) != self._mtimes[path]:
+                self._dirty.add(path)
+
+    def invalidate(self, path: Pathlike):
+        """Mark the directory containing :code:`path` to be listed again
+
+        Args:
+            path: A file or directory which was created, moved or deleted
+
+        If :code:`path` is itself an indexed directory, it's marked too.
+
+        """
+        path = os.path.abspath(path)
+        self._dirty.update(x for x in [os.path.dirname(path), path] if x in self._entries)
+
+    def find(self, kind: str, name: str, directory: Path) -> Optional[str]:
+        """Return the CSL or template file for :code:`name` in :code:`directory` if it exists
+
+        Args:
+            kind: One of "csl" or "template"
+            name: The CSL or template name
+            directory: The directory in which to search
+
+        """
+        if os.sep in name:
+            return str(directory.joinpath(name)) if directory.joinpath(name).exists() else None
+        entries = self.entries(directory)
+        for candidate in candidate_names(kind, name):
+            if candidate in entries:
+                return str(directory.joinpath(candidate))
+        return None
+
+    def resolve(self, kind: str, name: str, search_dir: Optional[Path],
+                in_file: Pathlike) -> str:
+        """Get the CSL or template file from its name.
+
+        Args:
+            kind: One of "csl" or "template"
+            name: The CSL or template name, a relative or a full path
+            search_dir: The CSL or templates directory from the config
+            in_file: The input file path
+
+        If :code:`name` is an existing path it's returned as a full path.
+        Otherwise it's searched for in order in :code:`search_dir`, the
+        directory named :code:`kind` next to :code:`in_file` and the
+        directory of :code:`in_file`.
+
+        If it's not found, then :code:`name` is returned as it is and pandoc
+        will look for it in its data directory.
+
+        """
+        if Path(name).exists():
+            return str(expandpath(name))
+        if not self.watched:
+            self.revalidate()
+        for directory in list(self._dirty):
+            self.entries(directory)
+        parent = Path(in_file).parent
+        key = (kind, name, str(search_dir or ""), os.path.abspath(parent))
+        if key not in self._memo:
+            dirs = [search_dir] if search_dir else []
+            if kind in self.entries(parent):
+                dirs.append(parent.joinpath(kind))
+            dirs.append(parent)
+            found = None
+            for directory in dirs:
+                found = self.find(kind, name, directory)
+                if found:
+                    break
+            if not found:
+                logw(f"{kind} file for \"{name}\" not found. "
+                     "This will default to pandoc template if it exists")
+            self._memo[key] = found or name
+        return self._memo[key]
@@ -0,0 +1,176 @@
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
+import os
+import queue
+import threading
+
+from .util import logbi, logd, loge
+
+
+# NOTE: A tier is the mode with the idle time in seconds for "idle"
+Tier = Tuple[str, float]
+
+# NOTE: The compile function is called with the markdown files, the filetypes
+#       to build and optionally the text of the file
+CompileFunc = Callable[[Union[str, List[str]], Optional[List[str]], Optional[str]], Any]
+
+tiers = ["immediate", "idle", "manual"]
+
+
+def parse_tier(value: str) -> Tier:
+    """Parse a scheduling tier from the config.
+
+    Args:
+        value: One of "immediate", "manual" or "idle:SECONDS"
+
+    Raises :class:`ValueError` if :code:`value` isn't a valid tier.
+
+    """
+    mode, _, seconds = value.strip().partition(":")
+    if mode == "idle":
+        try:
+            delay = float(seconds)
+        except ValueError:
+            raise ValueError(f"Idle time must be in seconds, e.g., \"idle:10\". Got {value}")
+        if delay < 0:
+            raise ValueError(f"Idle time cannot be negative. Got {value}")
+        return (mode, delay)
+    elif mode in tiers and not seconds:
+        return (mode, 0)
+    else:
+        raise ValueError(f"Unknown tier {value}. Choose from "
+                         "\"immediate\", \"idle:SECONDS\" or \"manual\"")
+
+
+class Scheduler:
+    """Build the filetypes of the saved files according to their tiers.
+
+    Args:
+        compile_func: Function called with the markdown files, the filetypes
+                      to build and the text. See :data:`CompileFunc` and
+                      :meth:`pndconf.config.Configuration.compile_files`
+        filetypes: The filetypes to build
+        schedule: The tiers of the filetypes. A filetype without a tier is
+                  built immediately.
+
+    The "immediate" filetypes are built on each save. The "idle" filetypes
+    are built only after the file hasn't been saved for the idle time, so a
+    save drops the pending build of the previous one. The "manual" filetypes
+    aren't built on saves, only by :meth:`build`, e.g., on a request from
+    :mod:`pndconf.server`.
+
+    The builds run one at a time as they share the configuration. The builds
+    for saves run on a worker thread, so that the caller, usually the thread
+    of the watchdog observer, never waits for a running build. A save of a
+    file whose build is still queued doesn't queue it again.
+
+    """
+    def __init__(self, compile_func: CompileFunc, filetypes: List[str],
+                 schedule: Dict[str, Tier]):
+        self.compile_func = compile_func
+        self.filetypes = filetypes
+        self.schedule = schedule
+        self._lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._timers: Dict[str, List[threading.Timer]] = {}
+        self._saves: Dict[str, int] = {}
+        self._jobs: "queue.Queue[Optional[Tuple[str, ...]]]" = queue.Queue()
+        self._pending: Set[Tuple[str, ...]] = set()
+        self._worker = threading.Thread(target=self._work, daemon=True)
+        self._worker.start()
+
+    def tier(self, filetype: str) -> Tier:
+        return self.schedule.get(filetype, ("immediate", 0))
+
+    def __call__(self, md_files: Union[str, List[str]]):
+        """Build the :code:`md_files` which were saved
+
+        Args:
+            md_files: A markdown file or a list of them
+        """
+        files = [md_files] if isinstance(md_files, str) else md_files
+        immediate = [ft for ft in self.filetypes if self.tier(ft)[0] == "immediate"]
+        delays: Dict[float, List[str]] = {}
+        for ft in self.filetypes:
+            mode, delay = self.tier(ft)
+            if mode == "idle":
+                delays.setdefault(delay, []).append(ft)
+        with self._state_lock:
+            for md_file in files:
+                self.cancel(md_file)
+                save = self._saves[md_file] = self._saves.get(md_file, 0) + 1
+                for delay, filetypes in delays.items():
+                    logd(f"Deferring {filetypes} of {md_file} for {delay} seconds")
+                    timer = threading.Timer(delay, self._build_if_idle,
+                                            (md_file, filetypes, save))
+                    timer.daemon = True
+                    self._timers.setdefault(md_file, []).append(timer)
+                    timer.start()
+        if immediate:
+            with self._state_lock:
+                for md_file in files:
+                    if (md_file, *immediate) not in self._pending:
+                        self._pending.add((md_file, *immediate))
+                        self._jobs.put((md_file, *immediate))
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                if job is None:
+                    return
+                with self._state_lock:
+                    self._pending.discard(job)
+                md_file, *filetypes = job
+                self.build(md_file, filetypes)
+            except Exception as e:
+                loge(f"Error while building {job}: {e}")
+            finally:
+                self._jobs.task_done()
+
+    def wait(self):
+        "Wait for the queued builds of the saves"
+        self._jobs.join()
+
+    def cancel(self, md_file: str):
+        "Drop the pending builds of :code:`md_file`"
+        for timer in self._timers.pop(md_file, []):
+            timer.cancel()
+
+    def stop(self):
+        "Drop all the pending builds and stop the worker"
+        with self._state_lock:
+            for md_file in [*self._timers]:
+                self.cancel(md_file)
+            self._pending.clear()
+            while True:
+                try:
+                    self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                self._jobs.task_done()
+        self._jobs.put(None)
+
+    def _build_if_idle(self, md_file: str, filetypes: List[str], save: int):
+        # NOTE: Checked again after acquiring the lock as the file may have
+        #       been saved while waiting for a running build
+        with self._lock:
+            if self._saves.get(md_file) != save:
+                logd(f"Dropping build of {filetypes} of {md_file} as it was saved again")
+                return
+            logbi(f"Building {filetypes} of {os.path.basename(md_file)} after idle")
+            self.compile_func(md_file, filetypes, None)
+
+    def build(self, md_files: Union[str, List[str]], filetypes: Optional[List[str]] = None,
+              text: Optional[str] = None):
+        """Build the :code:`filetypes` of :code:`md_files` now, including the manual ones.
+
+        Args:
+            md_files: A markdown file or a list of them
+            filetypes: The filetypes to build. Defaults to all of them.
+            text: Text of the file, if it's not to be read from the disk
+
+        Waits for any running build.
+
+        """
+        with self._lock:
+            return self.compile_func(md_files, filetypes or self.filetypes, text)
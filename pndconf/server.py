@@ -0,0 +1,296 @@
+from typing import Any, Callable, Dict, List, Optional, Union
+import os
+import json
+import time
+import socket
+import tempfile
+import threading
+import socketserver
+from collections import deque
+from pathlib import Path
+
+from .util import logbi, logd, loge, logi, output_files
+
+
+Pathlike = Union[str, Path]
+
+# NOTE: The compile function is called with the file, optionally its text and
+#       the filetypes to build and returns the outputs as returned by
+#       :meth:`pndconf.config.Configuration.compile_files`
+CompileFunc = Callable[[str, Optional[str], Optional[List[str]]], List[Any]]
+
+
+def default_socket_path() -> Path:
+    """Return the default path of the server socket.
+
+    It's in :code:`$XDG_RUNTIME_DIR` if it's set, otherwise in the temporary
+    directory with the user id in its name.
+
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return Path(runtime_dir).joinpath("pndconf.sock")
+    return Path(tempfile.gettempdir()).joinpath(f"pndconf-{os.getuid()}.sock")
+
+
+def send_request(socket_path: Pathlike, request: Dict[str, Any],
+                 timeout: Optional[float] = None) -> Dict[str, Any]:
+    """Send a request to the server and return its response.
+
+    Args:
+        socket_path: Path of the server socket
+        request: The request. See :meth:`Server.dispatch`
+        timeout: Timeout in seconds for the response. Waits indefinitely if not given
+
+    The requests and responses are JSON objects, one per line.
+
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(str(socket_path))
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError(f"Server at {socket_path} closed the connection")
+    return json.loads(line)
+
+
+def remove_stale_socket(socket_path: Path):
+    """Remove :code:`socket_path` if it's left over from a server which isn't running.
+
+    Args:
+        socket_path: Path of the server socket
+
+    Raises :class:`FileExistsError` if a server is listening on it.
+
+    """
+    if not socket_path.exists():
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(socket_path))
+        except OSError:
+            logd(f"Removing stale socket {socket_path}")
+            socket_path.unlink()
+            return
+    raise FileExistsError(f"A server is already running on {socket_path}")
+
+
+class Build:
+    """A build request of a file, optionally with its unsaved text.
+
+    Args:
+        id: Id of the request
+        file: The markdown file
+        text: Text of the file if it's different from that on disk
+        filetypes: The filetypes to build. All of them if not given
+
+    """
+    def __init__(self, id: int, file: str, text: Optional[str],
+                 filetypes: Optional[List[str]] = None):
+        self.id = id
+        self.file = file
+        self.text = text
+        self.filetypes = filetypes
+        self.status = "queued"
+        self.outputs: List[str] = []
+        self.error = ""
+        self.done = threading.Event()
+
+    def finish(self, status: str, error: str = ""):
+        self.status = status
+        self.error = error
+        self.done.set()
+
+    def response(self) -> Dict[str, Any]:
+        return {"ok": self.status in {"queued", "done"}, "id": self.id, "file": self.file,
+                "status": self.status, "outputs": self.outputs, "error": self.error}
+
+
+class BuildQueue:
+    """Run builds one at a time in a worker thread.
+
+    Args:
+        compile_func: Function to compile a file. See :data:`CompileFunc`
+
+    The builds are run serially as they share the
+    :class:`pndconf.config.Configuration` and its caches. A queued build of a
+    file is superseded by a newer request for the same file and filetypes,
+    so that only the latest text of an editor buffer is built.
+
+    """
+    def __init__(self, compile_func: CompileFunc):
+        self.compile_func = compile_func
+        self.builds = 0
+        self.running: Optional[Build] = None
+        self._queue: deque = deque()
+        self._cond = threading.Condition()
+        self._next_id = 0
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            while self._queue:
+                self._queue.popleft().finish("cancelled", "Server stopped")
+            self._cond.notify_all()
+
+    def submit(self, file: str, text: Optional[str] = None,
+               filetypes: Optional[List[str]] = None) -> Build:
+        """Queue a build of :code:`file` and return it
+
+        Args:
+            file: The markdown file
+            text: Text of the file if it's different from that on disk
+            filetypes: The filetypes to build. All of them if not given
+
+        """
+        with self._cond:
+            self._next_id += 1
+            build = Build(self._next_id, file, text, filetypes)
+            for queued in [x for x in self._queue
+                           if x.file == file and x.filetypes == filetypes]:
+                self._queue.remove(queued)
+                queued.finish("superseded", f"Superseded by request {build.id}")
+            if self._stopped:
+                build.finish("cancelled", "Server stopped")
+            else:
+                self._queue.append(build)
+                self._cond.notify_all()
+        return build
+
+    def cancel(self, id: Optional[int] = None, file: Optional[str] = None) -> List[int]:
+        """Cancel queued builds and return their ids
+
+        Args:
+            id: Id of the build to cancel
+            file: Cancel the builds of this file
+
+        A running build isn't interrupted.
+
+        """
+        with self._cond:
+            cancelled = [x for x in self._queue if x.id == id or x.file == file]
+            for build in cancelled:
+                self._queue.remove(build)
+                build.finish("cancelled", "Cancelled by client")
+        return [x.id for x in cancelled]
+
+    def status(self) -> Dict[str, Any]:
+        with self._cond:
+            running = self.running
+            return {"builds": self.builds,
+                    "running": running and {"id": running.id, "file": running.file},
+                    "queue": [{"id": x.id, "file": x.file} for x in self._queue]}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                build = self._queue.popleft()
+                self.running = build
+            try:
+                post = self.compile_func(build.file, build.text, build.filetypes)
+                build.outputs = output_files(post)
+                build.finish("done")
+            except Exception as e:
+                loge(f"Error building {build.file}: {e}")
+                build.finish("failed", str(e))
+            with self._cond:
+                self.builds += 1
+                self.running = None
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response = self.server.dispatch(request)  # type: ignore
+            except ValueError as e:
+                response = {"ok": False, "error": f"Invalid request: {e}"}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve build requests on a Unix domain socket.
+
+    Args:
+        socket_path: Path of the server socket
+        compile_func: Function to compile a file. See :data:`CompileFunc`
+
+    The server keeps the configuration and its caches loaded, so that a
+    request doesn't pay for the interpreter startup, imports and toolchain
+    probing. Each connection is handled in its own thread and the builds are
+    run by a :class:`BuildQueue`.
+
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path: Pathlike, compile_func: CompileFunc):
+        self.socket_path = Path(socket_path)
+        remove_stale_socket(self.socket_path)
+        self.queue = BuildQueue(compile_func)
+        self.started = time.time()
+        super().__init__(str(self.socket_path), RequestHandler)
+
+    def dispatch(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle a request and return the response
+
+        Args:
+            request: The request
+
+        The requests are:
+            convert: Build :code:`file`, with :code:`text` if given instead of
+                     reading the file, for the :code:`filetypes` if given.
+                     The response is sent after the build finishes unless
+                     :code:`wait` is false.
+            status: Return the status of the server and its builds
+            cancel: Cancel the queued builds with :code:`id` or of :code:`file`
+
+        """
+        command = request.get("command")
+        if command == "convert":
+            if not request.get("file"):
+                return {"ok": False, "error": "No file given"}
+            build = self.queue.submit(os.path.abspath(request["file"]), request.get("text"),
+                                      request.get("filetypes"))
+            logbi(f"Queued build {build.id} of {build.file}")
+            if request.get("wait", True):
+                build.done.wait()
+            return build.response()
+        elif command == "status":
+            return {"ok": True, "pid": os.getpid(), "socket": str(self.socket_path),
+                    "uptime": time.time() - self.started, **self.queue.status()}
+        elif command == "cancel":
+            file = request.get("file") and os.path.abspath(request["file"])
+            cancelled = self.queue.cancel(request.get("id"), file)
+            running = self.queue.running
+            error = ""
+            if not cancelled:
+                error = "No queued builds to cancel"
+                if running and (running.id == request.get("id") or running.file == file):
+                    error = f"Build {running.id} is running and cannot be cancelled"
+            return {"ok": bool(cancelled), "cancelled": cancelled, "error": error}
+        else:
+            return {"ok": False, "error": f"Unknown command {command}"}
+
+    def serve(self):
+        "Serve until interrupted and remove the socket"
+        self.queue.start()
+        logi(f"Serving on {self.socket_path}")
+        try:
+            self.serve_forever()
+        finally:
+            self.queue.stop()
+            self.server_close()
+            if self.socket_path.exists():
+                self.socket_path.unlink()
@@ -0,0 +1,104 @@
+from typing import Dict, List, Any, Union
+import re
+import json
+import hashlib
+from pathlib import Path
+from subprocess import Popen, PIPE, DEVNULL
+
+from .util import cache_dir, logd
+
+
+Pathlike = Union[str, Path]
+
+
+def run_probe(pandoc_path: Pathlike, *args: str) -> Dict[str, Any]:
+    """Run pandoc with :code:`args` and return its output and return code
+
+    Args:
+        pandoc_path: Path to the pandoc executable
+        args: Arguments to pandoc
+
+    """
+    try:
+        p = Popen([str(pandoc_path), *args], stdin=DEVNULL, stdout=PIPE, stderr=PIPE)
+        out, err = p.communicate()
+        return {"out": out.decode("utf-8", "replace"), "err": err.decode("utf-8", "replace"),
+                "returncode": p.returncode}
+    except OSError as e:
+        return {"out": "", "err": str(e), "returncode": -1}
+
+
+def parse_help_options(help_text: str) -> List[str]:
+    """Return the options listed in the output of :code:`pandoc --help`
+
+    Args:
+        help_text: Output of :code:`pandoc --help`
+
+    Long options are returned without the leading "--" and short ones with
+    the leading "-".
+
+    """
+    long_opts = re.findall(r"(?<![\w-])--([a-zA-Z0-9][\w-]*)", help_text)
+    short_opts = re.findall(r"(?<![\w-])(-[a-zA-Z0-9])\b", help_text)
+    return sorted({*long_opts, *short_opts})
+
+
+def probe_pandoc(pandoc_path: Pathlike) -> Dict[str, Any]:
+    """Run pandoc to find its version, options, extensions and output formats.
+
+    Args:
+        pandoc_path: Path to the pandoc executable
+
+    The lists are empty if pandoc doesn't support listing them.
+
+    """
+    version = run_probe(pandoc_path, "--version")
+    help_output = run_probe(pandoc_path, "--help")
+    extensions = run_probe(pandoc_path, "--list-extensions")
+    output_formats = run_probe(pandoc_path, "--list-output-formats")
+    if version["returncode"]:
+        raise ValueError(f"pandoc --version failed with {version['err']}")
+
+    def lines(result):
+        return [x.strip() for x in result["out"].splitlines() if x.strip()]\
+            if not result["returncode"] else []
+    return {"path": str(pandoc_path),
+            "version": version["out"].split()[1],
+            "version_output": version["out"],
+            "help": help_output["out"],
+            "help_error": help_output["err"],
+            "options": parse_help_options(help_output["out"]),
+            # NOTE: Extensions are listed with the default ones prefixed with "+"
+            #       and the rest with "-"
+            "extensions": [x.lstrip("+-") for x in lines(extensions)],
+            "output_formats": lines(output_formats)}
+
+
+def pandoc_info(pandoc_path: Pathlike) -> Dict[str, Any]:
+    """Return the probe results of pandoc from the cache or probe and cache them.
+
+    Args:
+        pandoc_path: Path to the pandoc executable
+
+    The results are cached keyed by the path, size and mtime of the
+    executable, so an upgraded pandoc is probed again. See
+    :func:`probe_pandoc`.
+
+    """
+    pandoc_path = Path(pandoc_path).absolute()
+    stat = pandoc_path.stat()
+    path_key = hashlib.md5(str(pandoc_path).encode()).hexdigest()[:16]
+    stat_key = hashlib.md5(f"{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:16]
+    cache_file = cache_dir("toolchain").joinpath(f"{path_key}-{stat_key}.json")
+    if cache_file.exists():
+        try:
+            with open(cache_file) as f:
+                return json.load(f)
+        except Exception as e:
+            logd(f"Could not load toolchain cache {cache_file}: {e}")
+    info = probe_pandoc(pandoc_path)
+    for stale in cache_file.parent.glob(f"{path_key}-*.json"):
+        stale.unlink()
+    with open(cache_file, "w") as f:
+        json.dump(info, f)
+    return info
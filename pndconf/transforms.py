@@ -1,181 +1,71 @@
-from typing import Dict, List
+from typing import Dict, List, Optional, Union, Callable, Iterable, Any
 import re
+from pathlib import Path
 
+from .const import stop_words_set
+from .venues import VenueMatcher, load_venues, default_venues_file
+from .abbreviations import AbbrevIndex
+from .util import path_fingerprint
 
-def rule_neurips(x):
-    if "nips" in x.lower() or "neurips" in x.lower() or\
-       "neural information processing" in x.lower():
-        return "neurips"
 
+# TODO: WHAT ABOUT ABBREVIATIONS?
+#       Currently there's no rule to classify "Int. Jour. Comp. Vis." etc.
 
-def rule_iccv(x):
-    if ("computer vision" in x.lower() and "international conference" in x.lower() and
-            "pattern" not in x.lower()) or "iccv" in x.lower():
-        return "iccv"
-
-
-def rule_cvpr(x):
-    if "computer vision and pattern recognition" in x.lower() or "cvpr" in x.lower():
-        return "cvpr"
-
-
-def rule_wavc(x):
-    if "winter conference" in x.lower() and "computer vision" in x.lower() or\
-       "wavc" in x.lower():
-        return "wavc"
-
-
-def rule_eccv(x):
-    if "european conference" in x.lower() and "computer vision" in x.lower() or\
-       "eccv" in x.lower():
-        return "eccv"
-
-
-def rule_iclr(x):
-    if "learning representations" in x.lower() or "iclr" in x.lower():
-        return "iclr"
-
-
-def rule_bmvc(x):
-    if "british" in x.lower() and "machine vision" in x.lower() or "bmvc" in x.lower():
-        return "bmvc"
-
-
-def rule_aistats(x):
-    if "artificial intelligence and statistics" in x.lower() or\
-       "aistats" in x.lower():
-        return "aistats"
-
-
-def rule_uai(x):
-    if "uncertainty in artificial intelligence" in x.lower() or\
-       "UAI" in x:
-        return "uai"
-
-
-def rule_ijcv(x):
-    if "international journal of computer vision" in x.lower() or\
-       "ijcv" in x.lower():
-        return "ijcv"
-
+# TODO: We can add certain other rules like Transactions is always a journal etc.
 
-def rule_ijcai(x):
-    if "ijcai" in x.lower() or\
-       "joint conference on artificial intelligence" in x.lower():
-        return "ijcai"
+# TODO: The variables here should be synced from the network Eventually, the
+#       pndconf should run as a service and accept markdown files so that the
+#       editor doesn't have to wait.
 
+# TODO: In some venues, "eleventh" and "twelfth" etc. are also written denoting
+#       the iteration of the conference. Perhaps use DOI to fetch that or some other method.
 
-def rule_aaai(x):
-    if "aaai" in x.lower():
-        return "aaai"
+# NOTE: The known venues and their rules are in "venues.yaml". Extra venues
+#       files can be added with :func:`set_venues_files`
+venues_files: List[Path] = [default_venues_file]
+_venue_matcher: Optional[VenueMatcher] = None
+# NOTE: Index of LTWA abbreviations for words not in `abbrevs`. See :func:`set_abbrevs_file`
+abbrevs_index: Optional[AbbrevIndex] = None
+abbrevs_path: Optional[Path] = None
 
+Entries = List[Dict[str, str]]
+# NOTE: Batch versions of the transforms. See :func:`batch_transform`
+batch_transforms: Dict[str, Callable[..., Entries]] = {}
 
-def rule_icml(x):
-    if "icml" in x.lower() or\
-       {*filter(lambda y: y not in stop_words_set, x.lower().split())} ==\
-       {"international", "conference", "machine", "learning"}:
-        return "icml"
+months = dict(zip(range(1, 13), [x[:3] for x in ["January", "February",
+                                                 "March", "April", "May", "June", "July", "August",
+                                                 "September", "October", "November", "December"]]))
+title_case_split_regexp = re.compile(r"( +|-)")
+spaces_regexp = re.compile(r"^ +$")
+braced_regexp = re.compile(r"{(.+)}")
 
 
-def rule_pami(x):
-    if ("ieee" in x.lower() and "transactions" in x.lower() and
-            "pattern analysis" in x.lower() and "machine intelligence" in x.lower())\
-            or "PAMI" in x or "TPAMI" in x:
-        return "pami"
+def set_venues_files(files: List[Union[str, Path]]):
+    """Set additional venues files to load venues from.
 
+    Args:
+        files: Venue files. See "venues.yaml" for the format.
 
-def rule_jair(x):
-    if "jair" in x.lower() or\
-       re.match(r"journal +of +artificial +intelligence +research", x, flags=re.IGNORECASE):
-        return True
+    The venues in these files are added to the default ones.
 
+    """
+    global venues_files, _venue_matcher
+    venues_files = [default_venues_file, *map(Path, files)]
+    _venue_matcher = None
 
-def rule_jmlr(x):
-    if "jmlr" in x.lower() or\
-       re.match(r"journal +of +machine +learning +research", x, flags=re.IGNORECASE):
-        return True
 
+def get_venue_matcher() -> VenueMatcher:
+    """Return the :class:`VenueMatcher` for the venues.
 
-# TODO: WHAT ABOUT ABBREVIATIONS?
-#       Currently there's no rule to classify "Int. Jour. Comp. Vis." etc.
+    It's compiled once on first use.
 
-# TODO: We can add certain other rules like Transactions is always a journal etc.
+    """
+    global _venue_matcher
+    if _venue_matcher is None:
+        _venue_matcher = VenueMatcher(load_venues(*venues_files))
+    return _venue_matcher
 
-# TODO: The variables here should be synced from the network Eventually, the
-#       pndconf should run as a service and accept markdown files so that the
-#       editor doesn't have to wait.
 
-# TODO: In some venues, "eleventh" and "twelfth" etc. are also written denoting
-#       the iteration of the conference. Perhaps use DOI to fetch that or some other method.
-venues = {'neurips': {'name': 'Advances in Neural Information Processing Systems',
-                      'type': 'inproceedings',
-                      'contraction': 'NeurIPS',
-                      'rule': rule_neurips},
-          'iccv': {'name': 'Proceedings of the IEEE International Conference on Computer Vision',
-                   'type': 'inproceedings',
-                   'contraction': 'ICCV',
-                   'rule': rule_iccv},
-          'cvpr': {'name': 'Proceedings of the IEEE Conference on Computer Vision and Pattern Recognition',
-                   'type': 'inproceedings',
-                   'contraction': 'CVPR',
-                   'rule': rule_cvpr},
-          'wavc': {'name': 'Proceedings of the IEEE Winter Conference on Applications of Computer Vision',
-                   'type': 'inproceedings',
-                   'contraction': 'WAVC',
-                   'rule': rule_wavc},
-          'eccv': {'name': 'Proceedings of the European Conference on Computer Vision',
-                   'type': 'inproceedings',
-                   'contraction': 'ECCV',
-                   'rule': rule_eccv},
-          'iclr': {'name': 'Proceedings of the International Conference on Learning Representations',
-                   'type': 'inproceedings',
-                   'contraction': 'ICLR',
-                   'rule': rule_iclr},
-          'bmvc': {'name': 'Proceedings of the British Machine Vision Conference',
-                   'type': 'inproceedings',
-                   'contraction': 'BMVC',
-                   'rule': rule_bmvc},
-          'aistats': {'name': 'Proceedings of the International Conference on Artificial Intelligence and Statistics',
-                      'type': 'inproceedings',
-                      'contraction': 'AISTATS',
-                      'rule': rule_aistats},
-          'uai': {'name': 'Proceedings of the Conference on Uncertainty in Artificial Intelligence',
-                  'type': 'inproceedings',
-                  'contraction': 'UAI',
-                  'rule': rule_uai},
-          'ijcv': {'name': 'International Journal of Computer Vision',
-                   'type': 'article',
-                   'contraction': 'IJCV',
-                   'rule': rule_ijcv},
-          'ijcai': {'name': 'Proceedings of the International Joint Conference on Artificial Intelligence',
-                    'type': 'inproceedings',
-                    'contraction': 'IJCAI',
-                    'rule': rule_ijcai},
-          'aaai': {'name': 'Proceedings of the AAAI Conference on Artificial Intelligence',
-                   'type': 'inproceedings',
-                   'contraction': 'AAAI',
-                   'rule': rule_aaai},
-          'icml': {'name': 'Proceedings of the International Conference on Machine Learning',
-                   'type': 'inproceedings',
-                   'contraction': 'ICML',
-                   'rule': rule_icml},
-          'pami': {'name': 'IEEE Transactions on Pattern Analysis and Machine Intelligence',
-                   'type': 'article',
-                   'contraction': 'TPAMI',
-                   'rule': rule_pami},
-          'jair': {'name': 'Journal of Artificial Intelligence Research',
-                   'type': 'article',
-                   'contraction': 'JAIR',
-                   'rule': rule_jair},
-          'jmlr': {'name': 'Journal of Machine Learning Research',
-                   'type': 'article',
-                   'contraction': 'JMLR',
-                   'rule': rule_jmlr}}
-stop_words_set = {"a", "an", "and", "are", "as", "at", "by", "can", "did",
-                  "do", "does", "for", "from", "had", "has", "have", "having", "here", "how",
-                  "in", "into", "is", "it", "it's", "its", "not", "of", "on", "over", "should",
-                  "so", "than", "that", "the", "then", "there", "these", "to", "via", "was", "were",
-                  "what", "when", "where", "which", "who", "why", "will", "with"}
 abbrevs = {'Advances': 'Adv.',
            'in': None,
            'Neural': 'n.a.',
@@ -239,33 +129,77 @@ abbrevs = {'Advances': 'Adv.',
            'winter': 'n.a.'}
 
 
-def load_abbrevs(abbrevs_file):
-    import csv
-    lines = []
-    with open(abbrevs_file) as f:
-        reader = csv.reader(f, delimiter=";")
-        for line in reader:
-            lines.append(line)
-    return {re.sub("-$", ".+", x[0].lower()): x[1].lower()
-            for x in lines if "eng" in x[-1] or x[-1] == "mul"}
+def load_abbrevs(abbrevs_file: Union[str, Path]) -> AbbrevIndex:
+    """Load the LTWA abbreviations from :code:`abbrevs_file`
+
+    Args:
+        abbrevs_file: The LTWA CSV file
 
+    See :class:`pndconf.abbreviations.AbbrevIndex`
 
-def get_abbrev(abbrev_regexps, word):
-    for k, v in abbrev_regexps.items():
-        if re.match(k, word, flags=re.IGNORECASE):
-            return v
+    """
+    return AbbrevIndex.load(abbrevs_file)
 
 
-def update_abbrevs(words, abbrevs, abbrev_regexps):
+def get_abbrev(abbrev_index: AbbrevIndex, word: str) -> Optional[str]:
+    return abbrev_index.lookup(word)
+
+
+def update_abbrevs(words, abbrevs, abbrev_index: AbbrevIndex):
     for w in set(words):
         match = re.match(r"[A-Z]+$", w)  # check all upcase
-        if not match and w not in abbrevs or abbrevs[w] is None:
-            abbrev = get_abbrev(abbrev_regexps, w)
+        if not match and (w not in abbrevs or abbrevs[w] is None):
+            abbrev = get_abbrev(abbrev_index, w)
             if abbrev:
                 abbrevs[w.lower()] = abbrev.lower()
                 abbrevs[w.capitalize()] = abbrev.capitalize()
 
 
+def set_abbrevs_file(abbrevs_file: Optional[Union[str, Path]]):
+    """Set the LTWA file used by :func:`abbreviate_venue` for unknown words
+
+    Args:
+        abbrevs_file: The LTWA CSV file
+
+    """
+    global abbrevs_index, abbrevs_path
+    abbrevs_path = Path(abbrevs_file) if abbrevs_file else None
+    abbrevs_index = load_abbrevs(abbrevs_file) if abbrevs_file else None
+
+
+def get_settings() -> Dict[str, Any]:
+    """Return the venues and abbreviations files set for the transforms.
+
+    They can be restored in another process, e.g., a worker process, with
+    :func:`apply_settings`.
+
+    """
+    return {"venues_files": [str(x) for x in venues_files[1:]],
+            "abbrevs_file": abbrevs_path and str(abbrevs_path)}
+
+
+def settings_fingerprint() -> List[Any]:
+    """Return the settings with the fingerprints of the venues and abbreviations files.
+
+    It changes when the files are set or edited, so it can key results
+    cached across runs. See :func:`get_settings`
+
+    """
+    files = [*venues_files, *([abbrevs_path] if abbrevs_path else [])]
+    return [get_settings(), *(path_fingerprint(x) for x in files)]
+
+
+def apply_settings(settings: Dict[str, Any]):
+    """Set the venues and abbreviations files from :code:`settings`
+
+    Args:
+        settings: Settings as returned by :func:`get_settings`
+
+    """
+    set_venues_files(settings["venues_files"])
+    set_abbrevs_file(settings["abbrevs_file"])
+
+
 def fix_cvf(x: str):
     if "ieee/cvf" in x.lower():
         return x.replace("ieee/cvf", "IEEE").replace("IEEE/CVF", "IEEE")
@@ -303,24 +237,24 @@ def fix_venue(ent: Dict[str, str], contract: bool = False):
     venue = ent.get("booktitle", None) or ent.get("journal", None) or ent.get("venue", None)
     if venue:
         venue = venue.replace("{", "").replace("}", "")
-        for k, v in venues.items():
-            rule = v["rule"]
+        matcher = get_venue_matcher()
+        k = matcher.match(venue)
+        if k:
+            v = matcher.venues[k]
             vtype = v["type"]
-            if rule(venue):
-                vname = v["contraction"] if contract else v["name"]
-                if vtype == "inproceedings":
-                    if ent["ENTRYTYPE"] == "article":
-                        ent["ENTRYTYPE"] = "inproceedings"
-                        ent.pop("journal")
-                    ent["booktitle"] = vname
-                elif vtype == "article":
-                    if ent["ENTRYTYPE"] == "inproceedings":
-                        ent["ENTRYTYPE"] = "article"
-                        ent.pop("booktitle")
-                    ent["journal"] = vname
-                else:
-                    raise AttributeError(f"Unknown venue type of {ent['ENTRYTYPE']}")
-                break
+            vname = v["contraction"] if contract else v["name"]
+            if vtype == "inproceedings":
+                if ent["ENTRYTYPE"] == "article":
+                    ent["ENTRYTYPE"] = "inproceedings"
+                    ent.pop("journal")
+                ent["booktitle"] = vname
+            elif vtype == "article":
+                if ent["ENTRYTYPE"] == "inproceedings":
+                    ent["ENTRYTYPE"] = "article"
+                    ent.pop("booktitle")
+                ent["journal"] = vname
+            else:
+                raise AttributeError(f"Unknown venue type of {ent['ENTRYTYPE']}")
     return ent
 
 
@@ -342,6 +276,24 @@ def contract_venue(ent: Dict[str, str]):
     return fix_venue(ent, contract=True)
 
 
+def title_case(val: str) -> str:
+    """Change a string to title case with each word braced.
+
+    Args:
+        val: The string
+
+    """
+    temp: List[str] = []
+    capitalize_next = False
+    for i, x in enumerate(filter(lambda x: x and not spaces_regexp.match(x),
+                                 title_case_split_regexp.split(val))):
+        cap = (not i) or capitalize_next or x not in stop_words_set
+        y = x.capitalize() if cap else x
+        temp.append(y)
+        capitalize_next = bool(x.endswith((".", ":")))
+    return " ".join([x if x.startswith("{") else "{" + x + "}" for x in temp])
+
+
 def change_to_title_case(ent: Dict[str, str]) -> Dict[str, str]:
     """Change some values in a bibtex entry to title case.
 
@@ -353,43 +305,57 @@ def change_to_title_case(ent: Dict[str, str]) -> Dict[str, str]:
     """
     for key in ["title", "booktitle", "journal"]:
         if key in ent:
-            val = ent[key]
-            temp: List[str] = []
-            capitalize_next = False
-            for i, x in enumerate(filter(lambda x: x and not re.match(r"^ +$", x),
-                                         re.split(r"( +|-)", val))):
-                cap = (not i) or capitalize_next or x not in stop_words_set
-                y = x.capitalize() if cap else x
-                temp.append(y)
-                capitalize_next = bool(x.endswith((".", ":")))
-            ent[key] = " ".join([x if x.startswith("{") else "{" + x + "}" for x in temp])
+            ent[key] = title_case(ent[key])
     return ent
 
 
-def abbreviate_venue(ent: Dict[str, str]) -> Dict[str, str]:
+def venue_key(ent: Dict[str, str]) -> Optional[str]:
+    """Return the key of the venue of the entry for abbreviation if any
+
+    Args:
+        ent: Bibtex entry as a dictionary
+
+    """
     if ent["ENTRYTYPE"] == "inproceedings":
         vkey = "booktitle"
     elif ent["ENTRYTYPE"] == "article":
         vkey = "journal"
     else:
-        return ent
-    try:
-        words = ent[vkey].split()
-    except Exception:
+        return None
+    if vkey not in ent:
         raise AttributeError(f"{vkey} not in entry")
+    return vkey
+
+
+def abbreviate(venue: str) -> str:
+    """Abbreviate the words of a venue
+
+    Args:
+        venue: The venue
+
+    The words are looked up in :code:`abbrevs` and in the LTWA index if it's
+    set. See :func:`set_abbrevs_file`.
+
+    """
+    words = venue.split()
+    if abbrevs_index is not None:
+        update_abbrevs([braced_regexp.sub(r"\1", w) for w in words], abbrevs, abbrevs_index)
     for i, w in enumerate(words):
-        term = re.sub(r"{(.+)}", r"\1", w)
+        term = braced_regexp.sub(r"\1", w)
         found = term in abbrevs and abbrevs[term] != "n.a." and abbrevs[term]
         if found:
             words[i] = "{" + found + "}"
-    ent[vkey] = " ".join(words)
+    return " ".join(words)
+
+
+def abbreviate_venue(ent: Dict[str, str]) -> Dict[str, str]:
+    vkey = venue_key(ent)
+    if vkey:
+        ent[vkey] = abbreviate(ent[vkey])
     return ent
 
 
 def date_to_year_month(ent: Dict[str, str]) -> Dict[str, str]:
-    months = dict(zip(range(1, 13), [x[:3] for x in ["January", "February",
-                                                     "March", "April", "May", "June", "July", "August",
-                                                     "September", "October", "November", "December"]]))
     if "date" in ent:
         date = ent.pop("date").split("-")
         if len(date) == 1:
@@ -416,5 +382,87 @@ def remove_url(ent: Dict[str, str]) -> Dict[str, str]:
     return ent
 
 
+def batch_transform(name: str) -> Callable:
+    """Register the decorated function as the batch version of transform :code:`name`.
+
+    Args:
+        name: Name of the single entry transform
+
+    A batch transform takes the full list of entries (and any arguments of the
+    single entry transform) and returns the transformed list. It can do its
+    setup once and work on a column of values at a time. Transforms without a
+    batch version are adapted with :func:`per_entry`.
+
+    """
+    def decorator(func: Callable[..., Entries]) -> Callable[..., Entries]:
+        batch_transforms[name] = func
+        return func
+    return decorator
+
+
+def per_entry(func: Callable[..., Dict[str, str]]) -> Callable[..., Entries]:
+    """Adapt a single entry transform to a batch transform.
+
+    Args:
+        func: The single entry transform
+
+    """
+    def batch(entries: Entries, *args) -> Entries:
+        return [func(ent, *args) for ent in entries]
+    batch.__name__ = func.__name__
+    return batch
+
+
+def get_batch_transform(name: str) -> Callable[..., Entries]:
+    """Return the batch version of transform :code:`name`
+
+    Args:
+        name: Name of the transform
+
+    """
+    return batch_transforms.get(name) or per_entry(globals()[name])
+
+
+def map_column(entries: Entries, keys: Iterable[str],
+               func: Callable[[str], str]) -> Entries:
+    """Apply :code:`func` to all the values of :code:`keys` in :code:`entries`.
+
+    Args:
+        entries: Bibtex entries
+        keys: The keys (columns) to transform
+        func: The function to apply to each value
+
+    :code:`func` is called only once for each distinct value.
+
+    """
+    cache: Dict[str, str] = {}
+    for ent in entries:
+        for key in keys:
+            if key in ent:
+                val = ent[key]
+                if val not in cache:
+                    cache[val] = func(val)
+                ent[key] = cache[val]
+    return entries
+
+
+@batch_transform("change_to_title_case")
+def change_to_title_case_batch(entries: Entries) -> Entries:
+    return map_column(entries, ["title", "booktitle", "journal"], title_case)
+
+
+@batch_transform("abbreviate_venue")
+def abbreviate_venue_batch(entries: Entries) -> Entries:
+    cache: Dict[str, str] = {}
+    for ent in entries:
+        vkey = venue_key(ent)
+        if vkey:
+            val = ent[vkey]
+            if val not in cache:
+                cache[val] = abbreviate(val)
+            ent[vkey] = cache[val]
+    return entries
+
+
 def check_author_names(ent: Dict[str, str]):
     check_for_unicode = None
@@ -1,9 +1,15 @@
-from typing import List, Dict, Union, Optional, Tuple, Any
+from typing import List, Dict, Union, Optional, Tuple, Any, IO
+import io
 import re
 import os
 import sys
+import copy
+import hashlib
 import time
 import datetime
+import filecmp
+import stat
+import tempfile
 import importlib
 from pathlib import Path
 
@@ -62,25 +68,222 @@ class Debounce:
             return x
 
 
+class BuildStats:
+    """Statistics of the files written during a build.
+
+    Files written with :func:`write_if_changed` or :func:`replace_if_changed`
+    are recorded as either written or unchanged. Outputs which weren't built
+    again as their intermediate file didn't change are recorded as up to date.
+
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.written: List[str] = []
+        self.unchanged: List[str] = []
+        self.up_to_date: List[str] = []
+
+    def record_write(self, path: Pathlike, changed: bool):
+        if changed:
+            self.written.append(str(path))
+        else:
+            self.unchanged.append(str(path))
+
+    def record_up_to_date(self, path: Pathlike):
+        self.up_to_date.append(str(path))
+
+    def summary(self) -> str:
+        msg = f"Wrote {len(self.written)} intermediate file(s)"
+        if self.unchanged:
+            msg += f", skipped {len(self.unchanged)} unchanged: " +\
+                ", ".join(Path(x).name for x in self.unchanged)
+        if self.up_to_date:
+            msg += f", {len(self.up_to_date)} output(s) up to date: " +\
+                ", ".join(Path(x).name for x in self.up_to_date)
+        return msg
+
+
+build_stats = BuildStats()
+
+
+def temp_file_for(path: Pathlike) -> Path:
+    """Return a temporary file path in the same directory as :code:`path`.
+
+    Args:
+        path: The target file path
+
+    The suffix of :code:`path` is kept so that tools which infer the file
+    format from the extension (like pandoc) still work. The file gets the mode
+    of :code:`path` if it exists, else the default mode for new files, as
+    :func:`tempfile.mkstemp` creates it readable only by the user.
+
+    """
+    path = Path(path)
+    fd, name = tempfile.mkstemp(prefix=f".{path.stem}.", suffix=path.suffix, dir=path.parent)
+    os.close(fd)
+    try:
+        mode = stat.S_IMODE(path.stat().st_mode)
+    except OSError:
+        mode = 0o666 & ~current_umask()
+    os.chmod(name, mode)
+    return Path(name)
+
+
+_umask: Optional[int] = None
+
+
+def current_umask() -> int:
+    "Return the umask of the process. It's read once."
+    # NOTE: The umask can only be read by setting it, which isn't thread safe,
+    #       so it's read only on the first call
+    global _umask
+    if _umask is None:
+        _umask = os.umask(0o022)
+        os.umask(_umask)
+    return _umask
+
+
+def replace_if_changed(temp_file: Pathlike, path: Pathlike) -> bool:
+    """Replace :code:`path` with :code:`temp_file` only if the contents differ.
+
+    Args:
+        temp_file: The newly written file
+        path: The target file
+
+    The replacement is atomic. If the contents are the same then
+    :code:`temp_file` is removed and :code:`path` is left untouched, so that its
+    mtime doesn't change. Returns :code:`True` if :code:`path` was replaced.
+
+    """
+    temp_file, path = Path(temp_file), Path(path)
+    if not temp_file.exists():
+        return False
+    if path.exists() and filecmp.cmp(temp_file, path, shallow=False):
+        temp_file.unlink()
+        build_stats.record_write(path, False)
+        return False
+    os.replace(temp_file, path)
+    build_stats.record_write(path, True)
+    return True
+
+
+def write_if_changed(path: Pathlike, content: Union[str, bytes]) -> bool:
+    """Write :code:`content` to :code:`path` only if it differs from the existing contents.
+
+    Args:
+        path: The file to write
+        content: The contents
+
+    See :func:`replace_if_changed`.
+
+    """
+    temp_file = temp_file_for(path)
+    with open(temp_file, "wb") as f:
+        f.write(content.encode("utf-8") if isinstance(content, str) else content)
+    return replace_if_changed(temp_file, path)
+
+
+# NOTE: The C loader from libyaml is much faster if PyYAML is built with it
+yaml_loader = getattr(yaml, "CFullLoader", yaml.FullLoader)
+_yaml_headers: Dict[str, Any] = {}
+_yaml_headers_size = 1024
+
+
+def read_header(f: IO[str]) -> Tuple[Optional[str], str]:
+    """Read the yaml header from a markdown file object, stopping after it.
+
+    Args:
+        f: The file object at the start of the file
+
+    The header begins with a :code:`---` line at the start of the file and ends at a
+    :code:`---` or :code:`...` line.
+
+    Returns the header without the delimiters, or :code:`None` if there's no
+    header, and the text read after the header. The text after the header
+    begins after the closing delimiter and includes its newline.
+
+    """
+    first = f.readline()
+    if first.rstrip("\r\n") != "---":
+        return None, first
+    lines = []
+    for line in f:
+        if line.rstrip("\r\n") in {"---", "..."}:
+            return "".join(lines), line[3:]
+        lines.append(line)
+    return None, first + "".join(lines)
+
+
+def parse_yaml_header(header: str) -> Dict[str, Any]:
+    """Parse a yaml header with a cache keyed by a hash of the header.
+
+    Args:
+        header: The yaml header
+
+    A copy of the cached value is returned, so it can be modified.
+
+    """
+    key = hashlib.md5(header.encode()).hexdigest()
+    if key not in _yaml_headers:
+        if len(_yaml_headers) >= _yaml_headers_size:
+            _yaml_headers.clear()
+        _yaml_headers[key] = yaml.load(header, Loader=yaml_loader) or {}
+    return copy.deepcopy(_yaml_headers[key])
+
+
 # TODO: The following should be replaced with separate tests
 # assert in_file.endswith('.md')
 # assert self._filetypes
 def read_md_file_with_header(filename: Pathlike) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """Read a markdown file and parse its yaml header.
+
+    Args:
+        filename: The markdown file
+
+    Returns the text after the header and the header as a :class:`dict`,
+    which is empty if there's no header. Returns :code:`None` if the header
+    can't be parsed.
+
+    """
     try:
         with open(filename) as f:
-            splits = f.read().split('---', maxsplit=3)
-            if len(splits) == 3:
-                in_file_pandoc_opts = yaml.load(splits[1], Loader=yaml.FullLoader)
-                in_file_text = splits[2]
-            else:
-                in_file_pandoc_opts = {}
-                in_file_text = splits[0]
+            header, text = read_header(f)
+            in_file_text = text + f.read()
+        in_file_pandoc_opts = parse_yaml_header(header) if header is not None else {}
+    except Exception as e:
+        loge(f"Yaml parse error {e}. Will not compile.")
+        return None
+    return in_file_text, in_file_pandoc_opts
+
+
+def parse_md_text_with_header(text: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """Like :func:`read_md_file_with_header` but for the :code:`text` of a markdown file"""
+    try:
+        f = io.StringIO(text)
+        header, rest = read_header(f)
+        in_file_text = rest + f.read()
+        in_file_pandoc_opts = parse_yaml_header(header) if header is not None else {}
     except Exception as e:
         loge(f"Yaml parse error {e}. Will not compile.")
         return None
     return in_file_text, in_file_pandoc_opts
 
 
+def read_md_header(filename: Pathlike) -> str:
+    """Return the raw yaml header of a markdown file without reading the rest of it.
+
+    Args:
+        filename: The markdown file
+
+    Returns an empty string if there's no header.
+
+    """
+    with open(filename) as f:
+        header, _ = read_header(f)
+    return header or ""
+
+
 def compress_space(x: str):
     return re.sub(" +", " ", x)
 
@@ -102,44 +305,6 @@ def update_command(command: List[str], k: str, v: str) -> None:
     command.append(f"--{k}={v}")
 
 
-def get_csl_or_template(key: str, val: str, dir: Path) -> str:
-    """Get CSL or template file according to the value :code:`val`
-
-    Args:
-        key: One of "csl" or "template"
-        val: The file path or file stem to search for, essentially
-             the CSL or template name.
-        dir: The directory in which to search
-
-    The CSL or template file can be searched in a given directory with the file
-    name or file name without suffix with some rules according to naming
-    conventions.
-
-    E.g., :code:`get_csl_or_template("csl", "ieee", "some_dir")` will search for
-    "ieee" and "ieee.csl" in "some_dir".
-    While, :code:`get_csl_or_template("template", "ieee", "some_dir")` will search for
-    "default.ieee" and "ieee.template" in those directories
-
-    """
-    v = val
-    if dir.joinpath(v).exists():
-        v = str(dir.joinpath(v))
-    else:
-        candidates = [x.name for x in dir.iterdir()
-                      if v in str(x)]
-        if key == "template":
-            if f"default.{v}" in candidates:
-                v = str(dir.joinpath(f"default.{v}"))
-            elif f"{v}.template" in candidates:
-                v = str(dir.joinpath(f"{v}.template"))
-        elif key == "csl":
-            if f"{v}" in candidates:
-                v = str(dir.joinpath(f"{v}"))
-            elif f"{v}.csl" in candidates:
-                v = str(dir.joinpath(f"{v}.csl"))
-    return v
-
-
 def which(program):
     """Search for program name in paths.
 
@@ -167,6 +332,39 @@ def expandpath(x: Union[str, Path]):
     return Path(x).expanduser().absolute()
 
 
+def path_fingerprint(path: Pathlike) -> List[Any]:
+    """Return the absolute path, size and mtime of :code:`path`
+
+    Args:
+        path: A file
+
+    Only the path is returned if it doesn't exist.
+
+    """
+    path = Path(path).absolute()
+    try:
+        stat = path.stat()
+    except OSError:
+        return [str(path)]
+    return [str(path), stat.st_size, stat.st_mtime_ns]
+
+
+def cache_dir(*parts: str) -> Path:
+    """Return a directory inside the :mod:`pndconf` cache directory.
+
+    Args:
+        parts: Path components of the subdirectory
+
+    The cache directory is :code:`$XDG_CACHE_HOME/pndconf` or
+    :code:`~/.cache/pndconf`. The directory is created if it doesn't exist.
+
+    """
+    root = Path(os.environ.get("XDG_CACHE_HOME") or "~/.cache").expanduser()
+    path = root.joinpath("pndconf", *parts)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
 # NOTE: A more generic implementation is in common_pyutil
 def load_user_module(modname):
     if modname.endswith(".py"):  # remove .py if it exists
@@ -231,3 +429,14 @@ def logbbi(message: str, newline: bool = True) -> str:
     end = "\n" if newline else ""
     print(f"{COLORS.BRIGHT_BLUE}{message}{COLORS.ENDC}", end=end)
     return message
+
+
+def output_files(post: List) -> List[str]:
+    """Return the output files from the return value of
+    :meth:`pndconf.config.Configuration.compile_files`
+
+    Args:
+        post: The outputs of each compiled file
+
+    """
+    return [x["out_file"] for x in sum([x or [] for x in post], [])]
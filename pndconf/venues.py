@@ -0,0 +1,187 @@
+from typing import Dict, List, Optional, Iterable, Set, Any, Union, FrozenSet
+import re
+from pathlib import Path
+from collections import deque
+from functools import lru_cache
+
+import yaml
+
+from .const import stop_words_set
+
+
+default_venues_file = Path(__file__).parent.joinpath("venues.yaml")
+
+
+class AhoCorasick:
+    """An Aho-Corasick automaton to find all occurrences of many patterns at once.
+
+    Args:
+        patterns: The patterns to search for
+
+    The time to search a text is linear in the length of the text plus the
+    number of matches, regardless of the number of patterns.
+
+    """
+    def __init__(self, patterns: Iterable[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[str]] = [[]]
+        for pattern in patterns:
+            self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str):
+        state = 0
+        for char in pattern:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        if pattern not in self.output[state]:
+            self.output[state].append(pattern)
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                self.output[next_state] = self.output[next_state] +\
+                    self.output[self.fail[next_state]]
+
+    def findall(self, text: str) -> Set[str]:
+        """Return the set of all patterns which occur in :code:`text`.
+
+        Args:
+            text: The text to search
+
+        """
+        state = 0
+        found: Set[str] = set()
+        for char in text:
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            if self.output[state]:
+                found.update(self.output[state])
+        return found
+
+
+def normalize_venue(venue: str) -> str:
+    """Normalize a venue string for matching.
+
+    Args:
+        venue: The venue string
+
+    The venue is lower cased, punctuation is replaced by spaces, numbers are
+    separated from words and the words are padded with a single space on
+    either side, so that patterns in the same form match only whole words.
+
+    """
+    venue = re.sub(r"[^a-z0-9]+", " ", venue.lower())
+    venue = re.sub(r"(?<=[a-z])(?=[0-9])|(?<=[0-9])(?=[a-z])", " ", venue)
+    return " " + " ".join(venue.split()) + " "
+
+
+class VenueRule:
+    """Normalized matching rule of a single venue.
+
+    Args:
+        venue: The venue as a :class:`dict`. See :code:`venues.yaml`
+
+    """
+    def __init__(self, venue: Dict[str, Any]):
+        self.acronyms = {normalize_venue(str(x)) for x in venue.get("acronyms", [])}
+        self.phrases = {normalize_venue(str(x)) for x in venue.get("phrases", [])}
+        self.groups = [{normalize_venue(str(x)) for x in group}
+                       for group in venue.get("all", [])]
+        self.exclude = {normalize_venue(str(x)) for x in venue.get("exclude", [])}
+        self.words: FrozenSet[str] = frozenset(str(x).lower() for x in venue.get("words", []))
+
+    @property
+    def terms(self) -> Set[str]:
+        "All the terms which can lead to a match"
+        return self.acronyms.union(self.phrases, *self.groups)
+
+    def matches(self, found: Set[str]) -> bool:
+        """Check if the rule matches given the terms found in a venue string
+
+        Args:
+            found: Terms found in the venue string
+
+        """
+        if self.acronyms & found:
+            return True
+        if self.exclude & found:
+            return False
+        return bool(self.phrases & found) or any(group <= found for group in self.groups)
+
+
+class VenueMatcher:
+    """Match venue strings to known venues.
+
+    Args:
+        venues: A :class:`dict` of venues as loaded from a venues file.
+                See :code:`venues.yaml` for the format.
+
+    All the terms of all the venues are compiled into a single
+    :class:`AhoCorasick` automaton, so that a venue string is scanned only
+    once irrespective of the number of known venues and only the venues whose
+    terms occur in it are checked. Results are memoized per distinct venue
+    string.
+
+    """
+    def __init__(self, venues: Dict[str, Dict[str, Any]]):
+        self.venues = venues
+        self._priority = {k: i for i, k in enumerate(venues)}
+        self._rules = {k: VenueRule(v) for k, v in venues.items()}
+        self._index: Dict[str, List[str]] = {}
+        self._words: Dict[FrozenSet[str], str] = {}
+        patterns: Set[str] = set()
+        for key, rule in self._rules.items():
+            for term in rule.terms:
+                self._index.setdefault(term, []).append(key)
+            patterns.update(rule.terms, rule.exclude)
+            if rule.words:
+                self._words.setdefault(rule.words, key)
+        self._automaton = AhoCorasick(sorted(patterns))
+        self.match = lru_cache(maxsize=None)(self._match)
+
+    def _match(self, venue: str) -> Optional[str]:
+        """Return the key of the matching venue for :code:`venue` if any.
+
+        Args:
+            venue: The venue string
+
+        """
+        text = normalize_venue(venue)
+        found = self._automaton.findall(text)
+        candidates = {key for term in found for key in self._index.get(term, [])
+                      if self._rules[key].matches(found)}
+        words = frozenset(x for x in text.split() if x not in stop_words_set)
+        if words in self._words:
+            candidates.add(self._words[words])
+        if candidates:
+            return min(candidates, key=self._priority.__getitem__)
+        return None
+
+
+def load_venues(*venues_files: Union[str, Path]) -> Dict[str, Dict[str, Any]]:
+    """Load venues from yaml files
+
+    Args:
+        venues_files: Venues files. Venues in later files override the ones
+                      with the same key in earlier files.
+
+    """
+    venues: Dict[str, Dict[str, Any]] = {}
+    for venues_file in venues_files:
+        with open(venues_file) as f:
+            venues.update(yaml.load(f, Loader=yaml.SafeLoader) or {})
+    return venues
@@ -4,7 +4,27 @@ from pathlib import Path
 
 from watchdog.events import FileSystemEvent, FileSystemEventHandler
 
-from .util import logd, loge, logi, logbi, logw, Debounce
+from .util import logd, loge, logi, logbi, logw, Debounce, read_md_header
+
+
+class ResourceHandler(FileSystemEventHandler):
+    """Report files created, moved or deleted to :code:`invalidate`
+
+    Args:
+        invalidate: Function called with the paths which changed. See
+                    :meth:`pndconf.resources.ResourceIndex.invalidate`
+
+    Modifications don't change which files exist and aren't reported.
+
+    """
+    def __init__(self, invalidate: Callable[[str], None]):
+        self.invalidate = invalidate
+
+    def on_any_event(self, event: FileSystemEvent):
+        if event.event_type in {"created", "deleted", "moved"}:
+            self.invalidate(event.src_path)
+            if getattr(event, "dest_path", ""):
+                self.invalidate(event.dest_path)
 
 
 class ChangeHandler(FileSystemEventHandler):
@@ -16,7 +36,7 @@ class ChangeHandler(FileSystemEventHandler):
     def __init__(self, root: Path, is_watched: Callable[[str], bool],
                  get_watched: Callable[[], List[Path]],
                  compile_func: Callable[[Union[str, List[str]]], None],
-                 log_level: int):
+                 log_level: int, invalidate: Optional[Callable[[str], None]] = None):
         self.root = root
         self.is_watched = is_watched
         self.get_watched = get_watched
@@ -24,16 +44,25 @@ class ChangeHandler(FileSystemEventHandler):
         self.log_level = log_level
         self.debounce = Debounce(3000)
         self.count = 0
+        self.resources = invalidate and ResourceHandler(invalidate)
 
-    # NOTE: DEBUG
-    # def on_any_event(self, event):
-    #     print(str(event))
+    def on_any_event(self, event: FileSystemEvent):
+        # NOTE: DEBUG
+        # print(str(event))
+        # NOTE: Called before the specific handlers, so that a template
+        #       created in the watched directory is found by the compile
+        if self.resources:
+            self.resources.on_any_event(event)
 
     def on_created(self, event: FileSystemEvent):
         "Event fired when a new file is created"
         pwd = os.path.abspath(self.root) + '/'
         filepath = str(os.path.abspath(event.src_path))
         assert pwd in filepath
+        # NOTE: Writing a new file fires created and then modified, so debounce
+        #       on the same absolute path as on_modified to build it only once
+        if not self.debounce(filepath):
+            return
         filepath = filepath.replace(pwd, '')
         watched = self.is_watched(filepath)
         if watched:
@@ -42,7 +71,7 @@ class ChangeHandler(FileSystemEventHandler):
 
     def on_modified(self, event: FileSystemEvent):
         "Event fired when a file is modified"
-        src_path = event.src_path
+        src_path = os.path.abspath(event.src_path)
         # NOTE: Hack around bug in watchdog where file modified event is called
         #       twice on a single modification or some reason
         src_path = self.debounce(src_path)
@@ -57,6 +86,24 @@ class ChangeHandler(FileSystemEventHandler):
                 # print(md_files, self.count)
                 self.compile_stuff(md_files)
 
+    def on_moved(self, event: FileSystemEvent):
+        """Event fired when a file is moved
+
+        Editors which save atomically write to a temporary file and rename it
+        to the target, so that's treated as a modification of the target.
+
+        """
+        dest_path = getattr(event, "dest_path", "")
+        if event.is_directory or not dest_path:
+            return
+        dest_path = self.debounce(os.path.abspath(dest_path))
+        if dest_path:
+            if self.log_level > 2:
+                logd(f"File moved to {dest_path}")
+            md_files = self.get_md_files(dest_path)
+            if md_files:
+                self.compile_stuff(md_files)
+
     # NOTE: Maybe rename this function
     def compile_stuff(self, md_files: Union[str, List[str]]) -> None:
         "Compile if required when an event is fired"
@@ -68,7 +115,14 @@ class ChangeHandler(FileSystemEventHandler):
 
     # CHECK: If it's working correctly
     def get_md_files(self, e):
-        "Return all the markdown files which include the template"
+        """Return all the markdown files which include the template
+
+        A file includes a template :code:`e` if it has the text
+        :code:`includes e`, e.g., as a comment :code:`# includes e`, in its
+        yaml header. Only the header is read. A file without a header is read
+        entirely.
+
+        """
         if e.endswith('.md'):
             return e
         elif e.endswith('template'):
@@ -77,8 +131,10 @@ class ChangeHandler(FileSystemEventHandler):
             elements = self.get_watched()
             elements = [elem for elem in elements if elem.endswith('.md')]
             for elem in elements:
-                with open(elem, 'r') as f:
-                    text = f.read()
+                text = read_md_header(elem)
+                if not text:
+                    with open(elem, 'r') as f:
+                        text = f.read()
                 if ("includes " + e) in text:
                     md_files.append(elem)
             return md_files
@@ -37,7 +37,7 @@ setup(
     ],
     packages=["pndconf"],
     include_package_data=True,
-    package_data={'': ['config_default.ini']},
+    package_data={'': ['config_default.ini', 'venues.yaml']},
     keywords='pandoc markdown watcher',
     python_requires=">=3.7, <=4.0",
     install_requires=[
@@ -1,4 +1,5 @@
 import pytest
+from pndconf import formats
 from pndconf.config import Configuration
 from pathlib import Path
 
@@ -17,3 +18,12 @@ def config():
                            same_pdf_output_dir=False,
                            dry_run=False)
     return config
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path_factory, monkeypatch):
+    cache = tmp_path_factory.mktemp("cache")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(cache))
+    # NOTE: The TeX fingerprints are cached per process along with the formats
+    monkeypatch.setattr(formats, "_tex_fingerprints", {})
+    return cache
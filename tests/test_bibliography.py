@@ -0,0 +1,155 @@
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+from pndconf import csl, bibliography, transforms
+from pndconf.bibliography import generate_bibtex
+from pndconf.util import read_md_file_with_header
+
+
+@pytest.fixture
+def article(tmp_path):
+    for name in ["article.md", "bibliography.bib"]:
+        shutil.copy(Path("examples").joinpath(name), tmp_path.joinpath(name))
+    return tmp_path.joinpath("article.md")
+
+
+def test_csl_reference_should_convert_to_bibtex_and_biblatex():
+    ref = {"id": "yaml2020citation", "type": "article-journal",
+           "author": [{"family": "Person", "given": "Some"}],
+           "container-title": "Yaml Citation", "issued": "2020-06",
+           "title": "Yaml Citation", "page": "1-10"}
+    entry = csl.csl_to_entry(ref, "bibtex")
+    assert entry == {"ENTRYTYPE": "article", "ID": "yaml2020citation",
+                     "title": "Yaml Citation", "author": "Person, Some",
+                     "pages": "1--10", "journal": "Yaml Citation",
+                     "year": "2020", "month": "Jun"}
+    entry = csl.csl_to_entry(ref, "biblatex")
+    assert entry["journaltitle"] == "Yaml Citation"
+    assert entry["date"] == "2020-06"
+    assert "year" not in entry
+
+
+def test_entry_to_csl_should_keep_case_protection_in_titles():
+    entry = {"ENTRYTYPE": "article", "ID": "dna2020",
+             "title": "The {DNA} of {\\\"o}ptimal {Bayesian} Methods",
+             "journal": "{IEEE} Transactions", "publisher": "{ACM} Press",
+             "author": "M{\\\"u}ller, Hans"}
+    ref = csl.entry_to_csl(entry)
+    assert ref["title"] == 'The <span class="nocase">DNA</span> of öptimal '\
+        '<span class="nocase">Bayesian</span> Methods'
+    assert ref["container-title"] == '<span class="nocase">IEEE</span> Transactions'
+    assert ref["publisher"] == "ACM Press"
+    assert ref["author"] == [{"family": "Müller", "given": "Hans"}]
+
+
+def test_csl_date_should_parse_all_formats():
+    assert csl.parse_csl_date("2020-06") == ("2020", 6, None)
+    assert csl.parse_csl_date({"date-parts": [[2019, 3, 2]]}) == ("2019", 3, 2)
+    assert csl.parse_csl_date([{"year": 2018}]) == ("2018", None, None)
+    assert csl.parse_csl_date("sometime") == ("", None, None)
+
+
+def test_generate_bibtex_should_merge_inline_references(article):
+    text, metadata = read_md_file_with_header(article)
+    metadata["bibliography"] = str(article.parent.joinpath("bibliography.bib"))
+    out_file = generate_bibtex(article, metadata, "bibtex", text, [])
+    bib = out_file.read_text()
+    assert "@book{darwin1871descent" in bib
+    assert "@article{yaml2020citation" in bib
+    assert "einstein1905elektrodynamik" not in bib
+    assert metadata["bibliography"] == [str(out_file.absolute())]
+
+
+def test_bibliography_service_should_parse_files_once_per_fingerprint(article):
+    bib_file = article.parent.joinpath("bibliography.bib")
+    service = bibliography.BibliographyService()
+    chapters = [article.parent.joinpath(f"chapter{i}.md") for i in range(3)]
+    for i, chapter in enumerate(chapters):
+        chapter.write_text(f"Cite [@pandoc] and [@darwin1871descent] in chapter {i}")
+        generate_bibtex(chapter, {"bibliography": str(bib_file)}, "bibtex",
+                        chapter.read_text(), ["change_to_title_case"], service=service)
+    assert service.reads == 1 and service.parses == 1
+    assert len(service._transforms) == 1
+    entries = service.cited_entries([str(bib_file)], ["darwin1871descent", "pandoc", "none"])
+    assert [x["ID"] for x in entries] == ["darwin1871descent", "pandoc"]
+    with open(bib_file, "a") as f:
+        f.write("\n@misc{new,\n  title = {New}\n}\n")
+    entries = service.cited_entries([str(bib_file)], ["new", "pandoc"])
+    assert [x["ID"] for x in entries] == ["new", "pandoc"]
+    assert service.reads == 2 and service.parses == 2
+
+
+def test_cited_keys_should_find_all_citation_forms():
+    text = ("See [@a; @b, p. 3] and @c:d says. Also [-@{e f}]. "
+            "Mail me at someone@example.com or cite @a again.")
+    assert bibliography.cited_keys(text) == ["a", "b", "c:d", "e f"]
+
+
+def test_generate_csl_json_should_write_cited_subset(article, cache_home, monkeypatch):
+    text, metadata = read_md_file_with_header(article)
+    metadata["bibliography"] = str(article.parent.joinpath("bibliography.bib"))
+    bib = metadata["bibliography"]
+    out_file = bibliography.generate_csl_json(article, metadata, text, [])
+    assert out_file.parent == cache_home.joinpath("pndconf", "csl")
+    refs = json.loads(out_file.read_text())
+    assert [x["id"] for x in refs] == ["darwin1871descent"]
+    assert refs[0]["author"] == [{"family": "Darwin", "given": "Charles"}]
+    assert refs[0]["issued"] == {"date-parts": [[1871]]}
+    assert metadata["bibliography"] == [str(out_file)]
+    metadata["bibliography"] = bib
+    assert bibliography.generate_csl_json(article, metadata, text, []) == out_file
+    metadata["bibliography"] = bib
+    new_file = bibliography.generate_csl_json(article, metadata, text + " [@pandoc]", [])
+    assert new_file != out_file and not out_file.exists()
+    venues = article.parent.joinpath("venues.yaml")
+    venues.write_text("# venues\n")
+    monkeypatch.setattr(transforms, "venues_files", [*transforms.venues_files, venues])
+    files = []
+    for _ in range(2):
+        metadata["bibliography"] = bib
+        files.append(bibliography.generate_csl_json(article, metadata, text + " [@pandoc]", []))
+        venues.write_text("# edited venues\n")
+    assert len({new_file, *files}) == 3
+
+
+def test_batch_transforms_should_match_single_entry_transforms():
+    entries = [{"ENTRYTYPE": "article", "ID": f"a{i}", "title": "a study of\nthings",
+                "journal": "Journal of Machine Learning Research", "date": "2020-03",
+                "url": "http://x", "file": "a.pdf"}
+               for i in range(3)]
+    entries.append({"ENTRYTYPE": "inproceedings", "ID": "b", "title": "deep nets",
+                    "booktitle": "CVPR"})
+    names = ["abbreviate_venue", "change_to_title_case", "standardize_venue",
+             "normalize", "remove_url", "date_to_year_month", "remove_keys(file)"]
+    single = bibliography.compose_transforms(names)
+    expected = [single(ent.copy()) for ent in entries]
+    batch = bibliography.compose_batch_transforms(names)
+    assert batch([ent.copy() for ent in entries]) == expected
+    assert expected[0]["month"] == "Mar" and "file" not in expected[0]
+
+
+def test_normalize_bibliography_should_keep_order_with_process_pool(tmp_path):
+    bib_file = tmp_path.joinpath("library.bib")
+    with open(bib_file, "w") as f:
+        f.write('@string{jmlr = "Journal of Machine Learning Research"}\n\n')
+        f.write('@preamble{"\\newcommand{\\noop}[1]{}"}\n\n')
+        for i in range(25):
+            f.write(f"@article{{key{i},\n  title = {{a study of things {i}}},\n"
+                    f"  journal = jmlr,\n  year = {{2020}}\n}}\n\n")
+    names = ["change_to_title_case", "standardize_venue"]
+    single = tmp_path.joinpath("single.bib")
+    pooled = tmp_path.joinpath("pooled.bib")
+    assert bibliography.normalize_bibliography([str(bib_file)], single, names,
+                                               jobs=1, chunk_size=4) == 26
+    assert bibliography.normalize_bibliography([str(bib_file)], pooled, names,
+                                               jobs=3, chunk_size=4) == 26
+    text = pooled.read_text()
+    assert text == single.read_text()
+    assert text.startswith("@preamble")
+    keys = [line.split("{")[1].rstrip(",") for line in text.splitlines()
+            if line.startswith("@article")]
+    assert keys == [f"key{i}" for i in range(25)]
+    assert "{Journal} {of} {Machine} {Learning} {Research}" in text
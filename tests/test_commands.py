@@ -118,3 +118,51 @@ def test_commands_should_give_correct_pdf_generation_command_with_bibtex(config)
     final_pdflatex = f"cd {out_dir} && pdflatex -file-line-error -output-directory {out_dir} -interaction=nonstopmode --synctex=1 {out_file}".replace(f"{out_file}", f"../{Path(out_file).name}")
     assert pdf_cmd[7] == final_pdflatex
     assert pdf_cmd[8] == final_pdflatex
+
+
+def test_commands_with_draft_profile_should_skip_toc_and_unchanged_citations(config, tmp_path):
+    in_file = Path("./examples/article.md")
+    stem = in_file.stem
+    config.output_dir = tmp_path
+    config._filetypes = ["pdf", "beamer"]
+    config.no_citeproc = True
+    config.set_profile("draft")
+    text, pandoc_opts = read_md_file_with_header(in_file)
+    commands = Commands(config, in_file, text, pandoc_opts)
+    cmd = commands.build_commands()
+    assert "--toc" not in cmd["beamer"]["command"]
+    pdf_cmd = cmd["pdf"]["command"]
+    out_dir = tmp_path.joinpath(f"{stem}_files")
+    assert not any(x.startswith("rm ") for x in pdf_cmd)
+    assert "pdflatex -draftmode" in pdf_cmd[3] and "-interaction=batchmode" in pdf_cmd[3]
+    bib_file = in_file.absolute().with_suffix(".bib")
+    record = out_dir.joinpath(f"{stem}.cites")
+    assert pdf_cmd[5] == f"cd {out_dir} && bibtex {stem} && echo "\
+        f"{commands.citations_hash(bib_file)} > {record}"
+    assert len([x for x in pdf_cmd if "&& pdflatex" in x]) == 2
+    assert cmd["pdf"]["bib_files"] == [str(bib_file)]
+    out_dir.mkdir()
+    record.write_text(commands.citations_hash(bib_file) + "\n")
+    out_dir.joinpath(f"{stem}.bbl").touch()
+    pdf_cmd = Commands(config, in_file, text, pandoc_opts).build_commands()["pdf"]["command"]
+    assert not any("bibtex" in x or "-draftmode" in x for x in pdf_cmd)
+    assert len([x for x in pdf_cmd if "&& pdflatex" in x]) == 1
+
+
+def test_commands_with_persistent_build_dir_should_run_engine_in_files_dir(config, tmp_path):
+    in_file = Path("./examples/article.md")
+    stem = in_file.stem
+    config.output_dir = tmp_path
+    config._filetypes = ["beamer"]
+    config.persistent_build_dir = True
+    text, pandoc_opts = read_md_file_with_header(in_file)
+    cmd = Commands(config, in_file, text, pandoc_opts).build_commands()["beamer"]
+    out_dir = tmp_path.joinpath(f"{stem}_files")
+    assert cmd["rerun"] and cmd["pandoc_out_file"] == str(tmp_path.joinpath(f"{stem}.tex"))
+    assert cmd["out_file"] == str(out_dir.joinpath(f"{stem}.pdf"))
+    pandoc_cmd, *engine_cmd = cmd["command"]
+    assert f"-o {tmp_path.joinpath(stem)}.tex" in pandoc_cmd and "--pdf-engine" not in pandoc_cmd
+    assert engine_cmd == [f"cd {tmp_path} && mkdir -p {out_dir}",
+                          f"cd {tmp_path} && pdflatex -file-line-error -output-directory "
+                          f"{out_dir} -interaction=nonstopmode --synctex=1 "
+                          f"{tmp_path.joinpath(stem)}.tex"]
@@ -0,0 +1,83 @@
+from pndconf import compilers
+
+
+def test_command_chain_should_stage_tex_output(tmp_path):
+    tex = tmp_path.joinpath("article.tex")
+    chain = [f"cat > {tex}", f"sed -i 's/citep/cite/g' {tex}"]
+    assert compilers.exec_command_chain(chain, "\\citep{a}", str(tex))
+    assert tex.read_text() == "\\cite{a}"
+    mtime = tex.stat().st_mtime_ns
+    assert compilers.exec_command_chain(chain, "\\citep{a}", str(tex))
+    assert tex.stat().st_mtime_ns == mtime
+    assert not compilers.exec_command_chain([f"false > {tex}"], "", str(tex))
+    assert tex.read_text() == "\\cite{a}"
+    assert [x.name for x in tmp_path.iterdir()] == ["article.tex"]
+
+
+def test_markdown_compile_should_merge_input_once_and_give_it_only_to_pandoc(tmp_path,
+                                                                              monkeypatch):
+    html, pdf, rest = (tmp_path.joinpath(x) for x in ["out.html", "out.tex", "rest.txt"])
+    opts, text = {"title": "Doc"}, "\nBody\n"
+    commands = {"html": {"command": f"cat > {html}", "out_file": str(html),
+                         "in_file_opts": opts, "text": text},
+                "pdf": {"command": [f"cat > {pdf}", f"cat > {rest}"], "out_file": str(pdf),
+                        "in_file_opts": dict(opts), "text": text}}
+    merges = []
+    merge_input = compilers.merge_input
+    monkeypatch.setattr(compilers, "merge_input", lambda *args: merges.append(args) or
+                        merge_input(*args))
+    assert len(compilers.markdown_compile(commands, "doc.md")) == 2
+    assert len(merges) == 1
+    assert html.read_text() == pdf.read_text() == "---\ntitle: Doc\n---\n\nBody\n"
+    assert rest.read_text() == ""
+
+
+def test_exec_tex_command_should_rerun_only_when_asked(monkeypatch):
+    runs = []
+    monkeypatch.setattr(compilers.tex_compiler, "compile", lambda cmd: runs.append(cmd) or True)
+    monkeypatch.setattr(compilers.tex_compiler, "needs_rerun", lambda cmd: len(runs) < 3)
+    command = "cd out && xelatex -output-directory out/a_files a.tex"
+    assert compilers.is_tex_command(command)
+    assert compilers.exec_tex_command(command)
+    assert len(runs) == 1 and compilers.tex_compiler.cmdname == "xelatex"
+    assert compilers.exec_tex_command(command, rerun=True)
+    assert len(runs) == 3
+    assert compilers.exec_tex_command(command, rerun=True)
+    assert len(runs) == 4
+
+
+def test_command_chain_should_cut_off_when_tex_is_unchanged(tmp_path):
+    tex, pdf, runs = (tmp_path.joinpath(x) for x in ["article.tex", "article.pdf", "runs"])
+    chain = [f"cat > {tex}", f"cd {tmp_path} && echo run >> runs && cp article.tex {pdf}"]
+    for text in ["One", "One", "Two"]:
+        assert compilers.exec_command_chain(chain, text, str(tex), out_file=str(pdf))
+    assert runs.read_text().split() == ["run", "run"]
+    assert compilers.build_stats.up_to_date[-1] == str(pdf)
+    pdf.unlink()
+    assert compilers.exec_command_chain(chain, "Two", str(tex), out_file=str(pdf))
+    assert pdf.read_text() == "Two"
+    assert not compilers.exec_command_chain([*chain, "false"], "Two", str(tex),
+                                            out_file=str(pdf))
+    assert compilers.exec_command_chain(chain, "Two", str(tex), out_file=str(pdf))
+    assert len(runs.read_text().split()) == 5
+
+
+def test_command_chain_cutoff_should_rebuild_on_changed_bib_and_figures(tmp_path):
+    tex, pdf = tmp_path.joinpath("article.tex"), tmp_path.joinpath("article.pdf")
+    bib, fig = tmp_path.joinpath("article.bib"), tmp_path.joinpath("fig.png")
+    bib.write_text("@book{a, title = {One}}")
+    fig.write_bytes(b"one")
+    text = "\\includegraphics{fig}\n\\bibliography{article}\n"
+    chain = [f"cat > {tex}", f"cd {tmp_path} && echo run >> runs && cp article.tex {pdf}"]
+
+    def build():
+        assert compilers.exec_command_chain(chain, text, str(tex), out_file=str(pdf),
+                                            bib_files=[str(bib)])
+        return len(tmp_path.joinpath("runs").read_text().split())
+    assert build() == 1
+    assert build() == 1
+    bib.write_text("@book{a, title = {Two}}")
+    assert build() == 2
+    fig.write_bytes(b"two, larger")
+    assert build() == 3
+    assert build() == 3
@@ -1,3 +1,8 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
 from pndconf.config import Configuration
 
 
@@ -13,6 +18,35 @@ def test_should_get_watched_elements_correctly():
     pass
 
 
-
-
-
+@pytest.fixture
+def article(tmp_path):
+    for name in ["article.md", "bibliography.bib"]:
+        shutil.copy(Path("examples").joinpath(name), tmp_path.joinpath(name))
+    return tmp_path.joinpath("article.md")
+
+
+def test_get_commands_should_reuse_plan_when_only_body_changes(config, article):
+    config._filetypes = ["html", "pdf"]
+    first = config.get_commands(str(article))
+    assert config.plan_builds == 1
+    article.write_text(article.read_text() + "\nSome more text.\n")
+    second = config.get_commands(str(article))
+    assert config.plan_builds == 1 and config.plan_reuses == 1
+    assert second["pdf"]["command"] == first["pdf"]["command"]
+    assert second["html"]["text"].endswith("Some more text.\n")
+    second["html"]["in_file_opts"]["title"] = "Changed"
+    assert config.get_commands(str(article))["html"]["in_file_opts"]["title"] != "Changed"
+
+
+def test_get_commands_should_rebuild_plan_on_header_or_citation_change(config, article):
+    config._filetypes = ["html"]
+    config.get_commands(str(article))
+    article.write_text(article.read_text().replace("Example Article", "Another Article"))
+    config.get_commands(str(article))
+    assert config.plan_builds == 2
+    article.write_text(article.read_text() + "\nCiting [@newkey2021].\n")
+    config.get_commands(str(article))
+    assert config.plan_builds == 3
+    config.no_citeproc = True
+    config.get_commands(str(article))
+    assert config.plan_builds == 4
@@ -0,0 +1,63 @@
+import pytest
+
+from pndconf import dedup, bibliography
+
+
+@pytest.fixture
+def entries():
+    return [{"ENTRYTYPE": "article", "ID": "vaswani2017attention",
+             "title": "Attention is All you Need", "author": "Vaswani, Ashish and Shazeer, Noam",
+             "journal": "arXiv preprint arXiv:1706.03762", "year": "2017"},
+            {"ENTRYTYPE": "inproceedings", "ID": "other",
+             "title": "Deep Residual Learning for Image Recognition",
+             "author": "He, Kaiming", "booktitle": "CVPR", "year": "2016"},
+            {"ENTRYTYPE": "inproceedings", "ID": "Vaswani_NIPS_2017",
+             "title": "{Attention} Is {All} You Need",
+             "author": "Ashish Vaswani and Noam Shazeer", "year": "2017",
+             "booktitle": "Advances in Neural Information Processing Systems",
+             "pages": "5998--6008"},
+            {"ENTRYTYPE": "inproceedings", "ID": "vaswani2018",
+             "title": "Attention is All you Need: Transformers for Sequence Transduction",
+             "author": "Vaswani, A.", "year": "2018",
+             "booktitle": "NeurIPS"}]
+
+
+def test_dedup_should_find_exact_and_near_duplicates(entries):
+    records = [dedup.Record(x) for x in entries]
+    assert records[0].fingerprint == records[2].fingerprint
+    assert dedup.find_duplicates(records) == [[0, 2]]
+    assert dedup.find_duplicates(records, threshold=0.4) == [[0, 2, 3]]
+
+
+@pytest.mark.parametrize("policy, kept", [("first", "vaswani2017attention"),
+                                          ("last", "Vaswani_NIPS_2017"),
+                                          ("most_fields", "Vaswani_NIPS_2017")])
+def test_dedup_policy_should_choose_entry_to_keep(entries, policy, kept):
+    result, aliases = dedup.deduplicate(entries, policy, add_ids=True)
+    assert [x["ID"] for x in result] == sorted([kept, "other", "vaswani2018"],
+                                               key=[x["ID"] for x in entries].index)
+    dropped = ({"vaswani2017attention", "Vaswani_NIPS_2017"} - {kept}).pop()
+    assert aliases == {kept: [dropped]}
+    assert result[[x["ID"] for x in result].index(kept)]["ids"] == dropped
+
+
+def test_normalize_bibliography_should_remove_duplicates(tmp_path, entries):
+    from bibtexparser import bwriter
+    writer = bwriter.BibTexWriter()
+    bib_file = tmp_path.joinpath("library.bib")
+    bib_file.write_text("".join(writer._entry_to_bibtex(x) for x in entries * 2))
+    out_file = tmp_path.joinpath("out.bib")
+    count = bibliography.normalize_bibliography([str(bib_file)], out_file, [], jobs=2,
+                                                chunk_size=3, dedup_policy="most_fields")
+    assert count == 3
+    text = out_file.read_text()
+    assert "@inproceedings{Vaswani_NIPS_2017" in text
+    assert "@article{vaswani2017attention" not in text
+    assert text.count("ids = {vaswani2017attention}") == 1
+
+
+def test_dedup_should_be_fast_for_large_libraries():
+    records = [dedup.Record({"ID": f"key{i}", "title": f"title {i} of paper number {i * 7}",
+                             "author": f"Author{i}, A.", "year": "2020"})
+               for i in range(5000)]
+    assert dedup.find_duplicates(records) == []
@@ -0,0 +1,38 @@
+import os
+
+from pndconf.formats import format_for, with_format
+
+
+fake_pdflatex = """#!/bin/sh
+for arg in "$@"; do
+    case $arg in
+        -jobname=*) name=${arg#-jobname=} ;;
+        -output-directory=*) dir=${arg#-output-directory=} ;;
+    esac
+done
+echo "$name" >> "$(dirname "$0")/runs"
+touch "$dir/$name.fmt"
+"""
+
+
+def test_format_for_should_build_format_once_per_preamble(tmp_path, monkeypatch):
+    bin_dir = tmp_path.joinpath("bin")
+    bin_dir.mkdir()
+    bin_dir.joinpath("pdflatex").write_text(fake_pdflatex)
+    bin_dir.joinpath("pdflatex").chmod(0o755)
+    monkeypatch.setenv("PATH", os.pathsep.join([str(bin_dir), os.environ["PATH"]]))
+    tex_file = tmp_path.joinpath("article.tex")
+    tex_file.write_text("\\documentclass{article}\n\\begin{document}\nOne\n\\end{document}\n")
+    fmt = format_for(tex_file)
+    assert fmt and fmt.with_suffix(".fmt").exists()
+    tex_file.write_text("\\documentclass{article}\n\\begin{document}\nTwo\n\\end{document}\n")
+    assert format_for(tex_file) == fmt
+    command = f"cd {tmp_path} && pdflatex -interaction=nonstopmode {tex_file}"
+    assert with_format(command, tex_file) ==\
+        f"cd {tmp_path} && pdflatex -fmt={fmt} -interaction=nonstopmode {tex_file}"
+    tex_file.write_text("\\documentclass{beamer}\n\\begin{document}\n\\end{document}\n")
+    new_fmt = format_for(tex_file)
+    assert new_fmt != fmt and not fmt.with_suffix(".fmt").exists()
+    assert len(bin_dir.joinpath("runs").read_text().split()) == 2
+    tex_file.write_text("No document")
+    assert format_for(tex_file) is None
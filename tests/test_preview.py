@@ -0,0 +1,45 @@
+import socket
+import urllib.request
+
+import pytest
+
+from pndconf.preview import PreviewServer, events_path, reload_script
+
+
+@pytest.fixture
+def preview(tmp_path):
+    for name in ["a", "b"]:
+        tmp_path.joinpath(f"{name}.html").write_text(f"<html><body>{name}</body></html>")
+    server = PreviewServer(tmp_path, port=0)
+    server.start()
+    yield server
+    server.stop()
+
+
+def open_events(server, page):
+    host, port = server.server_address[:2]
+    sock = socket.create_connection((host, port), timeout=2)
+    sock.sendall(f"GET {events_path}?file={page} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+    stream = sock.makefile("rb")
+    while b"connected" not in stream.readline():
+        pass
+    stream.readline()
+    return sock, stream
+
+
+def test_preview_should_inject_reload_script(preview):
+    with urllib.request.urlopen(preview.url + "a.html", timeout=2) as response:
+        body = response.read().decode()
+    assert body == f"<html><body>a{reload_script}</body></html>"
+
+
+def test_preview_should_reload_only_pages_of_written_files(preview, tmp_path):
+    sock_a, events_a = open_events(preview, "/a.html")
+    sock_b, events_b = open_events(preview, "/b.html")
+    preview.notify([tmp_path.joinpath("a.html")])
+    assert events_a.readline() == b"event: reload\n"
+    sock_b.settimeout(0.5)
+    with pytest.raises(socket.timeout):
+        events_b.readline()
+    sock_a.close()
+    sock_b.close()
@@ -0,0 +1,61 @@
+from watchdog.events import FileCreatedEvent, FileModifiedEvent
+
+from pndconf.resources import ResourceIndex
+from pndconf.watcher import ResourceHandler
+
+
+def test_resource_index_should_resolve_in_order_and_memoize(tmp_path):
+    csl_dir = tmp_path.joinpath("styles")
+    csl_dir.mkdir()
+    csl_dir.joinpath("ieee.csl").touch()
+    doc_dir = tmp_path.joinpath("doc")
+    doc_dir.joinpath("template").mkdir(parents=True)
+    doc_dir.joinpath("template", "default.article").touch()
+    doc_dir.joinpath("article.template").touch()
+    in_file = doc_dir.joinpath("article.md")
+    index = ResourceIndex()
+    assert index.resolve("csl", "ieee", csl_dir, in_file) == str(csl_dir.joinpath("ieee.csl"))
+    assert index.resolve("template", "article", None, in_file) ==\
+        str(doc_dir.joinpath("template", "default.article"))
+    assert index.resolve("csl", "apa", csl_dir, in_file) == "apa"
+    scans = index.scans
+    for _ in range(3):
+        index.resolve("csl", "ieee", csl_dir, in_file)
+        index.resolve("csl", "apa", csl_dir, in_file)
+    assert index.scans == scans
+
+
+def test_resource_index_should_refresh_only_invalidated_dirs(tmp_path):
+    in_file = tmp_path.joinpath("article.md")
+    index = ResourceIndex(watched=True)
+    assert index.resolve("csl", "apa", None, in_file) == "apa"
+    version = index.version(tmp_path)
+    handler = ResourceHandler(index.invalidate)
+    handler.on_any_event(FileModifiedEvent(str(in_file)))
+    tmp_path.joinpath("apa.csl").touch()
+    assert index.resolve("csl", "apa", None, in_file) == "apa"
+    handler.on_any_event(FileCreatedEvent(str(tmp_path.joinpath("apa.csl"))))
+    assert index.resolve("csl", "apa", None, in_file) == str(tmp_path.joinpath("apa.csl"))
+    assert index.version(tmp_path) == version + 1
+    handler.on_any_event(FileCreatedEvent(str(tmp_path.joinpath("apa.csl"))))
+    assert index.version(tmp_path) == version + 1
+
+
+def test_resource_index_without_watcher_should_refresh_changed_dirs(tmp_path):
+    in_file = tmp_path.joinpath("doc", "article.md")
+    in_file.parent.mkdir()
+    csl_dir = tmp_path.joinpath("styles")
+    index = ResourceIndex()
+    assert index.resolve("csl", "apa", csl_dir, in_file) == "apa"
+    version, scans = index.version(csl_dir), index.scans
+    assert index.resolve("csl", "apa", csl_dir, in_file) == "apa"
+    assert index.scans == scans
+    csl_dir.mkdir()
+    csl_dir.joinpath("apa.csl").touch()
+    assert index.resolve("csl", "apa", csl_dir, in_file) == str(csl_dir.joinpath("apa.csl"))
+    assert index.version(csl_dir) == version + 1
+    assert index.resolve("template", "article", None, in_file) == "article"
+    in_file.parent.joinpath("template").mkdir()
+    in_file.parent.joinpath("template", "default.article").touch()
+    assert index.resolve("template", "article", None, in_file) ==\
+        str(in_file.parent.joinpath("template", "default.article"))
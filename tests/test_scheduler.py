@@ -0,0 +1,76 @@
+import time
+import threading
+from pathlib import Path
+
+import pytest
+
+from pndconf.config import Configuration
+from pndconf.scheduler import Scheduler, parse_tier
+
+
+def test_parse_tier_should_parse_valid_tiers():
+    assert parse_tier("immediate") == ("immediate", 0)
+    assert parse_tier(" idle:2.5 ") == ("idle", 2.5)
+    assert parse_tier("manual") == ("manual", 0)
+    for value in ["idle", "idle:-1", "manual:3", "later"]:
+        with pytest.raises(ValueError):
+            parse_tier(value)
+
+
+def test_scheduler_should_drop_deferred_build_on_new_save():
+    builds = []
+    idle_built = threading.Event()
+
+    def compile_func(md_files, filetypes, text):
+        builds.append((md_files, filetypes))
+        if filetypes == ["pdf"]:
+            idle_built.set()
+    scheduler = Scheduler(compile_func, ["html", "pdf", "beamer"],
+                          {"pdf": ("idle", 0.3), "beamer": ("manual", 0)})
+    scheduler("a.md")
+    scheduler.wait()
+    time.sleep(0.1)
+    scheduler("a.md")
+    scheduler.wait()
+    assert builds == [("a.md", ["html"])] * 2
+    assert idle_built.wait(2)
+    time.sleep(0.4)
+    assert builds[2:] == [("a.md", ["pdf"])]
+    scheduler.build("a.md")
+    assert builds[-1] == ("a.md", ["html", "pdf", "beamer"])
+
+
+def test_scheduler_should_not_block_saves_on_running_build():
+    builds = []
+    started, release = threading.Event(), threading.Event()
+
+    def compile_func(md_files, filetypes, text):
+        if filetypes == ["pdf"]:
+            started.set()
+            release.wait(5)
+        builds.append((md_files, filetypes, text))
+    scheduler = Scheduler(compile_func, ["html", "pdf"], {"pdf": ("idle", 0)})
+    scheduler("a.md")
+    assert started.wait(2)
+    start = time.time()
+    for _ in range(3):
+        scheduler("a.md")
+    assert time.time() - start < 0.5
+    release.set()
+    scheduler.build("a.md", ["pdf"], "# Text")
+    scheduler.wait()
+    assert ("a.md", ["pdf"], "# Text") in builds
+    # NOTE: The saves while a build is queued don't queue it again
+    assert 1 <= builds.count(("a.md", ["html"], None)) <= 2
+    scheduler.stop()
+
+
+def test_configuration_should_read_schedule_section(tmp_path):
+    config_file = tmp_path.joinpath("config.ini")
+    config_file.write_text("[html]\n-o : html\n\n[pdf]\n-o : pdf\n\n"
+                           "[schedule]\npdf : idle:10\nhtml : sometime\n")
+    config = Configuration(None, Path("."), config_file=config_file,
+                           pandoc_path=Path("/usr/bin/pandoc"), pandoc_version="2.14.2",
+                           no_citeproc=False)
+    assert config.filetypes == ["html", "pdf"]
+    assert config.schedule == {"pdf": ("idle", 10)}
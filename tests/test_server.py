@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+from pndconf.server import Server, send_request
+
+
+@pytest.fixture
+def server(tmp_path):
+    started = threading.Event()
+    release = threading.Event()
+    builds = []
+
+    def compile_func(md_file, text=None, filetypes=None):
+        builds.append((md_file, text))
+        started.set()
+        release.wait(5)
+        return [[{"in_file": md_file, "out_file": md_file.replace(".md", ".pdf")}]]
+
+    server = Server(tmp_path.joinpath("pndconf.sock"), compile_func)
+    thread = threading.Thread(target=server.serve, daemon=True)
+    thread.start()
+    server.started_build, server.release, server.builds = started, release, builds
+    yield server
+    release.set()
+    server.shutdown()
+    thread.join(5)
+
+
+def test_server_should_convert_buffer_text(server, tmp_path):
+    server.release.set()
+    md_file = str(tmp_path.joinpath("article.md"))
+    response = send_request(server.socket_path, {"command": "convert", "file": md_file,
+                                                 "text": "# Unsaved"}, timeout=5)
+    assert response["ok"] and response["status"] == "done"
+    assert response["outputs"] == [md_file.replace(".md", ".pdf")]
+    assert server.builds == [(md_file, "# Unsaved")]
+    status = send_request(server.socket_path, {"command": "status"}, timeout=5)
+    assert status["builds"] == 1 and not status["queue"]
+    with pytest.raises(FileExistsError):
+        Server(server.socket_path, lambda *_: [])
+
+
+def test_server_should_supersede_and_cancel_queued_builds(server, tmp_path):
+    files = [str(tmp_path.joinpath(f"{x}.md")) for x in ["a", "b"]]
+
+    def convert(md_file, text):
+        return send_request(server.socket_path, {"command": "convert", "file": md_file,
+                                                 "text": text, "wait": False}, timeout=5)
+    running = convert(files[0], "1")
+    assert server.started_build.wait(5)
+    first = convert(files[1], "1")
+    second = convert(files[1], "2")
+    status = send_request(server.socket_path, {"command": "status"}, timeout=5)
+    assert status["running"]["id"] == running["id"]
+    assert [x["id"] for x in status["queue"]] == [second["id"]]
+    response = send_request(server.socket_path, {"command": "cancel", "id": running["id"]},
+                            timeout=5)
+    assert not response["ok"] and "cannot be cancelled" in response["error"]
+    response = send_request(server.socket_path, {"command": "cancel", "file": files[1]},
+                            timeout=5)
+    assert response["cancelled"] == [second["id"]]
+    assert first["id"] < second["id"]
+    server.release.set()
+    status = send_request(server.socket_path, {"command": "status"}, timeout=5)
+    assert not status["queue"]
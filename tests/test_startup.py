@@ -0,0 +1,12 @@
+import sys
+import subprocess
+
+import pytest
+
+
+@pytest.mark.parametrize("module", ["pndconf.parser", "pndconf.config"])
+def test_import_should_not_load_heavy_dependencies(module):
+    code = (f"import sys, {module}; "
+            "print(*[x for x in ['bibtexparser', 'watchdog', 'chardet'] if x in sys.modules])")
+    output = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True)
+    assert output.stdout.decode().split() == []
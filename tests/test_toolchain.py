@@ -0,0 +1,44 @@
+import pytest
+
+from pndconf import toolchain
+from pndconf.parser import validate_extra_args
+
+
+@pytest.fixture
+def fake_pandoc(tmp_path):
+    log = tmp_path.joinpath("calls.log")
+    pandoc = tmp_path.joinpath("pandoc")
+    pandoc.write_text(f"""#!/bin/sh
+echo "$1" >> {log}
+case "$1" in
+    --version) echo "pandoc 2.19.2";;
+    --help) printf 'pandoc [OPTIONS] [FILES]\\n  -f FORMAT, -r FORMAT  --from=FORMAT\\n'
+            printf '  -s  --standalone\\n  --toc, --table-of-contents\\n  -V KEY[:VALUE]\\n';;
+    --list-extensions) printf '+smart\\n-emoji\\n';;
+    --list-output-formats) printf 'html\\nlatex\\n';;
+esac
+""")
+    pandoc.chmod(0o755)
+    return pandoc, log
+
+
+def test_pandoc_info_should_probe_once_and_cache(fake_pandoc):
+    pandoc, log = fake_pandoc
+    info = toolchain.pandoc_info(pandoc)
+    assert info["version"] == "2.19.2"
+    assert {"from", "standalone", "toc", "table-of-contents", "-s", "-V"} <= set(info["options"])
+    assert info["extensions"] == ["smart", "emoji"]
+    assert info["output_formats"] == ["html", "latex"]
+    calls = log.read_text()
+    assert toolchain.pandoc_info(pandoc) == info
+    assert log.read_text() == calls
+    pandoc.write_text(pandoc.read_text().replace("2.19.2", "3.1.1"))
+    assert toolchain.pandoc_info(pandoc)["version"] == "3.1.1"
+
+
+def test_validate_extra_args_should_reject_unknown_pandoc_options(fake_pandoc):
+    options = toolchain.pandoc_info(fake_pandoc[0])["options"]
+    validate_extra_args(["--toc=true", "-V", "fontsize=12pt", "-s"], options)
+    with pytest.raises(SystemExit):
+        validate_extra_args(["--tableofcontents=true"], options)
+    validate_extra_args(["--tableofcontents=true"])
@@ -0,0 +1,71 @@
+import pytest
+
+from pndconf import transforms
+from pndconf.venues import AhoCorasick, VenueMatcher
+
+
+def test_aho_corasick_should_find_overlapping_patterns():
+    automaton = AhoCorasick(["he", "she", "his", "hers"])
+    assert automaton.findall("ushers") == {"she", "he", "hers"}
+    assert automaton.findall("xyz") == set()
+
+
+@pytest.mark.parametrize("venue, key", [
+    ("CVPR", "cvpr"),
+    ("IEEE/CVF Conference on Computer Vision and Pattern Recognition", "cvpr"),
+    ("International Conference on Computer Vision and Pattern Recognition", "cvpr"),
+    ("Proceedings of the IEEE International Conference on Computer Vision", "iccv"),
+    ("NeurIPS2020", "neurips"),
+    ("Proc. of NIPS'17", "neurips"),
+    ("International Conference on Machine Learning", "icml"),
+    ("Journal of Machine Learning Research", "jmlr"),
+    ("IEEE Transactions on Pattern Analysis and Machine Intelligence", "pami"),
+    ("Quail Biology", None),
+    ("Machine Learning", None)])
+def test_venue_matcher_should_match_known_venues(venue, key):
+    assert transforms.get_venue_matcher().match(venue) == key
+
+
+def test_fix_venue_should_change_type_and_name():
+    ent = {"ENTRYTYPE": "article", "ID": "x", "journal": "{CVPR}"}
+    ent = transforms.standardize_venue(ent)
+    assert ent == {"ENTRYTYPE": "inproceedings", "ID": "x",
+                   "booktitle": transforms.get_venue_matcher().venues["cvpr"]["name"]}
+    ent = transforms.contract_venue({"ENTRYTYPE": "inproceedings", "ID": "y",
+                                     "booktitle": "Int. J. Comput. Vis. (IJCV)"})
+    assert ent == {"ENTRYTYPE": "article", "ID": "y", "journal": "IJCV"}
+
+
+def test_venue_matcher_should_respect_order_and_exclusions():
+    matcher = VenueMatcher({"a": {"all": [["deep", "learning"]], "exclude": ["workshop"]},
+                            "b": {"phrases": ["learning"]},
+                            "c": {"acronyms": ["dlw"], "exclude": ["workshop"]}})
+    assert matcher.match("Deep Learning") == "a"
+    assert matcher.match("Deep Learning Workshop") == "b"
+    assert matcher.match("DLW workshop") == "c"
+
+
+@pytest.fixture
+def ltwa(tmp_path):
+    ltwa_file = tmp_path.joinpath("ltwa.csv")
+    ltwa_file.write_text("WORD;ABBREVIATIONS;LANGUAGES\n"
+                         "academ-;acad.;mul\n"
+                         "academic-;academic.;eng\n"
+                         "vision;vis.;eng\n"
+                         "visionary;n.a.;eng\n"
+                         "-ology;-ol.;eng\n"
+                         "zeitung;ztg.;ger\n")
+    return ltwa_file
+
+
+def test_abbrev_index_should_match_exact_and_longest_prefix(ltwa, cache_home):
+    index = transforms.load_abbrevs(ltwa)
+    assert len(index) == 4
+    assert transforms.get_abbrev(index, "Academy") == "acad."
+    assert transforms.get_abbrev(index, "academics") == "academic."
+    assert transforms.get_abbrev(index, "vision") == "vis."
+    assert transforms.get_abbrev(index, "visions") is None
+    assert transforms.get_abbrev(index, "zeitung") is None
+    assert len([*cache_home.joinpath("pndconf", "abbrevs").iterdir()]) == 1
+    cached = transforms.load_abbrevs(ltwa)
+    assert cached.exact == index.exact and cached.prefixes == index.prefixes
@@ -0,0 +1,51 @@
+import os
+
+from pndconf import util
+
+
+def test_write_if_changed_should_not_touch_unchanged_file(tmp_path):
+    path = tmp_path.joinpath("test.bib")
+    util.build_stats.reset()
+    assert util.write_if_changed(path, "@book{a,}")
+    mtime = path.stat().st_mtime_ns
+    os.utime(path, ns=(mtime - 10**9, mtime - 10**9))
+    assert not util.write_if_changed(path, "@book{a,}")
+    assert path.stat().st_mtime_ns == mtime - 10**9
+    assert util.write_if_changed(path, "@book{b,}")
+    assert path.read_text() == "@book{b,}"
+    assert util.build_stats.unchanged == [str(path)]
+    assert len(util.build_stats.written) == 2
+    assert [x.name for x in tmp_path.iterdir()] == ["test.bib"]
+
+
+def test_read_md_file_with_header_should_stop_at_closing_delimiter(tmp_path, monkeypatch):
+    path = tmp_path.joinpath("doc.md")
+    path.write_text("---\ntitle: Doc\nlist: [1, 2]\n...\n\nBody\n\n---\n\nMore body\n")
+    text, opts = util.read_md_file_with_header(path)
+    assert opts == {"title": "Doc", "list": [1, 2]}
+    assert text == "\n\nBody\n\n---\n\nMore body\n"
+    assert util.read_md_header(path) == "title: Doc\nlist: [1, 2]\n"
+    assert util.parse_md_text_with_header(path.read_text()) == (text, opts)
+    opts["list"].append(3)
+    calls = []
+    monkeypatch.setattr(util.yaml, "load", lambda *args, **kwargs: calls.append(args))
+    path.write_text(path.read_text() + "Edited body\n")
+    text, opts = util.read_md_file_with_header(path)
+    assert opts == {"title": "Doc", "list": [1, 2]} and not calls
+    assert text.endswith("Edited body\n")
+
+
+def test_read_md_file_with_header_without_header_should_keep_all_text(tmp_path):
+    path = tmp_path.joinpath("doc.md")
+    path.write_text("Some text\n\n---\n\nMore text\n")
+    assert util.read_md_file_with_header(path) == (path.read_text(), {})
+    assert util.read_md_header(path) == ""
+
+
+def test_write_if_changed_should_keep_file_mode(tmp_path):
+    path = tmp_path.joinpath("test.bib")
+    assert util.write_if_changed(path, "@book{a,}")
+    assert path.stat().st_mode & 0o777 == 0o666 & ~util.current_umask()
+    path.chmod(0o644)
+    assert util.write_if_changed(path, "@book{b,}")
+    assert path.stat().st_mode & 0o777 == 0o644
@@ -0,0 +1,25 @@
+import pytest
+
+from benchmarks.bench_watch import (WatchDriver, setup_docs, single_save, atomic_save,
+                                    checkout, template_edit, percentile)
+
+
+# NOTE: Generous compared to the benchmark budgets so that a loaded machine
+#       doesn't fail the tests
+budget = 2.0
+
+
+@pytest.mark.parametrize("action", [single_save, atomic_save, checkout(20), template_edit(3)])
+def test_watcher_should_build_each_change_once_within_budget(tmp_path, action):
+    driver = WatchDriver(tmp_path)
+    setup_docs(driver, 2, 3)
+    latencies = []
+    with driver:
+        driver.measure(lambda: {}, 0, 0.5)
+        for i in range(2):
+            result = driver.measure(lambda: action(driver, i), 10, 0.3)
+            assert result["missed"] == [0.0]
+            assert result["duplicates"] == [0.0]
+            latencies.extend(result["latencies"])
+    assert min(latencies) >= 0
+    assert percentile(latencies, 95) < budget